@@ -66,6 +66,8 @@ MIDDLEWARE_CLASSES = (
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'errorreporter.middleware.ReadSnapshotMiddleware',
+    'errorreporter.middleware.RequestStatsMiddleware',
 )
 
 ROOT_URLCONF = 'djangoproject.urls'
@@ -78,11 +80,42 @@ WSGI_APPLICATION = 'djangoproject.wsgi.application'
 
 DATABASES = {
     'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
+        # the SQLite backend, with the queries of requests timed for the stats page
+        'ENGINE': 'errorreporter.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+        # seconds a connection waits for the import to release its write lock
+        'OPTIONS': {'timeout': 30},
     }
 }
 
+# Every SQLite connection runs in WAL mode, so the views keep reading while
+# import_reports writes, see errorreporter.db for the defaults.
+# ERRORREPORTER_SQLITE_PRAGMAS = (('journal_mode', 'wal'), ('synchronous', 'normal'))
+
+# Cache
+# https://docs.djangoproject.com/en/1.6/topics/cache/
+# Cached errorreporter pages are keyed on data generations in the database, so
+# a per-process cache stays correct while import_reports runs separately.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'errorreporter',
+    }
+}
+ERRORREPORTER_CACHE = 'default'
+ERRORREPORTER_CACHE_TIMEOUT = 60 * 60 * 24
+# reports posted to api/report are queued and written in batches of up to
+# ERRORREPORTER_INGEST_BATCH_SIZE reports, at least every FLUSH_INTERVAL seconds
+ERRORREPORTER_INGEST_QUEUE_SIZE = 10000
+ERRORREPORTER_INGEST_BATCH_SIZE = 500
+ERRORREPORTER_INGEST_FLUSH_INTERVAL = 1.0
+# RequestStatsMiddleware keeps the timings of this many requests per process for the stats page
+ERRORREPORTER_STATS_SIZE = 5000
+# the sysinfo values the search page finds stacks by, besides their stack and comments
+# (see errorreporter.search), os.environ ones need ERRORREPORTER_SYSINFO_ENVIRON_KEYS too
+# ERRORREPORTER_SEARCH_SYSINFO_KEYS = ('platform', 'platform.details', 'platform.machine', 'python.version')
+
 # Internationalization
 # https://docs.djangoproject.com/en/1.6/topics/i18n/
 
@@ -101,5 +134,8 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.6/howto/static-files/
 STATIC_ROOT = '/var/www/public_html/static/errorreporter/'
 STATIC_URL = '/static/errorreporter/'
+# Flame graphs are rendered in-process by default ('python'); set to 'perl' to pipe
+# the collapsed stacks through flamegraph.pl in FLAMEGRAPH_PATH instead.
+FLAMEGRAPH_BACKEND = 'python'
 FLAMEGRAPH_PATH = '/var/www/errorreporter/errorreporter/flamegraph/'
 
@@ -1,5 +1,7 @@
 from django.contrib import admin
-from errorreporter.models import CrashReport
+from errorreporter.models import CrashReport, ReportCount, StackSignature
 
 # Register your models here.
-admin.site.register(CrashReport)
\ No newline at end of file
+admin.site.register(CrashReport)
+admin.site.register(StackSignature)
+admin.site.register(ReportCount)
\ No newline at end of file
@@ -0,0 +1,233 @@
+import bisect
+
+from django.db.models import Count, Min, Q, Sum
+from errorreporter.cache import cached_by_generation, date_generation, version_generation
+from errorreporter.models import CrashReport, ReportCount, StackFrame, StackSignature, SysinfoCount, SysinfoValue, \
+    signatures_by_id
+
+
+def count_reports(**filters):
+    """
+    Counts the reports matching filters (e.g. date=... or version=...) per stack, os and machine in a single
+    pass over the report counts. Returns the total and {signature id: count}, {os: count}, {machine: count}.
+    """
+    per_signature = {}
+    per_os = {}
+    per_machine = {}
+    total = 0
+    counts = ReportCount.objects.filter(**filters).values_list('signature', 'os', 'machine', 'count')
+    for signature_id, os, machine, count in counts.iterator():
+        per_signature[signature_id] = per_signature.get(signature_id, 0) + count
+        per_os[os] = per_os.get(os, 0) + count
+        per_machine[machine] = per_machine.get(machine, 0) + count
+        total += count
+    return total, per_signature, per_os, per_machine
+
+
+# how stacks can be grouped: on their normalized fingerprint or their cluster of similar stacks
+GROUPINGS = {'normalized': 'normalized_hash', 'cluster': 'cluster'}
+
+
+def signature_groups(signature_ids, group, chunk_size=500):
+    """
+    Returns the {signature id: group key} of the given signatures for a grouping of GROUPINGS. Signatures
+    that weren't grouped yet (see the group_stacks command) are a group of their own.
+    """
+    signature_ids = list(signature_ids)
+    groups = {}
+    for i in range(0, len(signature_ids), chunk_size):
+        rows = StackSignature.objects.filter(id__in=signature_ids[i:i + chunk_size]).values_list('id', GROUPINGS[group])
+        for signature_id, key in rows:
+            groups[signature_id] = key or signature_id
+    return groups
+
+
+def group_counts(per_signature, group):
+    """
+    Sums the {signature id: count} per group of the given grouping. Returns the {signature id: count} of the
+    stack with the most reports of each group and the {signature id: [signature ids]} of the groups.
+    """
+    groups = signature_groups(per_signature, group)
+    members = {}
+    for signature_id in per_signature:
+        members.setdefault(groups[signature_id], []).append(signature_id)
+    counts = {}
+    grouped = {}
+    for ids in members.itervalues():
+        ids.sort(key=lambda signature_id: (-per_signature[signature_id], signature_id))
+        counts[ids[0]] = sum(per_signature[signature_id] for signature_id in ids)
+        grouped[ids[0]] = ids
+    return counts, grouped
+
+
+def aggregate_reports(**filters):
+    """
+    Builds the summary of the reports matching filters: the total, the number of different stacks, normalized
+    stacks and clusters of similar stacks and the breakdowns per os and machine. The stacks themselves are
+    fetched page by page with aggregate_stacks.
+    """
+    total, per_signature, per_os, per_machine = count_reports(**filters)
+    return {'total': total,
+            'stacks': len(per_signature),
+            'normalized_stacks': len(set(signature_groups(per_signature, 'normalized').itervalues())),
+            'clusters': len(set(signature_groups(per_signature, 'cluster').itervalues())),
+            'os_info': [{'os': os, 'descr': os, 'cnt': per_os[os]} for os in sorted(per_os)],
+            'machine_info': [{'machine': m, 'descr': m, 'cnt': per_machine[m]} for m in sorted(per_machine)]}
+
+
+def filter_generations(filters):
+    """Returns the generation names of the data of the date=... and/or version=... filters.
+    """
+    names = []
+    if 'date' in filters:
+        names.append(date_generation(filters['date']))
+    if 'version' in filters:
+        names.append(version_generation(filters['version']))
+    return names
+
+
+def ordered_stacks(filters, group=None):
+    """
+    Returns the (-count, signature id) of the stacks of the reports matching filters, most reports first, and
+    with a group of GROUPINGS the {signature id: [signature ids]} of the groups, each group counting as its
+    stack with the most reports. This reads every report count of a date or version, so it's cached per data
+    generation of the filters and the pages of aggregate_stacks are slices of it.
+    """
+    def compute():
+        _, per_signature, _, _ = count_reports(**filters)
+        grouped = None
+        if group:
+            per_signature, grouped = group_counts(per_signature, group)
+        return sorted((-cnt, signature_id) for signature_id, cnt in per_signature.iteritems()), grouped
+
+    return cached_by_generation("stacks:%s:%s" % (sorted(filters.items()), group), filter_generations(filters),
+                                compute)
+
+
+def aggregate_stacks(filters, after=None, limit=20, group=None):
+    """
+    Returns a page of the stacks of the reports matching filters, ordered by the number of reports, and the
+    cursor of the next page (None on the last page). after is the (count, signature id) cursor of the
+    previous page. Each stack comes with a representative report id and its compacted comments. With a
+    group of GROUPINGS, each group of stacks counts as one, shown by its stack with the most reports, and
+    'stacks' is the number of stacks in it.
+    """
+    ordered, grouped = ordered_stacks(filters, group)
+    first = bisect.bisect_right(ordered, (-after[0], after[1])) if after else 0
+    page = [(signature_id, -cnt) for cnt, signature_id in ordered[first:first + limit]]
+
+    signatures = signatures_by_id(signature_id for signature_id, _ in page)
+    if grouped:
+        comments = compact_comments(filters, [m for signature_id, _ in page for m in grouped[signature_id]])
+        comments = dict((signature_id, merge_comments(comments, grouped[signature_id])) for signature_id, _ in page)
+    else:
+        comments = compact_comments(filters, [signature_id for signature_id, _ in page])
+
+    crashreports_aggr = []
+    for signature_id, cnt in page:
+        signature = signatures[signature_id]
+        crashreports_aggr.append({'signature': signature_id,
+                                  'cnt': cnt,
+                                  'id': signature.first_report_id,
+                                  'stack': signature.stack,
+                                  'stack_hash': signature.stack_hash,
+                                  'stacks': len(grouped[signature_id]) if grouped else 1,
+                                  'comments': comments.get(signature_id, [])})
+
+    next_cursor = (page[-1][1], page[-1][0]) if len(ordered) > first + limit else None
+    return crashreports_aggr, next_cursor
+
+
+def compact_comments(filters, signature_ids):
+    """
+    Collect the comments for each stack trace in a more compact fashion, i.e.:
+    Stack1 - comment1 - count, first id. This is to prevent hundreds of lines with 'Not provided' in the reports.
+    Stacks are keyed by their signature id, the comments are grouped by the database.
+    """
+    comments = {}
+    for i in range(0, len(signature_ids), 500):
+        rows = CrashReport.objects.filter(signature__in=signature_ids[i:i + 500], **filters) \
+            .values('signature', 'comments')
+        for c in rows.annotate(cnt=Count('id'), first_id=Min('id')).order_by('-cnt'):
+            comments.setdefault(c['signature'], []).append({'comment': c['comments'],
+                                                            'cnt': c['cnt'],
+                                                            'id': c['first_id']})
+    return comments
+
+
+def merge_comments(comments, signature_ids):
+    """
+    Merges the compacted comments of the given stacks of a group, most frequent first.
+    """
+    merged = {}
+    for signature_id in signature_ids:
+        for c in comments.get(signature_id, []):
+            m = merged.get(c['comment'])
+            if m is None:
+                merged[c['comment']] = dict(c)
+            else:
+                m['cnt'] += c['cnt']
+                m['id'] = min(m['id'], c['id'])
+    return sorted(merged.itervalues(), key=lambda c: (-c['cnt'], c['id']))
+
+
+def frame_summary(**frame_filters):
+    """
+    Returns the number of stacks with a frame matching frame_filters (file=... and/or function=...) and
+    their total number of reports, answered from the frame index.
+    """
+    signature_ids = StackFrame.objects.filter(**frame_filters).values('signature')
+    summary = StackSignature.objects.filter(id__in=signature_ids).aggregate(stacks=Count('id'),
+                                                                            total=Sum('total_count'))
+    return {'stacks': summary['stacks'], 'total': summary['total'] or 0}
+
+
+def frame_stacks(frame_filters, after=None, limit=50):
+    """
+    Returns a page of the stacks with a frame matching frame_filters, ordered by their number of reports,
+    and the (count, signature id) cursor of the next page (None on the last page). Each stack comes with
+    its matching frames, first and last date and the versions it was reported for.
+    """
+    signature_ids = StackFrame.objects.filter(**frame_filters).values('signature')
+    objects = StackSignature.objects.filter(id__in=signature_ids)
+    if after:
+        objects = objects.filter(Q(total_count__lt=after[0]) | Q(total_count=after[0], id__gt=after[1]))
+    fields = ('id', 'stack_hash', 'total_count', 'first_seen', 'last_seen', 'first_report_id')
+    page = list(objects.order_by('-total_count', 'id').values(*fields)[:limit + 1])
+    next_cursor = (page[limit - 1]['total_count'], page[limit - 1]['id']) if len(page) > limit else None
+    page = page[:limit]
+
+    ids = [s['id'] for s in page]
+    versions = {}
+    for signature_id, version in ReportCount.objects.filter(signature__in=ids) \
+            .values_list('signature', 'version').distinct():
+        versions.setdefault(signature_id, []).append(version)
+    frames = {}
+    for f in StackFrame.objects.filter(signature__in=ids, **frame_filters).order_by('position') \
+            .values('signature', 'file', 'line', 'function'):
+        frames.setdefault(f.pop('signature'), []).append(f)
+
+    for s in page:
+        s['versions'] = sorted(versions.get(s['id'], []))
+        s['frames'] = frames.get(s['id'], [])
+    return page, next_cursor
+
+
+def sysinfo_keys():
+    """Returns the sysinfo keys that reports can be broken down by, sorted.
+    """
+    return list(SysinfoValue.objects.values_list('key', flat=True).distinct().order_by('key'))
+
+
+def sysinfo_breakdown(key, after=None, limit=None, **filters):
+    """
+    Returns the number of reports matching filters per value of the given sysinfo key, ordered by value,
+    from the sysinfo counts. A report with several values for a key (e.g. sys.path) counts for each.
+    """
+    objects = SysinfoCount.objects.filter(value__key=key, **filters)
+    if after is not None:
+        objects = objects.filter(value__value__gt=after)
+    objects = objects.values('value__value').annotate(cnt=Sum('count')).order_by('value__value')
+    if limit:
+        objects = objects[:limit]
+    return [{'value': s['value__value'], 'descr': s['value__value'], 'cnt': s['cnt']} for s in objects]
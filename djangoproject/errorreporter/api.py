@@ -0,0 +1,349 @@
+import datetime
+import json
+import threading
+import time
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Sum
+from django.http import Http404, HttpResponse, HttpResponseBadRequest
+from django.utils import timezone
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from errorreporter.aggregation import GROUPINGS, aggregate_stacks, count_reports, frame_stacks, sysinfo_breakdown
+from errorreporter.cache import GENERATION_ALL, cache_by_generation, date_generation, version_generation
+from errorreporter.ingest import get_report_queue
+from errorreporter.models import CrashReport, ReportCount, StackSignature, signatures_by_id
+from errorreporter.search import search_stacks
+from errorreporter.trends import latest_date, new_stacks, trending
+from errorreporter.timeseries import DEFAULT_MAX_POINTS, GRANULARITIES, bucket_starts, clamp_start, \
+    pick_granularity, stack_series
+
+DEFAULT_LIMIT = 50
+MAX_LIMIT = 500
+DEFAULT_TOP = 5
+MAX_TOP = 20
+MAX_POINTS = 1000
+
+_arrival_lock = threading.Lock()
+_last_arrival = [0.0]
+
+
+def scope_filters(scope, value):
+    """Returns the queryset filters for a date or version, raises Http404 on an invalid date.
+    """
+    if scope == "date":
+        try:
+            datetime.datetime.strptime(value, "%Y-%m-%d")
+        except ValueError:
+            raise Http404
+        return {'date': value}
+    return {'version': value}
+
+
+def scope_generations(scope, value, **kwargs):
+    if scope == "date":
+        return [date_generation(value)]
+    return [version_generation(value)]
+
+
+def frame_filters(request):
+    """Returns the frame index filters for the ?file= and ?function= parameters, raises Http404 if neither is given.
+    """
+    filters = dict((key, request.GET[key]) for key in ('file', 'function') if request.GET.get(key))
+    if not filters:
+        raise Http404
+    return filters
+
+
+def get_cursor(request):
+    """Returns the (count, signature id) cursor of ?after=<count>:<signature id>, raises Http404 on a bad cursor.
+    """
+    if not request.GET.get('after'):
+        return None
+    try:
+        cnt, signature_id = request.GET['after'].split(":")
+        return int(cnt), int(signature_id)
+    except ValueError:
+        raise Http404
+
+
+def get_group(request):
+    """Returns the grouping of ?group= (normalized or cluster), None if not given, raises Http404 on an unknown one.
+    """
+    group = request.GET.get('group') or None
+    if group is not None and group not in GROUPINGS:
+        raise Http404
+    return group
+
+
+def get_limit(request):
+    try:
+        limit = int(request.GET.get('limit', DEFAULT_LIMIT))
+    except ValueError:
+        limit = DEFAULT_LIMIT
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def get_int(request, name, default, maximum):
+    try:
+        value = int(request.GET.get(name, default))
+    except ValueError:
+        value = default
+    return max(1, min(value, maximum))
+
+
+def series_range(request, first_seen, last_seen):
+    """Returns the (start, end, granularity) of a time series for the ?start= and ?end=
+       (YYYY-MM-DD, default: first_seen and last_seen), ?granularity= (day, week or month,
+       default: the finest that fits) and ?points= parameters. The granularity is coarsened
+       until the range has at most ?points= buckets, beyond that the range is shortened
+       to its last ?points= months. Raises Http404 on an invalid date or granularity.
+    """
+    try:
+        start = datetime.datetime.strptime(request.GET['start'], "%Y-%m-%d").date() \
+            if request.GET.get('start') else first_seen
+        end = datetime.datetime.strptime(request.GET['end'], "%Y-%m-%d").date() \
+            if request.GET.get('end') else last_seen
+    except ValueError:
+        raise Http404
+    granularity = request.GET.get('granularity') or None
+    if granularity is not None and granularity not in GRANULARITIES:
+        raise Http404
+    if start is None or end is None or start > end:
+        return None, None, granularity or GRANULARITIES[0]
+
+    max_points = get_int(request, 'points', DEFAULT_MAX_POINTS, MAX_POINTS)
+    granularity = pick_granularity(start, end, granularity, max_points)
+    return clamp_start(start, end, granularity, max_points), end, granularity
+
+
+def series_response(signatures, start, end, granularity, counts=None):
+    """Returns the time series of the given StackSignatures as JSON: the bucket starts and per
+       stack its fingerprint, a representative report id, the number of reports per bucket and
+       their total, and its number of reports in counts, a {signature id: count} dict, if given.
+    """
+    series = stack_series([signature.id for signature in signatures], start, end, granularity) if start else {}
+    results = []
+    for signature in signatures:
+        points = series.get(signature.id, [])
+        result = {'stack_hash': signature.stack_hash, 'id': signature.first_report_id,
+                  'counts': points, 'total': sum(points)}
+        if counts is not None:
+            result['count'] = counts[signature.id]
+        results.append(result)
+    data = {'granularity': granularity, 'start': start, 'end': end,
+            'buckets': bucket_starts(start, end, granularity) if start else [], 'results': results}
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), content_type='application/json')
+
+
+def trend_fields(trend):
+    signature = trend.signature
+    lines = signature.stack.strip().splitlines()
+    return {'stack_hash': signature.stack_hash, 'id': signature.first_report_id,
+            'exception': lines[-1] if lines else "",
+            'first_seen': signature.first_seen, 'first_version': trend.first_version, 'total': signature.total_count,
+            'last_date': trend.last_date, 'count': trend.last_count, 'mean': trend.mean, 'score': trend.score}
+
+
+def trends(request):
+    """Returns the stacks that spiked on ?date= (YYYY-MM-DD, default: the last day with reports)
+       and the stacks that are new on that date, or new in ?version= if given. Raises Http404 on
+       an invalid date.
+    """
+    try:
+        date = datetime.datetime.strptime(request.GET['date'], "%Y-%m-%d").date() \
+            if request.GET.get('date') else latest_date()
+    except ValueError:
+        raise Http404
+    version = request.GET.get('version') or None
+    limit = get_limit(request)
+    return {'date': date, 'version': version,
+            'trending': [trend_fields(t) for t in trending(date, limit)] if date else [],
+            'new': [trend_fields(t) for t in new_stacks(limit, version=version)] if version else
+                   [trend_fields(t) for t in new_stacks(limit, date=date)] if date else []}
+
+
+def json_response(results, next_cursor):
+    data = {'results': results, 'next': next_cursor}
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), content_type='application/json')
+
+
+@cache_by_generation(scope_generations)
+def reports(request, scope, value):
+    """
+    The reports of a date or version, optionally of a single stack (?stack=<fingerprint>) or, with ?group=
+    (normalized or cluster), of the stacks grouped with it. Ordered by id. Keyset paginated: pass the 'next'
+    value of a page as ?after= to get the next one.
+    """
+    objects = CrashReport.objects.filter(**scope_filters(scope, value))
+    group = get_group(request)
+    if request.GET.get('stack'):
+        key = None
+        if group:
+            key = StackSignature.objects.filter(stack_hash=request.GET['stack']) \
+                .values_list(GROUPINGS[group], flat=True).first()
+        if key:
+            objects = objects.filter(**{'signature__' + GROUPINGS[group]: key})
+        else:
+            objects = objects.filter(signature__stack_hash=request.GET['stack'])
+    try:
+        after = int(request.GET.get('after', 0))
+    except ValueError:
+        after = 0
+    limit = get_limit(request)
+
+    fields = ('id', 'timestamp', 'date', 'version', 'os', 'machine', 'comments', 'signature__stack_hash')
+    results = list(objects.filter(id__gt=after).order_by('id').values(*fields)[:limit + 1])
+    for r in results:
+        r['stack_hash'] = r.pop('signature__stack_hash')
+    next_cursor = results[limit - 1]['id'] if len(results) > limit else None
+    return json_response(results[:limit], next_cursor)
+
+
+@cache_by_generation(scope_generations)
+def stacks(request, scope, value):
+    """
+    The stacks of a date or version with their number of reports and compacted comments, most frequent
+    first. With ?group=normalized, stacks that only differ in paths, line numbers and ids count as one, with
+    ?group=cluster all similar stacks do. Keyset paginated on (count, signature id): pass the 'next' value
+    of a page as ?after=.
+    """
+    results, next_cursor = aggregate_stacks(scope_filters(scope, value), get_cursor(request), get_limit(request),
+                                            get_group(request))
+    return json_response(results, "%d:%d" % next_cursor if next_cursor else None)
+
+
+@cache_by_generation(lambda stack_hash: [GENERATION_ALL])
+def occurrences(request, stack_hash):
+    """
+    The number of reports of a stack over time, from the per day, week and month stack counts.
+    Takes ?start=, ?end= (YYYY-MM-DD, default: when the stack was first and last seen), ?granularity=
+    (day, week or month) and ?points= (default: 400), the maximum number of buckets: a range with more
+    buckets is served at the next coarser granularity. Week and month buckets always count whole weeks
+    and months, 'buckets' has their first days.
+    """
+    signature = StackSignature.objects.filter(stack_hash=stack_hash) \
+        .only('id', 'stack_hash', 'first_report_id', 'first_seen', 'last_seen').first()
+    if signature is None:
+        raise Http404
+    start, end, granularity = series_range(request, signature.first_seen, signature.last_seen)
+    return series_response([signature], start, end, granularity)
+
+
+@cache_by_generation(lambda scope, value: [GENERATION_ALL])
+def top_occurrences(request, scope, value):
+    """
+    The number of reports over time of the ?top= (default: 5) stacks with the most reports of a date
+    or version, most frequent first, to compare them in one chart. Each stack comes with its number of
+    reports of the date or version as 'count', its series counts reports of all versions. Takes the
+    ?start=, ?end=, ?granularity= and ?points= parameters of the stack series.
+    """
+    _, per_signature, _, _ = count_reports(**scope_filters(scope, value))
+    top = sorted(per_signature.iteritems(), key=lambda s: (-s[1], s[0]))[:get_int(request, 'top', DEFAULT_TOP, MAX_TOP)]
+    signatures = signatures_by_id(signature_id for signature_id, _ in top)
+    signatures = [signatures[signature_id] for signature_id, _ in top]
+    start, end, granularity = series_range(request,
+                                           min(s.first_seen for s in signatures) if signatures else None,
+                                           max(s.last_seen for s in signatures) if signatures else None)
+    return series_response(signatures, start, end, granularity, counts=dict(top))
+
+
+@cache_by_generation(lambda: [GENERATION_ALL])
+def trend_feed(request):
+    """
+    The stacks with an unusual number of reports on a day ('trending', highest score first) and the
+    stacks first reported on that day or, with ?version=, from that version ('new', most reports first).
+    Takes ?date= (YYYY-MM-DD, default: the last day with reports), ?version= and ?limit=. The score of
+    a stack is the number of standard deviations its count of the day is above its moving average. Only
+    the last day a stack was reported has a score, an earlier ?date= misses the stacks reported since.
+    """
+    data = trends(request)
+    return HttpResponse(json.dumps(data, cls=DjangoJSONEncoder), content_type='application/json')
+
+
+@cache_by_generation(scope_generations)
+def breakdown(request, scope, value, key):
+    """
+    The number of reports of a date or version per os or machine, ordered by name.
+    Keyset paginated: pass the 'next' value of a page as ?after=.
+    """
+    objects = ReportCount.objects.filter(**scope_filters(scope, value))
+    if 'after' in request.GET:
+        objects = objects.filter(**{key + '__gt': request.GET['after']})
+    limit = get_limit(request)
+
+    results = list(objects.values(key).annotate(cnt=Sum('count')).order_by(key)[:limit + 1])
+    next_cursor = results[limit - 1][key] if len(results) > limit else None
+    return json_response(results[:limit], next_cursor)
+
+
+@cache_by_generation(lambda: [GENERATION_ALL])
+def frames(request):
+    """
+    The stacks that pass through a file and/or function (?file=, ?function=), with their number of reports,
+    matching frames, first and last date and versions, most frequent first. Keyset paginated on
+    (count, signature id): pass the 'next' value of a page as ?after=.
+    """
+    results, next_cursor = frame_stacks(frame_filters(request), get_cursor(request), get_limit(request))
+    return json_response(results, "%d:%d" % next_cursor if next_cursor else None)
+
+
+@cache_by_generation(lambda: [GENERATION_ALL])
+def search(request):
+    """
+    The stacks matching the search query ?q=, best match first. Every term has to occur in the stack, a
+    comment or an indexed sysinfo value of one of its reports, "quoted words" match as a phrase and a
+    term ending in * as a prefix. Each stack comes with its number of reports, first and last date,
+    score and the matching comments and sysinfo values with their number of reports. Takes ?limit=.
+    """
+    return json_response(search_stacks(request.GET.get('q', ""), get_limit(request)), None)
+
+
+def arrival_timestamp():
+    """Returns the time of arrival of a report without a timestamp, with microseconds, as a string:
+       timestamps identify reports, so each call returns a later one than the last.
+    """
+    with _arrival_lock:
+        _last_arrival[0] = max(time.time(), _last_arrival[0] + 0.000001)
+        return u"%.6f" % _last_arrival[0]
+
+
+@csrf_exempt
+@require_POST
+def report(request):
+    """
+    Accepts a crash report posted by a client, with the fields of an archived report: stack, sysinfo,
+    comments and optionally timestamp (defaults to the time of arrival). The report is queued and written
+    in a batch with other reports, it answers 503 when the queue is full.
+    """
+    if request.POST.get('timestamp'):
+        # timestamps identify reports, keep the client's as it is rather than the precision of a float
+        timestamp = request.POST['timestamp']
+        try:
+            float(timestamp)
+        except ValueError:
+            return HttpResponseBadRequest("Invalid timestamp")
+    else:
+        timestamp = arrival_timestamp()
+    report = {u'timestamp': timestamp,
+              u'stack': request.POST.get('stack'),
+              u'sysinfo': request.POST.get('sysinfo'),
+              u'comments': request.POST.get('comments')}
+
+    if not get_report_queue().put(report, timezone.now().strftime("%Y-%m-%d")):
+        response = HttpResponse("Too many reports, try again later", status=503)
+        response['Retry-After'] = 10
+        return response
+    return HttpResponse(json.dumps({'queued': True}), content_type='application/json', status=202)
+
+
+@cache_by_generation(scope_generations)
+def sysinfo(request, scope, value, key):
+    """
+    The number of reports of a date or version per value of a sysinfo key, ordered by value.
+    Keyset paginated: pass the 'next' value of a page as ?after=.
+    """
+    limit = get_limit(request)
+    results = sysinfo_breakdown(key, request.GET.get('after'), limit + 1, **scope_filters(scope, value))
+    next_cursor = results[limit - 1]['value'] if len(results) > limit else None
+    return json_response(results[:limit], next_cursor)
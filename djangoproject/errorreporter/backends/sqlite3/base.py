@@ -0,0 +1,8 @@
+"""The SQLite backend with its queries timed for RequestStatsMiddleware.
+"""
+from django.db.backends.sqlite3 import base
+from errorreporter.middleware import TimedDatabaseWrapperMixin
+
+
+class DatabaseWrapper(TimedDatabaseWrapperMixin, base.DatabaseWrapper):
+    pass
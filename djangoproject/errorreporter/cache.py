@@ -0,0 +1,87 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import get_cache
+from django.db.models import F
+from django.utils.encoding import force_bytes
+from errorreporter.models import DataGeneration
+
+GENERATION_ALL = "all"
+
+
+def date_generation(date):
+    return "date:%s" % date
+
+
+def version_generation(version):
+    return "version:%s" % version
+
+
+def get_generations(names):
+    """Returns the current generation of each of the given names, 0 if it was never bumped.
+    """
+    generations = dict(DataGeneration.objects.filter(name__in=names).values_list('name', 'generation'))
+    return [generations.get(name, 0) for name in names]
+
+
+def bump_generations(names):
+    """Invalidates the cached pages of the given names. Run this in the transaction
+       that changes their data, so readers never cache new data under an old generation.
+    """
+    names = set(names)
+    existing = set(DataGeneration.objects.filter(name__in=names).values_list('name', flat=True))
+    DataGeneration.objects.filter(name__in=existing).update(generation=F('generation') + 1)
+    DataGeneration.objects.bulk_create([DataGeneration(name=name, generation=1) for name in names - existing])
+
+
+def get_generation_cache():
+    return get_cache(getattr(settings, 'ERRORREPORTER_CACHE', 'default'))
+
+
+def cache_timeout():
+    return getattr(settings, 'ERRORREPORTER_CACHE_TIMEOUT', 60 * 60 * 24)
+
+
+def generation_key(prefix, names):
+    return "errorreporter:%s:%s" % (prefix, ".".join(str(g) for g in get_generations(names)))
+
+
+def cached_by_generation(name, names, compute):
+    """Returns what compute() returns, cached under name and the current generations of the
+       given generation names, in the cache of the cached pages.
+    """
+    cache = get_generation_cache()
+    key = generation_key(hashlib.md5(force_bytes(name)).hexdigest(), names)
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value, cache_timeout())
+    return value
+
+
+def cache_by_generation(generations_for):
+    """
+    Caches the responses of a view under its path and the current generations of the data it shows.
+    generations_for gets the arguments of the view and returns the generation names, the importer
+    bumps those when it adds reports so a cached page is never stale. Uses the ERRORREPORTER_CACHE
+    cache (default: 'default') for ERRORREPORTER_CACHE_TIMEOUT seconds (default: a day).
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            path_hash = hashlib.md5(force_bytes(request.get_full_path())).hexdigest()
+            key = generation_key("%s:%s" % (view.__name__, path_hash), generations_for(*args, **kwargs))
+            cache = get_generation_cache()
+            response = cache.get(key)
+            if response is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code == 200:
+                    if getattr(response, 'is_rendered', True):
+                        cache.set(key, response, cache_timeout())
+                    else:
+                        # a TemplateResponse can only be pickled once it is rendered
+                        response.add_post_render_callback(lambda r: cache.set(key, r, cache_timeout()))
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,117 @@
+"""Clusters similar stacks as their signatures are created. The MinHash bands of all
+stacks are stored in the StackBand index: a new stack is only compared with the earlier
+stacks it shares a band with, at most MAX_CANDIDATES of them, so clustering costs a few
+index lookups per new stack however many stacks there are. Stacks with an estimated
+similarity of SIMILARITY and up end up in the same cluster, also through other stacks.
+"""
+from errorreporter.cache import bump_generations, date_generation, version_generation
+from errorreporter.db import update_rows
+from errorreporter.grouping import band_keys, minhash, pack_minhash, similarity, stack_tokens, unpack_minhash
+from errorreporter.models import ReportCount, StackBand, StackMinHash, StackSignature
+
+SIMILARITY = 0.6
+# compare a new stack with at most this many of the stacks it shares a band with
+MAX_CANDIDATES = 50
+
+
+def top_candidates(keys, by_band):
+    """Returns the MAX_CANDIDATES stacks in the {band key: [signature id]} index that share
+       the most of the given band keys.
+    """
+    shared = {}
+    for key in keys:
+        for candidate in by_band.get(key, ()):
+            shared[candidate] = shared.get(candidate, 0) + 1
+    return sorted(shared, key=lambda c: (-shared[c], c))[:MAX_CANDIDATES]
+
+
+class Clusters(object):
+    """Union-find over cluster ids, the smallest (oldest) signature id represents a cluster.
+    """
+    def __init__(self):
+        super(Clusters, self).__init__()
+        self.parent = {}
+
+    def find(self, cluster):
+        root = cluster
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while cluster != root:
+            cluster, self.parent[cluster] = self.parent[cluster], root
+        return root
+
+    def union(self, a, b):
+        a, b = self.find(a), self.find(b)
+        if a != b:
+            self.parent[max(a, b)] = min(a, b)
+
+
+def bump_cluster_generations(clusters, chunk_size=500):
+    """Invalidates the cached pages of every date and version with reports of the stacks in the
+       given clusters, after clusters were merged into them: their stacks group differently there.
+    """
+    signature_ids = list(StackSignature.objects.filter(cluster__in=clusters).values_list('id', flat=True))
+    scopes = set()
+    for i in range(0, len(signature_ids), chunk_size):
+        scopes.update(ReportCount.objects.filter(signature__in=signature_ids[i:i + chunk_size])
+                      .values_list('date', 'version').distinct())
+    bump_generations([date_generation(date) for date, _ in scopes] +
+                     [version_generation(version) for _, version in scopes])
+
+
+def cluster_signatures(stacks, chunk_size=500):
+    """Adds the StackSignatures of the given {signature id: stack} dict, which are not in a
+       cluster yet, to the cluster of the most similar earlier stacks or to a new cluster of
+       their own. Clusters that turn out to be similar through a new stack are merged.
+       Returns the {signature id: cluster} of the given signatures.
+    """
+    hashes = dict((signature_id, minhash(stack_tokens(stack))) for signature_id, stack in stacks.iteritems())
+    bands = dict((signature_id, band_keys(values)) for signature_id, values in hashes.iteritems())
+
+    # the earlier stacks per band, the band index doesn't have the given stacks yet
+    by_band = {}
+    keys = list(set(key for keys in bands.itervalues() for key in keys))
+    for i in range(0, len(keys), chunk_size):
+        for key, signature_id in StackBand.objects.filter(band__in=keys[i:i + chunk_size]) \
+                .values_list('band', 'signature'):
+            by_band.setdefault(key, []).append(signature_id)
+
+    candidates = dict((signature_id, top_candidates(keys, by_band)) for signature_id, keys in bands.iteritems())
+    earlier = list(set(c for cs in candidates.itervalues() for c in cs))
+    clusters = {}
+    for i in range(0, len(earlier), chunk_size):
+        chunk = earlier[i:i + chunk_size]
+        for signature_id, data in StackMinHash.objects.filter(signature__in=chunk).values_list('signature', 'data'):
+            hashes[signature_id] = unpack_minhash(data)
+        for signature_id, cluster in StackSignature.objects.filter(id__in=chunk).values_list('id', 'cluster'):
+            if signature_id in hashes:
+                clusters[signature_id] = cluster or signature_id
+
+    found = Clusters()
+    batch_by_band = {}
+    for signature_id in sorted(stacks):
+        clusters[signature_id] = signature_id
+        # the earlier stacks of this batch are candidates too
+        for candidate in candidates[signature_id] + top_candidates(bands[signature_id], batch_by_band):
+            if candidate in clusters and similarity(hashes[signature_id], hashes[candidate]) >= SIMILARITY:
+                found.union(signature_id, clusters[candidate])
+        for key in bands[signature_id]:
+            batch_by_band.setdefault(key, []).append(signature_id)
+
+    StackMinHash.objects.bulk_create([StackMinHash(signature_id=signature_id, data=pack_minhash(hashes[signature_id]))
+                                      for signature_id in stacks])
+    StackBand.objects.bulk_create([StackBand(band=key, signature_id=signature_id)
+                                   for signature_id, keys in bands.iteritems() for key in keys])
+
+    # earlier clusters merged through a new stack join the oldest one
+    merged = set()
+    for cluster in set(clusters[c] for c in earlier):
+        if found.find(cluster) != cluster:
+            StackSignature.objects.filter(cluster=cluster).update(cluster=found.find(cluster))
+            merged.add(found.find(cluster))
+    if merged:
+        bump_cluster_generations(merged)
+    assigned = dict((signature_id, found.find(signature_id)) for signature_id in stacks)
+    update_rows(StackSignature, ('cluster',), [StackSignature(id=signature_id, cluster=cluster)
+                                              for signature_id, cluster in assigned.iteritems()])
+    return assigned
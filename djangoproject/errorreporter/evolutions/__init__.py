@@ -0,0 +1,7 @@
+SEQUENCE = [
+    'crashreport_stack_hash',
+    'stack_signature',
+    'stack_signature_collapsed',
+    'crashreport_sysinfo',
+    'stack_signature_grouping',
+]
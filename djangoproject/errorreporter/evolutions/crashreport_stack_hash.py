@@ -0,0 +1,16 @@
+from django.db import models
+from django_evolution.mutations import AddField, ChangeField, SQLMutation
+
+
+# existing rows get their fingerprint from `manage.py backfill_stack_hashes`
+MUTATIONS = [
+    ChangeField('CrashReport', 'stack', initial=None, db_index=False),
+    AddField('CrashReport', 'stack_hash', models.CharField, initial='', max_length=40, db_index=True),
+    # on SQLite AddField rebuilds the table without its other indexes, restore them
+    SQLMutation('crashreport_restore_indexes', [
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_f516c2b3" ON "errorreporter_crashreport" ("version");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_eeede814" ON "errorreporter_crashreport" ("date");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_9a7d6350" ON "errorreporter_crashreport" ("os");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_dbaea34e" ON "errorreporter_crashreport" ("machine");',
+    ], lambda app_label, proj_sig: None),
+]
@@ -0,0 +1,26 @@
+from django_evolution.mutations import DeleteField, SQLMutation
+
+
+# Moves the sysinfo out of the report rows into ReportSysinfo. `manage.py syncdb`
+# creates the ReportSysinfo table before this runs, the copied sysinfo is stored
+# uncompressed until `manage.py compress_sysinfo` compresses it.
+MUTATIONS = [
+    SQLMutation('crashreport_copy_sysinfo', [
+        'INSERT INTO "errorreporter_reportsysinfo" ("report_id", "data", "compressed") '
+        'SELECT "id", CAST("sysinfo" AS BLOB), 0 FROM "errorreporter_crashreport";',
+    ], lambda app_label, proj_sig: None),
+    DeleteField('CrashReport', 'sysinfo'),
+    # on SQLite the table is rebuilt without its indexes, restore them
+    SQLMutation('crashreport_restore_sysinfo_indexes', [
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_6d57d69a" '
+        'ON "errorreporter_crashreport" ("signature_id");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_f516c2b3" '
+        'ON "errorreporter_crashreport" ("version");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_eeede814" '
+        'ON "errorreporter_crashreport" ("date");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_9a7d6350" '
+        'ON "errorreporter_crashreport" ("os");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_dbaea34e" '
+        'ON "errorreporter_crashreport" ("machine");',
+    ], lambda app_label, proj_sig: None),
+]
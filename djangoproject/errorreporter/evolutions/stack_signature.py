@@ -0,0 +1,33 @@
+from django.db import models
+from django_evolution.mutations import AddField, DeleteField, SQLMutation
+
+
+# Moves the stacks into one StackSignature per distinct stack. `manage.py syncdb`
+# creates the StackSignature table before this runs, the stack hashes of the
+# converted signatures are filled in by `manage.py backfill_stack_hashes`.
+MUTATIONS = [
+    AddField('CrashReport', 'signature', models.ForeignKey, null=True,
+             related_model='errorreporter.StackSignature'),
+    SQLMutation('crashreport_convert_signatures', [
+        'INSERT INTO "errorreporter_stacksignature" '
+        '("stack", "first_seen", "last_seen", "total_count", "first_report_id") '
+        'SELECT "stack", MIN("date"), MAX("date"), COUNT(*), MIN("id") '
+        'FROM "errorreporter_crashreport" GROUP BY "stack";',
+        # temporary index on the (small) signature table so every report is matched with a lookup
+        'CREATE INDEX "errorreporter_stacksignature_convert" ON "errorreporter_stacksignature" ("stack");',
+        'UPDATE "errorreporter_crashreport" SET "signature_id" = (SELECT s."id" FROM "errorreporter_stacksignature" s '
+        'WHERE s."stack" = "errorreporter_crashreport"."stack");',
+        'DROP INDEX "errorreporter_stacksignature_convert";',
+    ], lambda app_label, proj_sig: None),
+    DeleteField('CrashReport', 'stack'),
+    DeleteField('CrashReport', 'stack_hash'),
+    # on SQLite the table is rebuilt without its indexes, restore them
+    SQLMutation('crashreport_restore_signature_indexes', [
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_6d57d69a" '
+        'ON "errorreporter_crashreport" ("signature_id");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_f516c2b3" ON "errorreporter_crashreport" ("version");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_eeede814" ON "errorreporter_crashreport" ("date");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_9a7d6350" ON "errorreporter_crashreport" ("os");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_crashreport_dbaea34e" ON "errorreporter_crashreport" ("machine");',
+    ], lambda app_label, proj_sig: None),
+]
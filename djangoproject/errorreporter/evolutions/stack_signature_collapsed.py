@@ -0,0 +1,8 @@
+from django.db import models
+from django_evolution.mutations import AddField
+
+
+# existing signatures are collapsed the first time a flame graph needs them
+MUTATIONS = [
+    AddField('StackSignature', 'collapsed', models.TextField, null=True),
+]
@@ -0,0 +1,16 @@
+from django.db import models
+from django_evolution.mutations import AddField, SQLMutation
+
+
+# existing signatures are normalized and clustered by `manage.py group_stacks`
+MUTATIONS = [
+    AddField('StackSignature', 'normalized_hash', models.CharField, max_length=40, null=True, db_index=True),
+    AddField('StackSignature', 'cluster', models.IntegerField, null=True, db_index=True),
+    # on SQLite the table is rebuilt for each field, without the index of the first one
+    SQLMutation('stack_signature_restore_grouping_indexes', [
+        'CREATE INDEX IF NOT EXISTS "errorreporter_stacksignature_0edd04e8" '
+        'ON "errorreporter_stacksignature" ("normalized_hash");',
+        'CREATE INDEX IF NOT EXISTS "errorreporter_stacksignature_c0ef31f3" '
+        'ON "errorreporter_stacksignature" ("cluster");',
+    ], lambda app_label, proj_sig: None),
+]
@@ -0,0 +1,167 @@
+"""Collapses stack traces into "file:function" frames and renders collapsed stack counts
+into an interactive SVG flame graph.
+
+This follows the layout of Brendan Gregg's flamegraph.pl, so the generated graphs
+look the same as before, but runs in-process instead of spawning a Perl pipeline
+per graph.
+"""
+import hashlib
+import re
+
+from django.utils.encoding import force_bytes
+from django.utils.html import escape, escapejs
+
+IMAGE_WIDTH = 1200
+FRAME_HEIGHT = 16
+FONT_TYPE = "Verdana"
+FONT_SIZE = 12
+FONT_WIDTH = 0.59
+MIN_WIDTH = 0.1
+XPAD = 10
+YPAD_TOP = FONT_SIZE * 4
+YPAD_BOTTOM = FONT_SIZE * 2 + 10
+
+# a frame line of a Python traceback, the stack used to be split on newlines and ';'
+FRAME_RE = re.compile(r'File "([^\n;]*)", line ([^\n;]*), in ([^\n;]*)')
+
+SVG_HEADER = u"""<?xml version="1.0" standalone="no"?>
+<!DOCTYPE svg PUBLIC "-//W3C//DTD SVG 1.1//EN" "http://www.w3.org/Graphics/SVG/1.1/DTD/svg11.dtd">
+<svg version="1.1" width="%(width)d" height="%(height)d" onload="init(evt)" viewBox="0 0 %(width)d %(height)d" xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink">
+<defs>
+	<linearGradient id="background" y1="0" y2="1" x1="0" x2="0">
+		<stop stop-color="#eeeeee" offset="5%%" />
+		<stop stop-color="#eeeeb0" offset="95%%" />
+	</linearGradient>
+</defs>
+<style type="text/css">
+	.func_g:hover { stroke:black; stroke-width:0.5; }
+</style>
+<script type="text/ecmascript">
+<![CDATA[
+	var details;
+	function init(evt) { details = document.getElementById("details").firstChild; }
+	function s(info) { details.nodeValue = "Function: " + info; }
+	function c() { details.nodeValue = ' '; }
+]]>
+</script>
+<rect x="0.0" y="0" width="%(width)d" height="%(height)d" fill="url(#background)" />
+<text text-anchor="middle" x="%(center).2f" y="%(title_y)d" font-size="17" font-family="%(font)s" fill="rgb(0,0,0)">%(title)s</text>
+<text text-anchor="left" x="%(xpad)d" y="%(details_y)d" font-size="%(font_size)d" font-family="%(font)s" fill="rgb(0,0,0)" id="details"> </text>
+"""
+
+SVG_FRAME = u"""<g class="func_g" onmouseover="s('%(js_info)s')" onmouseout="c()">
+<title>%(info)s</title><rect x="%(x).1f" y="%(y).1f" width="%(w).1f" height="%(h).1f" fill="rgb(%(r)d,%(g)d,%(b)d)" rx="2" ry="2" />
+<text text-anchor="" x="%(text_x).2f" y="%(text_y).2f" font-size="%(font_size)d" font-family="%(font)s" fill="rgb(0,0,0)">%(text)s</text>
+</g>
+"""
+
+
+def parse_frames(stack):
+    """Returns the (file, line, function) frames of the given stack trace, outermost first.
+    """
+    return FRAME_RE.findall(stack)
+
+
+def collapse_stack(stack):
+    """Returns the "file:function" frames of the given stack trace, outermost first and
+       separated by ';', as expected by flamegraph.pl.
+    """
+    return u";".join(u"%s:%s" % (stack_file, function) for stack_file, _, function in parse_frames(stack))
+
+
+class FrameInterner(object):
+    """Splits collapsed stacks into tuples of frames that share one string object per
+       distinct frame, so the frames of many stacks cost memory only once.
+    """
+    def __init__(self):
+        super(FrameInterner, self).__init__()
+        self._frames = {}
+
+    def split(self, collapsed):
+        frames = self._frames
+        return tuple(frames.setdefault(frame, frame) for frame in collapsed.split(u";")) if collapsed else ()
+
+
+def _merge(counts):
+    """Folds (frames, count) pairs into a tree of {name: [count, children]}.
+    """
+    root = {}
+    total = 0
+    for frames, count in counts:
+        if count <= 0:
+            continue
+        total += count
+        children = root
+        for name in frames:
+            node = children.get(name)
+            if node is None:
+                node = children[name] = [0, {}]
+            node[0] += count
+            children = node[1]
+    return total, root
+
+
+def _layout(children, start, depth, frames):
+    """Appends (name, depth, start, count) for each frame, children sorted by name like flamegraph.pl.
+    Returns the maximum depth below this level.
+    """
+    max_depth = depth
+    for name in sorted(children):
+        count, grandchildren = children[name]
+        frames.append((name, depth, start, count))
+        max_depth = max(max_depth, _layout(grandchildren, start, depth + 1, frames))
+        start += count
+    return max_depth
+
+
+def _color(name):
+    """Returns a warm color derived from the frame name, so a function keeps its color across graphs.
+    """
+    digest = hashlib.md5(force_bytes(name)).digest()
+    v1, v2, v3 = [ord(ch) / 255.0 for ch in digest[:3]]
+    return 205 + int(50 * v3), int(230 * v1), int(55 * v2)
+
+
+def render_svg(counts, title=u"Flame Graph"):
+    """Returns the SVG document for the given iterable of (frames, count) pairs.
+    """
+    total, root = _merge(counts)
+    frames = [(u"all", 0, 0, total)]
+    depth = _layout(root, 0, 1, frames) if total else 0
+
+    height = (depth + 1) * FRAME_HEIGHT + YPAD_TOP + YPAD_BOTTOM
+    parts = [SVG_HEADER % {'width': IMAGE_WIDTH, 'height': height, 'center': IMAGE_WIDTH / 2.0,
+                           'title_y': FONT_SIZE * 2, 'details_y': height - YPAD_BOTTOM / 2,
+                           'title': escape(title), 'xpad': XPAD, 'font': FONT_TYPE, 'font_size': FONT_SIZE}]
+    if not total:
+        parts.append(u'<text text-anchor="middle" x="%.2f" y="%d" font-size="%d" font-family="%s" '
+                     u'fill="rgb(0,0,0)">No stack counts found</text>\n'
+                     % (IMAGE_WIDTH / 2.0, height / 2, FONT_SIZE, FONT_TYPE))
+        parts.append(u"</svg>\n")
+        return u"".join(parts)
+
+    width_per_sample = float(IMAGE_WIDTH - 2 * XPAD) / total
+    max_chars_per_pixel = 1.0 / (FONT_SIZE * FONT_WIDTH)
+    for name, frame_depth, start, count in frames:
+        w = count * width_per_sample
+        if w < MIN_WIDTH:
+            continue
+        x = XPAD + start * width_per_sample
+        y = height - YPAD_BOTTOM - (frame_depth + 1) * FRAME_HEIGHT
+        info = u"%s (%d samples, %.2f%%)" % (name, count, 100.0 * count / total)
+
+        chars = int(w * max_chars_per_pixel)
+        if chars < 3:
+            text = u""
+        elif len(name) > chars:
+            text = name[:chars - 2] + u".."
+        else:
+            text = name
+        r, g, b = _color(name)
+        # escapejs leaves no quotes or markup, so the handler gets the name as it is
+        parts.append(SVG_FRAME % {'info': escape(info), 'js_info': escapejs(info), 'x': x, 'y': y,
+                                  'w': w, 'h': FRAME_HEIGHT - 1, 'r': r, 'g': g, 'b': b,
+                                  'text_x': x + 3, 'text_y': y + 10.5, 'text': escape(text),
+                                  'font_size': FONT_SIZE, 'font': FONT_TYPE})
+    parts.append(u"</svg>\n")
+    return u"".join(parts)
@@ -0,0 +1,126 @@
+"""Finds stacks that are the same bug. normalize_stack drops what differs between
+installs and builds of the same crash: the install path of files, line numbers,
+source lines and ids, addresses and numbers in the exception message. Stacks with the
+same normalized text share a normalized_hash.
+
+For near duplicates each stack gets a MinHash of its frames, frame pairs and exception,
+its values estimate the similarity (Jaccard index) of the features of two stacks. The
+values are hashed in BANDS bands of ROWS values, stacks with a similarity of about 0.6
+and up share a band with high probability, see errorreporter.clustering.
+"""
+import hashlib
+import re
+import struct
+import zlib
+
+from django.utils.encoding import force_bytes
+from errorreporter.flamegraph import parse_frames
+
+# file paths keep this many trailing components, below any site-packages or stdlib dir
+PATH_DEPTH = 3
+# builds ship .py, .pyc or .pyo files
+PATH_EXTENSION_RE = re.compile(r'\.py[co]$', re.IGNORECASE)
+PATH_ROOT_RE = re.compile(r'^.*/(?:site-packages|dist-packages|lib/python[\d.]*|python\d+/lib|[^/]*\.(?:zip|egg|exe))/',
+                          re.IGNORECASE)
+VOLATILE_RES = [
+    # file paths with at least two directories
+    (re.compile(r'(?:[A-Za-z]:)?(?:[\\/][^\s\'"\\/:,()]+){2,}[\\/]?'), u"<path>"),
+    (re.compile(r'\b[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\b'), u"<uuid>"),
+    (re.compile(r'\b0x[0-9a-fA-F]+\b'), u"<addr>"),
+    # hashes, e.g. infohashes and permids
+    (re.compile(r'\b[0-9a-fA-F]{16,}\b'), u"<hex>"),
+    (re.compile(r'\d+'), u"<n>"),
+]
+
+NUM_PERMUTATIONS = 32
+BANDS = 8
+ROWS = NUM_PERMUTATIONS // BANDS
+
+MERSENNE_PRIME = (1 << 61) - 1
+# (a, b) of the hash functions (a * x + b) % MERSENNE_PRIME, derived from md5 so stored
+# MinHashes stay comparable whatever the Python version
+PERMUTATIONS = [(int(hashlib.md5("a%d" % i).hexdigest(), 16) % (MERSENNE_PRIME - 1) + 1,
+                 int(hashlib.md5("b%d" % i).hexdigest(), 16) % MERSENNE_PRIME) for i in range(NUM_PERMUTATIONS)]
+
+
+def normalize_path(path):
+    """Returns the last PATH_DEPTH components of a file path, lowercase and ending in .py,
+       relative to site-packages or the stdlib if it's in there.
+    """
+    path = PATH_EXTENSION_RE.sub(u".py", PATH_ROOT_RE.sub(u"", path.replace(u"\\", u"/")))
+    return u"/".join([part for part in path.split(u"/") if part][-PATH_DEPTH:]).lower()
+
+
+def normalize_message(message):
+    for regex, replacement in VOLATILE_RES:
+        message = regex.sub(replacement, message)
+    return message.strip()
+
+
+def exception_line(stack):
+    """Returns the last line of a stack that is not a frame or a source line, u"" if there is none.
+    """
+    for line in reversed(stack.splitlines()):
+        if line.strip():
+            return u"" if line[:1].isspace() else line
+    return u""
+
+
+def normalized_frames(stack):
+    return [u"%s:%s" % (normalize_path(stack_file), function.strip())
+            for stack_file, _, function in parse_frames(stack)]
+
+
+def normalize_stack(stack):
+    """Returns the "file:function" frames of a stack with normalized paths, followed by its
+       exception with the volatile parts of the message replaced, one per line.
+    """
+    stack = stack or u""
+    return u"\n".join(normalized_frames(stack) + [normalize_message(exception_line(stack))])
+
+
+def normalized_fingerprint(stack):
+    return hashlib.sha1(force_bytes(normalize_stack(stack))).hexdigest()
+
+
+def stack_tokens(stack):
+    """Returns the features MinHash compares stacks on: the normalized frames, pairs of
+       consecutive frames, the exception and its type.
+    """
+    stack = stack or u""
+    frames = normalized_frames(stack)
+    exception = normalize_message(exception_line(stack))
+    tokens = set(frames)
+    tokens.update(u"%s>%s" % pair for pair in zip(frames, frames[1:]))
+    tokens.add(u"!" + exception)
+    tokens.add(u"!!" + exception.split(u":", 1)[0])
+    return tokens
+
+
+def minhash(tokens):
+    """Returns the NUM_PERMUTATIONS 32 bit MinHash values of a set of strings.
+    """
+    hashes = [zlib.crc32(force_bytes(token)) & 0xffffffff for token in tokens] or [0]
+    return [min((a * h + b) % MERSENNE_PRIME for h in hashes) & 0xffffffff for a, b in PERMUTATIONS]
+
+
+def pack_minhash(values):
+    return struct.pack("<%dI" % NUM_PERMUTATIONS, *values)
+
+
+def unpack_minhash(data):
+    return list(struct.unpack("<%dI" % NUM_PERMUTATIONS, bytes(data)))
+
+
+def band_keys(values):
+    """Returns a 60 bit key per band of ROWS MinHash values, stacks share a key if all the
+       values of the band are equal.
+    """
+    return [int(hashlib.md5(struct.pack("<%dI" % (ROWS + 1), band, *values[band * ROWS:(band + 1) * ROWS]))
+                .hexdigest()[:15], 16) for band in range(BANDS)]
+
+
+def similarity(a, b):
+    """Returns the estimated Jaccard similarity of the token sets of two MinHashes.
+    """
+    return sum(1 for x, y in zip(a, b) if x == y) / float(NUM_PERMUTATIONS)
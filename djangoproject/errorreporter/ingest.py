@@ -0,0 +1,120 @@
+"""Queue between the report POST endpoint and the database: reports are written
+by a background thread in batches, flushed when a batch is full or a flush
+interval has passed, so a burst of reports costs one transaction per batch
+instead of one per request. A batch that can't be written is retried until it
+is, while new reports fill the queue and are refused once it is full.
+"""
+import atexit
+import logging
+import Queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+from errorreporter.management.commands.import_reports import ExceptionLogParser
+
+logger = logging.getLogger(__name__)
+
+_report_queue = None
+_report_queue_lock = threading.Lock()
+
+# seconds before a failed batch is written again, doubled after every failure
+RETRY_DELAY = 1.0
+MAX_RETRY_DELAY = 60.0
+
+
+class ReportQueue(object):
+    def __init__(self, max_size, batch_size, flush_interval, retry_delay=RETRY_DELAY):
+        super(ReportQueue, self).__init__()
+        self._queue = Queue.Queue(max_size)
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._retry_delay = retry_delay
+        self._stopping = threading.Event()
+        self._parser = ExceptionLogParser()
+        self._thread = threading.Thread(target=self._run, name="ReportQueue")
+        self._thread.daemon = True
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def put(self, report, date):
+        """Queues a report dict with the fields of an archived report (timestamp, stack,
+           sysinfo, comments) received on the given date. Returns False if the queue is full.
+        """
+        try:
+            self._queue.put_nowait(self._parser.report_fields(report, date))
+        except Queue.Full:
+            return False
+        return True
+
+    def stop(self, timeout=10):
+        """Writes the queued reports and stops the writer thread. A batch that still fails
+           is tried once more and then given up.
+        """
+        self._stopping.set()
+        try:
+            self._queue.put(None, timeout=timeout)
+        except Queue.Full:
+            return
+        self._thread.join(timeout)
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            row = self._queue.get()
+            if row is None:
+                break
+            rows = [row]
+            deadline = time.time() + self._flush_interval
+            while len(rows) < self._batch_size:
+                try:
+                    row = self._queue.get(timeout=max(0, deadline - time.time()))
+                except Queue.Empty:
+                    break
+                if row is None:
+                    stopping = True
+                    break
+                rows.append(row)
+            self._write_retrying(rows)
+        connection.close()
+
+    def _write_retrying(self, rows):
+        # the reports were accepted, so keep them until they are written. Meanwhile the queue
+        # fills up and refuses new reports.
+        delay = self._retry_delay
+        attempt = 1
+        while not self._write(rows):
+            if self._stopping.is_set() and attempt > 1:
+                logger.error(u"Gave up writing %d queued reports while stopping", len(rows))
+                return
+            self._stopping.wait(delay)
+            delay = min(2 * delay, MAX_RETRY_DELAY)
+            attempt += 1
+
+    def _write(self, rows):
+        """Writes a batch, returns whether it succeeded.
+        """
+        # a concurrent import may insert the same reports, a retry skips those
+        try:
+            self._parser.insert_rows(rows, self._batch_size)
+        except Exception:
+            logger.exception(u"Failed to write %d queued reports", len(rows))
+            # reconnect for the next attempt
+            connection.close()
+            return False
+        return True
+
+
+def get_report_queue():
+    """Returns the queue of this process, configured by ERRORREPORTER_INGEST_QUEUE_SIZE
+       (default: 10000 reports), ERRORREPORTER_INGEST_BATCH_SIZE (default: 500 reports)
+       and ERRORREPORTER_INGEST_FLUSH_INTERVAL (default: 1 second).
+    """
+    global _report_queue
+    with _report_queue_lock:
+        if _report_queue is None:
+            _report_queue = ReportQueue(getattr(settings, 'ERRORREPORTER_INGEST_QUEUE_SIZE', 10000),
+                                        getattr(settings, 'ERRORREPORTER_INGEST_BATCH_SIZE', 500),
+                                        getattr(settings, 'ERRORREPORTER_INGEST_FLUSH_INTERVAL', 1.0))
+    return _report_queue
@@ -0,0 +1,111 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.cache import GENERATION_ALL, bump_generations, date_generation, version_generation
+from errorreporter.clustering import bump_cluster_generations
+from errorreporter.db import increment_counts
+from errorreporter.models import CrashReport, ReportCount, SearchDocument, StackCount, StackSignature, \
+    StackTrend, stack_fingerprint
+from errorreporter.search import document_key
+from errorreporter.trends import add_reports, first_versions, new_trend
+from django.db import transaction
+from django.db.models import F, Min
+
+
+def move_counts(model, fields, source_id, target_id, chunk_size=500):
+    """Moves the rollup rows of one signature to another, adding the count of a row to the
+       row of the other signature with the same values of the given fields, if there is one.
+    """
+    existing = dict((row[1:], row[0]) for row in model.objects.filter(signature=target_id)
+                    .values_list('id', *fields).iterator())
+    increments = {}
+    moved = []
+    for row in model.objects.filter(signature=source_id).values_list('id', 'count', *fields).iterator():
+        target_row = existing.get(row[2:])
+        if target_row is None:
+            moved.append(row[0])
+        else:
+            increments[target_row] = row[1]
+    increment_counts(model, increments)
+    for i in range(0, len(moved), chunk_size):
+        model.objects.filter(id__in=moved[i:i + chunk_size]).update(signature=target_id)
+
+
+def move_search_documents(source_id, target_id):
+    """Moves the comment and sysinfo documents of one signature to another, the stack
+       document of the other signature already has the same text.
+    """
+    for document in SearchDocument.objects.filter(signature=source_id).exclude(field='stack'):
+        key = document_key(target_id, document.field, document.text)
+        if SearchDocument.objects.filter(key=key).update(count=F('count') + document.count):
+            document.delete()
+        else:
+            SearchDocument.objects.filter(id=document.id).update(signature=target_id, key=key)
+
+
+def rebuild_trend(signature_id):
+    """Recomputes the StackTrend of a signature from its per day stack counts, like
+       rebuild_stack_trends does for all of them.
+    """
+    StackTrend.objects.filter(signature=signature_id).delete()
+    first_version = first_versions([signature_id]).get(signature_id, "")
+    trend = None
+    for date, count in StackCount.objects.filter(signature=signature_id, granularity='day').order_by('start') \
+            .values_list('start', 'count'):
+        if trend is None:
+            trend = new_trend(signature_id, date, first_version)
+        add_reports(trend, date, count)
+    if trend is not None:
+        trend.save()
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Compute the fingerprint of stack signatures converted from an old database."
+
+    def handle(self, *app_labels, **options):
+        updated = 0
+        merged = 0
+        for signature in StackSignature.objects.filter(stack_hash=None).iterator():
+            stack_hash = stack_fingerprint(signature.stack)
+            with transaction.atomic():
+                existing = StackSignature.objects.filter(stack_hash=stack_hash).first()
+                if existing:
+                    # the importer created a signature for this stack before the backfill ran
+                    self.merge(signature, existing)
+                    merged += 1
+                else:
+                    StackSignature.objects.filter(id=signature.id).update(stack_hash=stack_hash)
+                    updated += 1
+
+        print "Updated %d signatures, merged %d duplicates" % (updated, merged)
+
+    def merge(self, signature, existing):
+        """Moves the reports and rollups of a signature to an existing signature of the same
+           stack and deletes it. The frames, MinHash and bands of the stack are already indexed
+           for the existing signature, the duplicate ones go with the deleted signature.
+        """
+        scopes = set(ReportCount.objects.filter(signature=signature).values_list('date', 'version'))
+        CrashReport.objects.filter(signature=signature).update(signature=existing)
+        move_counts(ReportCount, ('date', 'version', 'os', 'machine'), signature.id, existing.id)
+        move_counts(StackCount, ('granularity', 'start'), signature.id, existing.id)
+        move_search_documents(signature.id, existing.id)
+        rebuild_trend(existing.id)
+
+        # converted signatures may not know their first report, look it up among the merged reports
+        first_report_id = CrashReport.objects.filter(signature=existing).aggregate(Min('id'))['id__min']
+        StackSignature.objects.filter(id=existing.id).update(
+            total_count=F('total_count') + signature.total_count,
+            first_seen=min(existing.first_seen, signature.first_seen),
+            last_seen=max(existing.last_seen, signature.last_seen),
+            first_report_id=first_report_id)
+        # the same stack belongs in one cluster, the oldest one represents it
+        clusters = set(c for c in (existing.cluster, signature.cluster) if c is not None)
+        if len(clusters) > 1:
+            StackSignature.objects.filter(cluster__in=clusters).update(cluster=min(clusters))
+            bump_cluster_generations([min(clusters)])
+        signature.delete()
+
+        bump_generations([GENERATION_ALL] + [date_generation(date) for date, _ in scopes] +
+                         [version_generation(version) for _, version in scopes])
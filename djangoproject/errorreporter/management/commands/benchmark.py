@@ -0,0 +1,314 @@
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import urllib
+from optparse import make_option
+
+import django
+from django.conf import settings
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand, CommandError
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.db.models import Sum
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+
+from errorreporter.management.commands import import_reports
+from errorreporter.management.commands.import_reports import DEFAULT_BATCH_SIZE, FlameGraphCreator
+from errorreporter.models import CrashReport, ReportCount, StackFrame, StackSignature
+from errorreporter.stats import PERCENTILES, percentile
+from errorreporter.synthetic import write_archives
+
+DEFAULT_SIZES = "10000,100000,1000000"
+
+
+def median(values):
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+class Discard(object):
+    """Swallows the progress the import prints, so it doesn't end up in the timings or the JSON.
+    """
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Time importing synthetic archives, rendering their flame graphs and the main views " \
+           "at a number of report counts, and write the timings as JSON. Runs on a scratch database."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sizes', action='store', dest='sizes', default=DEFAULT_SIZES,
+                    help='Comma separated report counts to benchmark (default: %s)' % DEFAULT_SIZES),
+        make_option('--days', action='store', type='int', dest='days', default=10,
+                    help='Number of daily archives the reports are spread over (default: 10)'),
+        make_option('--stacks', action='store', type='int', dest='stacks', default=1000,
+                    help='Number of distinct stacks (default: 1000)'),
+        make_option('--sysinfo-size', action='store', type='int', dest='sysinfo-size', default=2500,
+                    help='Approximate size of the sysinfo of a report in characters (default: 2500)'),
+        make_option('--seed', action='store', type='int', dest='seed', default=0,
+                    help='Seed of the archive generator (default: 0)'),
+        make_option('--workers', action='store', type='int', dest='workers', default=1,
+                    help='Number of processes parsing archives during the import (default: 1)'),
+        make_option('--batch-size', action='store', type='int', dest='batch-size', default=DEFAULT_BATCH_SIZE,
+                    help='Number of reports per batch during the import (default: %d)' % DEFAULT_BATCH_SIZE),
+        make_option('--repeat', action='store', type='int', dest='repeat', default=5,
+                    help='Number of requests per view (default: 5)'),
+        make_option('--concurrent', action='store_true', dest='concurrent', default=False,
+                    help='Import the second half of the archives while requesting the views, and compare '
+                         'their latency to the latency without an import running'),
+        make_option('--work-dir', action='store', dest='work-dir', default="",
+                    help='Directory for the archives and the scratch database, generated archives '
+                         'are reused by later runs (default: a temporary directory)'),
+        make_option('--output', action='store', dest='output', default="",
+                    help='File to write the JSON results to (default: standard output)'),
+    )
+
+    def handle(self, *app_labels, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(",")]
+        except ValueError:
+            raise CommandError("sizes must be comma separated numbers.")
+        if min(sizes) < 1 or options['days'] < 1 or options['stacks'] < 1 or options['repeat'] < 1:
+            raise CommandError("sizes, days, stacks and repeat must be positive.")
+        if options['concurrent'] and options['days'] < 2:
+            raise CommandError("concurrent needs at least 2 days of archives.")
+
+        work_dir = options['work-dir'] or tempfile.mkdtemp(prefix="errorreporter-benchmark-")
+        if not os.path.isdir(work_dir):
+            raise CommandError("work-dir doesn't exist or is not a dir.")
+
+        setup_test_environment()
+        results = {
+            'started': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%SZ"),
+            'environment': {'python': platform.python_version(), 'django': django.get_version(),
+                            'database': connection.vendor, 'cpus': multiprocessing.cpu_count(),
+                            'flamegraph_backend': getattr(settings, 'FLAMEGRAPH_BACKEND', 'python')},
+            'options': dict((key, options[key]) for key in ('days', 'stacks', 'sysinfo-size', 'seed', 'workers',
+                                                            'batch-size', 'repeat', 'concurrent')),
+            'runs': [],
+        }
+        for size in sizes:
+            self.stderr.write("Benchmarking %d reports..." % size)
+            results['runs'].append(self.run(size, work_dir, options))
+
+        output = json.dumps(results, indent=2, sort_keys=True)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output + "\n")
+        else:
+            self.stdout.write(output)
+
+    def archives(self, size, work_dir, options):
+        """Returns the directory with the archives of a run and the seconds it took to
+           write them, None if they were written by an earlier run.
+        """
+        archive_dir = os.path.join(work_dir, "archives-%d-%d-%d-%d-%d" % (
+            size, options['days'], options['stacks'], options['sysinfo-size'], options['seed']))
+        done = os.path.join(archive_dir, ".done")
+        if os.path.isfile(done):
+            return archive_dir, None
+        if os.path.isdir(archive_dir):
+            shutil.rmtree(archive_dir)
+        os.mkdir(archive_dir)
+        start = time.time()
+        write_archives(archive_dir, size, options['days'], stacks=options['stacks'],
+                       sysinfo_size=options['sysinfo-size'], seed=options['seed'])
+        elapsed = time.time() - start
+        open(done, 'w').close()
+        return archive_dir, elapsed
+
+    def run(self, size, work_dir, options):
+        archive_dir, generate_time = self.archives(size, work_dir, options)
+        input_dir = os.path.join(work_dir, "input")
+        concurrent_dir = os.path.join(work_dir, "input-concurrent")
+        output_dir = os.path.join(work_dir, "flamegraphs")
+        for path in (input_dir, concurrent_dir, output_dir):
+            if os.path.isdir(path):
+                shutil.rmtree(path)
+            os.mkdir(path)
+        # the importer moves the archives it imported, give it links to them. With
+        # concurrent, the later half is imported while the views are requested.
+        names = sorted(name for name in os.listdir(archive_dir) if name.startswith("exception"))
+        split = (len(names) + 1) // 2 if options['concurrent'] else len(names)
+        for i, name in enumerate(names):
+            os.link(os.path.join(archive_dir, name), os.path.join(input_dir if i < split else concurrent_dir, name))
+
+        # never touch the configured database: import into a scratch database file
+        connection.settings_dict['TEST_NAME'] = os.path.join(work_dir, "benchmark.db") \
+            if connection.vendor == 'sqlite' else None
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            result = {'reports': size, 'generate_seconds': generate_time}
+            result['import'] = self.time_import(input_dir, output_dir, options)
+            result['flamegraphs'] = self.time_flamegraphs(output_dir)
+            result['views'] = self.time_views(options['repeat'])
+            if options['concurrent']:
+                result['concurrent'] = self.time_concurrent(concurrent_dir, output_dir, options)
+            result['database'] = {'reports': CrashReport.objects.count(),
+                                  'stacks': StackSignature.objects.count(),
+                                  'frames': StackFrame.objects.count(),
+                                  'report_counts': ReportCount.objects.count()}
+            if connection.vendor == 'sqlite':
+                result['database']['bytes'] = os.path.getsize(connection.settings_dict['NAME'])
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+        return result
+
+    def import_archives(self, input_dir, output_dir, options):
+        command = import_reports.Command()
+        stdout, sys.stdout = sys.stdout, Discard()
+        try:
+            command.importReports(input_dir, output_dir, bulk=True, batch_size=options['batch-size'],
+                                  workers=options['workers'])
+        finally:
+            sys.stdout = stdout
+
+    def time_import(self, input_dir, output_dir, options):
+        start = time.time()
+        self.import_archives(input_dir, output_dir, options)
+        elapsed = time.time() - start
+        reports = CrashReport.objects.count()
+        return {'seconds': elapsed, 'reports_per_second': reports / elapsed if elapsed else None}
+
+    def time_flamegraphs(self, output_dir):
+        result = {}
+        for fg_type in ("date", "version"):
+            start = time.time()
+            count = FlameGraphCreator().create(output_dir, fg_type, rebuild_all=True)
+            result[fg_type] = {'seconds': time.time() - start, 'graphs': count}
+        return result
+
+    def view_urls(self):
+        """Returns the (name, url) of the views to time, on the busiest date, version and stack.
+        """
+        busiest = lambda field: ReportCount.objects.values(field).annotate(n=Sum('count')).order_by('-n')[0][field]
+        date = busiest('date').strftime("%Y-%m-%d")
+        version = busiest('version')
+        signature = StackSignature.objects.get(id=busiest('signature'))
+        frame = StackFrame.objects.filter(signature=signature).order_by('position')[0]
+        report_id = signature.first_report_id or CrashReport.objects.filter(signature=signature)[0].id
+        # the exception type, e.g. KeyError
+        search_term = signature.stack.strip().splitlines()[-1].split(":", 1)[0]
+        return [
+            ('overview_daily', reverse('overview_daily')),
+            ('overview_version', reverse('overview_version')),
+            ('crashreport_daily', reverse('crashreport_daily', kwargs={'date': date})),
+            ('crashreport_version', reverse('crashreport_version', kwargs={'version': version})),
+            ('stacktrace', reverse('stacktrace', kwargs={'stack_id': report_id})),
+            ('stacktrace_graphs', reverse('stacktrace_graphs', kwargs={'stack_id': report_id})),
+            ('stack_graphs', reverse('stack_graphs', kwargs={'stack_hash': signature.stack_hash})),
+            ('frames', reverse('frames') + "?" + urllib.urlencode({'function': frame.function})),
+            ('sysinfo', reverse('sysinfo', kwargs={'scope': 'date', 'value': date, 'key': 'platform.details'})),
+            ('api_reports', reverse('api_reports', kwargs={'scope': 'date', 'value': date})),
+            ('api_stacks', reverse('api_stacks', kwargs={'scope': 'version', 'value': version})),
+            ('api_stacks_cluster',
+             reverse('api_stacks', kwargs={'scope': 'version', 'value': version}) + "?group=cluster"),
+            ('api_breakdown', reverse('api_breakdown', kwargs={'scope': 'date', 'value': date, 'key': 'os'})),
+            ('api_frames', reverse('api_frames') + "?" + urllib.urlencode({'file': frame.file})),
+            ('api_occurrences', reverse('api_occurrences', kwargs={'stack_hash': signature.stack_hash})),
+            ('api_top_occurrences', reverse('api_top_occurrences', kwargs={'scope': 'version', 'value': version})),
+            ('trending', reverse('trending')),
+            ('api_trending', reverse('api_trending') + "?" + urllib.urlencode({'version': version})),
+            ('search', reverse('search') + "?" + urllib.urlencode({'q': search_term})),
+            ('api_search', reverse('api_search') + "?" + urllib.urlencode({'q': search_term[:4] + '*'})),
+        ]
+
+    def time_views(self, repeat):
+        """Times each view uncached, with the page cache cleared before every request,
+           and cached. Reports the median and best time in milliseconds.
+        """
+        client = Client()
+        cache = get_cache(getattr(settings, 'ERRORREPORTER_CACHE', 'default'))
+        return dict((name, self.time_view(client, cache, url, repeat)) for name, url in self.view_urls())
+
+    def time_view(self, client, cache, url, repeat):
+        uncached = []
+        for _ in range(repeat):
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                start = time.time()
+                response = client.get(url)
+                uncached.append((time.time() - start) * 1000)
+            # the next request resets the logged queries
+            query_count = len(queries)
+        cached = []
+        for _ in range(repeat):
+            start = time.time()
+            client.get(url)
+            cached.append((time.time() - start) * 1000)
+        return {'url': url, 'status': response.status_code, 'bytes': len(response.content),
+                'queries': query_count, 'uncached_ms': median(uncached), 'uncached_best_ms': min(uncached),
+                'cached_ms': median(cached), 'cached_best_ms': min(cached)}
+
+    def time_concurrent(self, input_dir, output_dir, options):
+        """Requests the views uncached in turn, first for repeat rounds without an import
+           running and then for as long as a separate process imports the archives in
+           input_dir. Reports the latency percentiles in milliseconds and the failed
+           requests of both phases.
+        """
+        client = Client()
+        cache = get_cache(getattr(settings, 'ERRORREPORTER_CACHE', 'default'))
+        urls = [url for _, url in self.view_urls()]
+        result = {'journal_mode': None}
+        if connection.vendor == 'sqlite':
+            cursor = connection.cursor()
+            cursor.execute("PRAGMA journal_mode")
+            result['journal_mode'] = cursor.fetchone()[0]
+
+        idle = []
+        for _ in range(options['repeat']):
+            idle.extend(self.request_views(client, cache, urls))
+
+        reports = CrashReport.objects.count()
+        # the import process must not share the connection of this one
+        connection.close()
+        importer = multiprocessing.Process(target=self.import_archives, args=(input_dir, output_dir, options))
+        start = time.time()
+        importer.start()
+        importing = []
+        while importer.is_alive():
+            importing.extend(self.request_views(client, cache, urls, stop=lambda: not importer.is_alive()))
+        importer.join()
+        elapsed = time.time() - start
+
+        result['import'] = {'seconds': elapsed, 'exitcode': importer.exitcode,
+                            'reports': CrashReport.objects.count() - reports}
+        for phase, requests in (('idle', idle), ('importing', importing)):
+            latencies = sorted(ms for ms, status in requests)
+            result[phase] = dict(("p%d_ms" % p, percentile(latencies, p)) for p in PERCENTILES)
+            result[phase].update(requests=len(requests), max_ms=latencies[-1] if latencies else None,
+                                 errors=sum(1 for ms, status in requests if status != 200))
+        return result
+
+    def request_views(self, client, cache, urls, stop=lambda: False):
+        """Requests every url once with the page cache cleared, unless stop() becomes true.
+           Returns a list of (milliseconds, status) tuples, status None if it raised.
+        """
+        requests = []
+        for url in urls:
+            if stop():
+                break
+            cache.clear()
+            start = time.time()
+            try:
+                status = client.get(url).status_code
+            except Exception:
+                status = None
+            requests.append(((time.time() - start) * 1000, status))
+        return requests
@@ -0,0 +1,37 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from errorreporter.models import ReportSysinfo
+from errorreporter.sysinfo import compress_sysinfo, decompress_sysinfo
+from django.db import connection, transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Compress the sysinfo copied from an old database."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch_size', default=1000,
+                    help='number of reports compressed per transaction'),
+        make_option('--vacuum', action='store_true', dest='vacuum', default=False,
+                    help='give the freed space back to the file system afterwards (SQLite only)'),
+    )
+
+    def handle(self, *app_labels, **options):
+        compressed = 0
+        while True:
+            with transaction.atomic():
+                batch = list(ReportSysinfo.objects.filter(compressed=False)[:options['batch_size']])
+                for sysinfo in batch:
+                    ReportSysinfo.objects.filter(report_id=sysinfo.report_id).update(
+                        data=compress_sysinfo(decompress_sysinfo(sysinfo.data, compressed=False)), compressed=True)
+            if not batch:
+                break
+            compressed += len(batch)
+
+        if options['vacuum'] and connection.vendor == 'sqlite':
+            connection.cursor().execute("VACUUM")
+
+        print "Compressed the sysinfo of %d reports" % compressed
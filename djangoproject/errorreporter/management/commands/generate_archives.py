@@ -0,0 +1,44 @@
+import datetime
+import os
+from optparse import make_option
+from django.core.management.base import BaseCommand, CommandError
+
+from errorreporter.synthetic import write_archives
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Write synthetic exception-YYYYMMDD.bz2 archives for benchmarks and load tests."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--output-dir', action='store', dest='output-dir', default="",
+                    help='Directory to write the archives to'),
+        make_option('--reports', action='store', type='int', dest='reports', default=10000,
+                    help='Number of reports (default: 10000)'),
+        make_option('--days', action='store', type='int', dest='days', default=1,
+                    help='Number of daily archives the reports are spread over (default: 1)'),
+        make_option('--start-date', action='store', dest='start-date', default="2014-01-01",
+                    help='Date of the first archive (default: 2014-01-01)'),
+        make_option('--stacks', action='store', type='int', dest='stacks', default=1000,
+                    help='Number of distinct stacks (default: 1000)'),
+        make_option('--sysinfo-size', action='store', type='int', dest='sysinfo-size', default=2500,
+                    help='Approximate size of the sysinfo of a report in characters (default: 2500)'),
+        make_option('--seed', action='store', type='int', dest='seed', default=0,
+                    help='Seed of the random generator, the same seed writes the same archives'),
+    )
+
+    def handle(self, *app_labels, **options):
+        if not os.path.isdir(options['output-dir']):
+            raise CommandError("output-dir doesn't exist or is not a dir.")
+        if options['reports'] < 0 or options['days'] < 1 or options['stacks'] < 1:
+            raise CommandError("reports, days and stacks must be positive.")
+        try:
+            start_date = datetime.datetime.strptime(options['start-date'], "%Y-%m-%d").date()
+        except ValueError:
+            raise CommandError("start-date must be YYYY-MM-DD.")
+
+        paths = write_archives(options['output-dir'], options['reports'], options['days'], start_date,
+                               stacks=options['stacks'], sysinfo_size=options['sysinfo-size'], seed=options['seed'])
+        print "Wrote %d reports to %d archives in %s" % (options['reports'], len(paths), options['output-dir'])
@@ -0,0 +1,52 @@
+from optparse import make_option
+from django.core.management.base import BaseCommand
+
+from errorreporter.clustering import cluster_signatures
+from errorreporter.db import update_rows
+from errorreporter.grouping import normalized_fingerprint
+from errorreporter.models import StackSignature
+from django.db import transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Compute the normalized fingerprint and the cluster of similar stacks of the signatures " \
+           "that don't have them yet, e.g. after upgrading an old database."
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', action='store', type='int', dest='batch-size', default=500,
+                    help='Number of signatures per transaction (default: 500)'),
+    )
+
+    def handle(self, *app_labels, **options):
+        normalized = 0
+        last_id = 0
+        while True:
+            batch = list(StackSignature.objects.filter(normalized_hash=None, id__gt=last_id).order_by('id')
+                         .only('id', 'stack')[:options['batch-size']])
+            if not batch:
+                break
+            for signature in batch:
+                signature.normalized_hash = normalized_fingerprint(signature.stack)
+            with transaction.atomic():
+                update_rows(StackSignature, ('normalized_hash',), batch)
+            normalized += len(batch)
+            last_id = batch[-1].id
+
+        # oldest first, like the importer would have created them
+        clustered = 0
+        last_id = 0
+        while True:
+            batch = list(StackSignature.objects.filter(cluster=None, id__gt=last_id).order_by('id')
+                         .values_list('id', 'stack')[:options['batch-size']])
+            if not batch:
+                break
+            with transaction.atomic():
+                cluster_signatures(dict(batch))
+            clustered += len(batch)
+            last_id = batch[-1][0]
+
+        clusters = StackSignature.objects.values('cluster').distinct().count()
+        print "Normalized %d signatures, clustered %d signatures, %d clusters" % (normalized, clustered, clusters)
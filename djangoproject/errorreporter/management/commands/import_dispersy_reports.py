@@ -0,0 +1,63 @@
+import datetime
+import os
+import re
+from optparse import make_option
+
+from errorreporter.management.commands import import_reports
+from errorreporter.management.commands.import_reports import ExceptionLogParser
+
+# the first line of a stack sent to the Dispersy reporter, by Tribler or a standalone Dispersy
+VERSION_RE = re.compile(r'(?:Tribler|Dispersy) version: ([^\n]*)\n')
+PACKAGE_DATE_RE = re.compile(r'(\d{4})(\d{2})(\d{2})')
+DEFAULT_VERSION = "x.x.x"
+
+
+class DispersyLogParser(ExceptionLogParser):
+    """Parses the archives of the Dispersy reporter, which receives the same reports as
+       the Tribler reporter, but older clients sent them without a version line and the
+       archives are not always named after their date.
+    """
+    def __init__(self, default_version=DEFAULT_VERSION):
+        super(DispersyLogParser, self).__init__()
+        self._default_version = default_version
+
+    def parse_date(self, pkg_path):
+        """Returns the date (YYYY-MM-DD) in the name of a package, or None if it has none.
+        """
+        match = PACKAGE_DATE_RE.search(os.path.basename(pkg_path))
+        return "%s-%s-%s" % match.groups() if match else None
+
+    def parse_version(self, stack):
+        match = VERSION_RE.match(stack or "")
+        if match:
+            return match.group(1), stack[match.end():]
+        return self._default_version, stack
+
+    def report_fields(self, xml_data_dict, date):
+        # reports in archives without a date in their name are dated by their timestamp,
+        # a report without a usable one can't be dated and is left out
+        if date is None:
+            try:
+                timestamp = float(xml_data_dict[u"timestamp"])
+                date = datetime.datetime.utcfromtimestamp(timestamp).strftime("%Y-%m-%d")
+            except (TypeError, ValueError, OverflowError):
+                self._logger.warning(u"Skipping a report without a date: timestamp %r", xml_data_dict[u"timestamp"])
+                return None
+        return super(DispersyLogParser, self).report_fields(xml_data_dict, date)
+
+
+# Class MUST be named 'Command'
+class Command(import_reports.Command):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Import Dispersy reporter archives that are not in the database yet."
+
+    parser_class = DispersyLogParser
+
+    option_list = import_reports.Command.option_list + (
+        make_option('--default-version', action='store', dest='default-version', default=DEFAULT_VERSION,
+                    help='Version of reports without a version line (default: %s)' % DEFAULT_VERSION),
+    )
+
+    def get_parser_kwargs(self, options):
+        return {'default_version': options['default-version']}
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.models import StackSignature, index_stack_frames
+from django.db import transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Index the frames of stack signatures imported before the frame index existed."
+
+    def handle(self, *app_labels, **options):
+        indexed = 0
+        last_id = 0
+        while True:
+            stacks = dict(StackSignature.objects.filter(id__gt=last_id, stackframe=None)
+                          .order_by('id').values_list('id', 'stack')[:500])
+            if not stacks:
+                break
+            with transaction.atomic():
+                index_stack_frames(stacks)
+            indexed += len(stacks)
+            last_id = max(stacks)
+
+        print "Indexed the frames of %d signatures" % indexed
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.models import CrashReport, ReportCount
+from django.db import transaction
+from django.db.models import Count
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Recompute the per date/version/stack/os/machine report counts from scratch."
+
+    def handle(self, *app_labels, **options):
+        groups = CrashReport.objects.values('date', 'version', 'signature', 'os', 'machine').annotate(cnt=Count('id'))
+
+        with transaction.atomic():
+            ReportCount.objects.all().delete()
+            counts = []
+            for g in groups.iterator():
+                counts.append(ReportCount(date=g['date'], version=g['version'], signature_id=g['signature'],
+                                          os=g['os'], machine=g['machine'], count=g['cnt']))
+                if len(counts) >= 1000:
+                    ReportCount.objects.bulk_create(counts)
+                    counts = []
+            ReportCount.objects.bulk_create(counts)
+
+        print "Rebuilt %d report counts" % ReportCount.objects.count()
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.core.management.color import no_style
+from django.core.management.sql import custom_sql_for_model
+
+from errorreporter.management.commands.import_reports import ExceptionLogParser
+from errorreporter.models import CrashReport, SearchDocument, StackSignature
+from errorreporter.search import has_search_index, index_stack_documents
+from errorreporter.sysinfo import decompress_sysinfo, parse_sysinfo, sysinfo_attributes
+from django.db import DatabaseError, connection, transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Recompute the search documents of all stacks from the stacks, comments and sysinfo of all " \
+           "reports, and create the SQLite full-text index if it's missing."
+
+    def handle(self, *app_labels, **options):
+        if connection.vendor == 'sqlite' and not has_search_index():
+            # the statements syncdb runs when it creates the SearchDocument table
+            try:
+                with transaction.atomic():
+                    for sql in custom_sql_for_model(SearchDocument, no_style(), connection):
+                        connection.cursor().execute(sql)
+            except DatabaseError as e:
+                print "Could not create the full-text index, searching scans the documents: %s" % e
+
+        parser = ExceptionLogParser()
+        reports = CrashReport.objects.values_list('signature', 'comments', 'reportsysinfo__data',
+                                                  'reportsysinfo__compressed')
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            last_id = 0
+            while True:
+                stacks = dict(StackSignature.objects.filter(id__gt=last_id).order_by('id')
+                              .values_list('id', 'stack')[:500])
+                if not stacks:
+                    break
+                index_stack_documents(stacks)
+                last_id = max(stacks)
+
+            rows = []
+            for signature_id, comments, data, compressed in reports.iterator():
+                if signature_id is None:
+                    continue
+                attributes = sysinfo_attributes(parse_sysinfo(decompress_sysinfo(data, compressed))) if data else []
+                rows.append((signature_id, comments, attributes))
+                if len(rows) >= 1000:
+                    parser.update_search_documents(rows)
+                    rows = []
+            parser.update_search_documents(rows)
+
+        print "Rebuilt %d search documents%s" % (SearchDocument.objects.count(),
+                                                 "" if has_search_index() else " (no full-text index)")
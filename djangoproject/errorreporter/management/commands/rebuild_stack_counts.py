@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.models import ReportCount, StackCount
+from errorreporter.timeseries import stack_counts
+from django.db import transaction
+from django.db.models import Sum
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Recompute the per day/week/month stack counts of the time series from the report counts."
+
+    def handle(self, *app_labels, **options):
+        days = ReportCount.objects.values('signature', 'date').annotate(cnt=Sum('count'))
+        counts = {}
+        for d in days.iterator():
+            for key, count in stack_counts([(d['signature'], d['date'])]).iteritems():
+                counts[key] = counts.get(key, 0) + count * d['cnt']
+
+        with transaction.atomic():
+            StackCount.objects.all().delete()
+            rows = [StackCount(signature_id=signature_id, granularity=granularity, start=start, count=count)
+                    for (signature_id, granularity, start), count in counts.iteritems()]
+            for i in range(0, len(rows), 1000):
+                StackCount.objects.bulk_create(rows[i:i + 1000])
+
+        print "Rebuilt %d stack counts" % StackCount.objects.count()
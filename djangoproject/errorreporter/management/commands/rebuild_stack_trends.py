@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.models import StackCount, StackSignature, StackTrend
+from errorreporter.trends import add_reports, first_versions, new_trend
+from django.db import transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Recompute the daily report statistics of all stacks from the per day stack counts."
+
+    def handle(self, *app_labels, **options):
+        versions = first_versions(StackSignature.objects.values_list('id', flat=True).iterator())
+        days = StackCount.objects.filter(granularity='day').order_by('signature', 'start') \
+            .values_list('signature', 'start', 'count')
+
+        with transaction.atomic():
+            StackTrend.objects.all().delete()
+            trends = []
+            trend = None
+            for signature_id, date, count in days.iterator():
+                if trend is None or trend.signature_id != signature_id:
+                    trend = new_trend(signature_id, date, versions.get(signature_id, ""))
+                    trends.append(trend)
+                    if len(trends) > 1000:
+                        StackTrend.objects.bulk_create(trends[:-1])
+                        trends = trends[-1:]
+                add_reports(trend, date, count)
+            StackTrend.objects.bulk_create(trends)
+
+        print "Rebuilt %d stack trends" % StackTrend.objects.count()
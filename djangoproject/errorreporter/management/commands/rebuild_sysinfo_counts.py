@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from errorreporter.management.commands.import_reports import ExceptionLogParser
+from errorreporter.models import ReportSysinfo, SysinfoCount
+from errorreporter.sysinfo import decompress_sysinfo, parse_sysinfo, sysinfo_attributes
+from django.db import transaction
+
+
+# Class MUST be named 'Command'
+class Command(BaseCommand):
+
+    # Displayed from 'manage.py help mycommand'
+    help = "Recompute the per date/version sysinfo key/value counts from the sysinfo of all reports."
+
+    def handle(self, *app_labels, **options):
+        parser = ExceptionLogParser()
+        reports = ReportSysinfo.objects.values_list('report__date', 'report__version', 'data', 'compressed')
+
+        with transaction.atomic():
+            SysinfoCount.objects.all().delete()
+            rows = []
+            for date, version, data, compressed in reports.iterator():
+                sysinfo = decompress_sysinfo(data, compressed)
+                rows.append({'date': date, 'version': version,
+                             'sysinfo_attributes': sysinfo_attributes(parse_sysinfo(sysinfo))})
+                if len(rows) >= 1000:
+                    parser.update_sysinfo_counts(rows)
+                    rows = []
+            parser.update_sysinfo_counts(rows)
+
+        print "Rebuilt %d sysinfo counts" % SysinfoCount.objects.count()
@@ -0,0 +1,164 @@
+"""RequestStatsMiddleware records the query count, SQL time and template render time of
+every errorreporter view in the request log of errorreporter.stats, shown by the stats
+view. Queries are only timed on a database whose ENGINE is one of errorreporter.backends
+(e.g. 'errorreporter.backends.sqlite3'), and templates only when a view returns a
+TemplateResponse. ReadSnapshotMiddleware runs every errorreporter page in a single read
+transaction. Enable them by adding them to MIDDLEWARE_CLASSES.
+"""
+import threading
+import time
+
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+from errorreporter.stats import get_request_log
+
+_local = threading.local()
+
+
+class RequestStats(object):
+    def __init__(self, view):
+        super(RequestStats, self).__init__()
+        self.view = view
+        self.start = time.time()
+        self.queries = 0
+        self.sql = 0.0
+        self.render = 0.0
+
+
+class TimedCursor(object):
+    """Wraps a database cursor to add its queries to the RequestStats of the request.
+    """
+    def __init__(self, cursor, stats):
+        super(TimedCursor, self).__init__()
+        self.cursor = cursor
+        self.stats = stats
+
+    def execute(self, sql, params=None):
+        start = time.time()
+        try:
+            return self.cursor.execute(sql, params)
+        finally:
+            self.stats.sql += time.time() - start
+            self.stats.queries += 1
+
+    def executemany(self, sql, param_list):
+        start = time.time()
+        try:
+            return self.cursor.executemany(sql, param_list)
+        finally:
+            self.stats.sql += time.time() - start
+            self.stats.queries += 1
+
+    # SQLite runs a query as its rows are fetched, so fetching counts as SQL time too
+    def fetchone(self):
+        start = time.time()
+        try:
+            return self.cursor.fetchone()
+        finally:
+            self.stats.sql += time.time() - start
+
+    def fetchmany(self, *args):
+        start = time.time()
+        try:
+            return self.cursor.fetchmany(*args)
+        finally:
+            self.stats.sql += time.time() - start
+
+    def fetchall(self):
+        start = time.time()
+        try:
+            return self.cursor.fetchall()
+        finally:
+            self.stats.sql += time.time() - start
+
+    def __getattr__(self, attr):
+        return getattr(self.cursor, attr)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+
+def timed_cursor(cursor):
+    """Returns the cursor wrapped in a TimedCursor while this thread handles a request
+       RequestStatsMiddleware records, the cursor itself otherwise.
+    """
+    stats = getattr(_local, 'stats', None)
+    return TimedCursor(cursor, stats) if stats is not None else cursor
+
+
+class TimedDatabaseWrapperMixin(object):
+    """Mixed into the DatabaseWrapper of the errorreporter.backends. Connections are
+       per thread, so the cursors of a request only see the queries of that request.
+    """
+    def cursor(self):
+        return timed_cursor(super(TimedDatabaseWrapperMixin, self).cursor())
+
+
+class ReadSnapshotMiddleware(object):
+    """Runs the GET and HEAD requests of the errorreporter views in one read transaction
+       on SQLite, so all queries of a page see the same data even when import_reports
+       commits a batch halfway through it. In WAL mode (see errorreporter.db) the read
+       transaction doesn't block the import, nor the other way around. Other databases
+       are left alone, run them at an isolation level that gives the same guarantee.
+    """
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        module = view_func.__module__ or ""
+        if request.method not in ("GET", "HEAD") or not module.startswith("errorreporter."):
+            return None
+        db = connections[DEFAULT_DB_ALIAS]
+        if db.vendor != 'sqlite' or db.in_atomic_block or not db.get_autocommit():
+            return None
+        # in autocommit mode pysqlite doesn't start transactions itself, the snapshot
+        # is taken by the first query and lasts until the COMMIT
+        db.cursor().execute("BEGIN")
+        request._errorreporter_snapshot = True
+        return None
+
+    def process_response(self, request, response):
+        if getattr(request, '_errorreporter_snapshot', False):
+            del request._errorreporter_snapshot
+            try:
+                connections[DEFAULT_DB_ALIAS].cursor().execute("COMMIT")
+            except DatabaseError:
+                # the transaction ended with an error already, nothing was written in it
+                pass
+        return response
+
+
+class RequestStatsMiddleware(object):
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        module = view_func.__module__ or ""
+        if not module.startswith("errorreporter."):
+            return None
+        stats = RequestStats("%s.%s" % (module.rsplit(".", 1)[-1], view_func.__name__))
+        request._errorreporter_stats = _local.stats = stats
+        return None
+
+    def process_template_response(self, request, response):
+        stats = getattr(request, '_errorreporter_stats', None)
+        if stats is None or response.is_rendered:
+            return response
+        # the response is rendered right after the template response middleware, which runs
+        # in reverse order: last in MIDDLEWARE_CLASSES, this times just the rendering. It
+        # leaves out the queries run by lazy querysets in the template.
+        start = time.time()
+        sql = stats.sql
+
+        def rendered(response):
+            stats.render += time.time() - start - (stats.sql - sql)
+        response.add_post_render_callback(rendered)
+        return response
+
+    def process_response(self, request, response):
+        stats = getattr(request, '_errorreporter_stats', None)
+        if stats is None:
+            return response
+        del request._errorreporter_stats
+        _local.stats = None
+
+        total = (time.time() - stats.start) * 1000
+        sql = stats.sql * 1000
+        render = stats.render * 1000
+        get_request_log().record(stats.view, response.status_code, total_ms=total, sql_ms=sql,
+                                 render_ms=render, python_ms=max(total - sql - render, 0.0),
+                                 queries=stats.queries)
+        return response
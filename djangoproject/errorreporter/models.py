@@ -1,17 +1,298 @@
+import hashlib
+
 from django.db import models
+from django.db.backends.signals import connection_created
+from django.utils.encoding import force_bytes
+from errorreporter.db import configure_sqlite
+from errorreporter.flamegraph import collapse_stack, parse_frames
+from errorreporter.grouping import normalized_fingerprint
+from errorreporter.sysinfo import decompress_sysinfo
+
+
+connection_created.connect(configure_sqlite, dispatch_uid="errorreporter.configure_sqlite")
+
+
+def stack_fingerprint(stack):
+    """Returns the fixed-width fingerprint (sha1 hex digest) of a stack trace.
+    """
+    return hashlib.sha1(force_bytes(stack or "")).hexdigest()
+
+
+def signatures_by_id(ids, chunk_size=500):
+    """Returns a {id: StackSignature} dict for the given signature ids. The ids are
+       queried in chunks to stay below SQLite's limit on the number of variables.
+    """
+    ids = list(ids)
+    signatures = {}
+    for i in range(0, len(ids), chunk_size):
+        signatures.update(StackSignature.objects.in_bulk(ids[i:i + chunk_size]))
+    return signatures
+
+
+def index_stack_frames(stacks):
+    """Stores the frames of the given {signature id: stack} dict in the StackFrame table.
+    """
+    frames = []
+    for signature_id, stack in stacks.iteritems():
+        for position, (stack_file, line, function) in enumerate(parse_frames(stack)):
+            frames.append(StackFrame(signature_id=signature_id, position=position, file=stack_file[:255],
+                                     line=int(line) if line.isdigit() else None, function=function[:255]))
+    StackFrame.objects.bulk_create(frames)
 
 
 # Create your models here.
+class StackSignature(models.Model):
+    """A distinct stack trace, shared by all reports that crashed with it."""
+    id = models.AutoField(primary_key=True)
+    # only NULL for signatures converted from old databases until backfill_stack_hashes ran
+    stack_hash = models.CharField(max_length=40, unique=True, null=True)
+    stack = models.TextField()
+    # "file:function" frames for the flame graphs, NULL for old signatures until they are rendered
+    collapsed = models.TextField(null=True)
+    # fingerprint of the stack without paths, line numbers and ids, see errorreporter.grouping,
+    # and the id of the oldest signature of its cluster of similar stacks. NULL for old
+    # signatures until group_stacks ran
+    normalized_hash = models.CharField(max_length=40, null=True, db_index=True)
+    cluster = models.IntegerField(null=True, db_index=True)
+    first_seen = models.DateField()
+    last_seen = models.DateField()
+    total_count = models.IntegerField(default=0)
+    first_report_id = models.IntegerField(null=True)
+
+    def save(self, *args, **kwargs):
+        self.stack_hash = stack_fingerprint(self.stack)
+        self.collapsed = collapse_stack(self.stack)
+        self.normalized_hash = normalized_fingerprint(self.stack)
+        super(StackSignature, self).save(*args, **kwargs)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d reports\n %s\n" % (self.stack_hash, self.total_count, self.stack)
+
+
+class StackMinHash(models.Model):
+    """The MinHash of a stack that near duplicates are found with, see errorreporter.grouping.
+    """
+    signature = models.OneToOneField(StackSignature, primary_key=True)
+    data = models.BinaryField()
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d bytes" % (self.signature_id, len(self.data))
+
+
+class StackBand(models.Model):
+    """A band of the MinHash of a stack, stacks that share a band are compared.
+    """
+    id = models.AutoField(primary_key=True)
+    band = models.BigIntegerField(db_index=True)
+    signature = models.ForeignKey(StackSignature)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %x" % (self.signature_id, self.band)
+
+
+class StackFrame(models.Model):
+    """A frame (file, line, function) of a stack, outermost first, indexed so the
+       stacks that pass through a file or function are found without scanning them.
+    """
+    id = models.AutoField(primary_key=True)
+    signature = models.ForeignKey(StackSignature)
+    position = models.IntegerField()
+    file = models.CharField(max_length=255, db_index=True)
+    line = models.IntegerField(null=True)
+    function = models.CharField(max_length=255, db_index=True)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s:%s in %s" % (self.file, self.line, self.function)
+
+
+class SearchDocument(models.Model):
+    """A distinct text that search finds a stack by: the stack itself, or a comment or sysinfo
+       value (field) of its reports with the number of reports it came with. On SQLite it is
+       indexed by the errorreporter_searchindex FTS5 table, see errorreporter.search.
+    """
+    id = models.AutoField(primary_key=True)
+    signature = models.ForeignKey(StackSignature)
+    field = models.CharField(max_length=10)
+    text = models.TextField()
+    # sha1 of the signature id, field and text, see errorreporter.search.document_key
+    key = models.CharField(max_length=40, unique=True)
+    # 0 for the stack, its reports are counted by StackSignature.total_count
+    count = models.IntegerField(default=0)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s %s: %d" % (self.signature_id, self.field, self.count)
+
+
 class CrashReport(models.Model):
     id = models.AutoField(primary_key=True)
     timestamp = models.CharField(max_length=200, unique=True)
-    sysinfo = models.TextField()
     comments = models.CharField(max_length=300)
-    stack = models.TextField(db_index=True)
+    signature = models.ForeignKey(StackSignature, null=True)
     version = models.CharField(max_length=10, db_index=True)
     date = models.DateField(db_index=True)
     os = models.CharField(max_length=50, db_index=True)
     machine = models.CharField(max_length=50, db_index=True)
 
+    @property
+    def stack(self):
+        return self.signature.stack if self.signature_id else ""
+
+    @property
+    def sysinfo(self):
+        try:
+            return self.reportsysinfo.text
+        except ReportSysinfo.DoesNotExist:
+            return ""
+
     def __unicode__(self):  # Python 3: def __str__(self):
         return "%s: Version %s\n %s\n %s\n" % (self.timestamp, self.version, self.stack, self.comments)
+
+
+class ReportSysinfo(models.Model):
+    """The sysinfo text of a report, zlib compressed and kept apart from the CrashReport
+       rows so listing and counting reports doesn't read it. Only the page of a single
+       report loads it.
+    """
+    report = models.OneToOneField(CrashReport, primary_key=True)
+    data = models.BinaryField()
+    # False for sysinfo copied from an old database until compress_sysinfo ran
+    compressed = models.BooleanField(default=True)
+
+    @property
+    def text(self):
+        return decompress_sysinfo(self.data, self.compressed)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d bytes" % (self.report_id, len(self.data))
+
+
+class ReportCount(models.Model):
+    """Number of reports per (date, version, stack, os, machine), maintained by
+       the importer so the overviews don't have to count the CrashReport table.
+    """
+    id = models.AutoField(primary_key=True)
+    date = models.DateField()
+    version = models.CharField(max_length=10, db_index=True)
+    signature = models.ForeignKey(StackSignature)
+    os = models.CharField(max_length=50)
+    machine = models.CharField(max_length=50)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'version', 'signature', 'os', 'machine')
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s %s %s %s %s: %d" % (self.date, self.version, self.signature_id, self.os, self.machine, self.count)
+
+
+class StackCount(models.Model):
+    """Number of reports of a stack per day, week or month (granularity), starting at
+       start. Maintained by the importer so a time series of a stack reads a row per point.
+    """
+    id = models.AutoField(primary_key=True)
+    signature = models.ForeignKey(StackSignature)
+    granularity = models.CharField(max_length=5)
+    start = models.DateField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('signature', 'granularity', 'start')
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s %s %s: %d" % (self.signature_id, self.granularity, self.start, self.count)
+
+
+class StackTrend(models.Model):
+    """Exponentially weighted mean and variance of the daily report counts of a stack up
+       to the last day it was reported, the count of that day and how unusual it is
+       (score), and the version it was first reported from. Maintained by the importer
+       from the reports it adds, see errorreporter.trends.
+    """
+    signature = models.OneToOneField(StackSignature, primary_key=True)
+    first_version = models.CharField(max_length=10, db_index=True)
+    last_date = models.DateField(db_index=True)
+    last_count = models.IntegerField(default=0)
+    # of the days before last_date, including those without reports
+    mean = models.FloatField(default=0.0)
+    variance = models.FloatField(default=0.0)
+    days = models.IntegerField(default=0)
+    score = models.FloatField(default=0.0)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s %s: %d (mean %.1f, score %.1f)" % (self.signature_id, self.last_date, self.last_count,
+                                                       self.mean, self.score)
+
+
+class DataGeneration(models.Model):
+    """Counter per date ('date:YYYY-MM-DD'), version ('version:x.y.z') and for
+       everything ('all'), bumped by the importer whenever it adds reports to it.
+       Cached pages are keyed on it, see errorreporter.cache.
+    """
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    generation = models.IntegerField(default=0)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d" % (self.name, self.generation)
+
+
+class FlameGraph(models.Model):
+    """The DataGeneration a date or version flame graph was last rendered at, so only
+       the graphs of dates and versions that received reports since are regenerated.
+    """
+    id = models.AutoField(primary_key=True)
+    name = models.CharField(max_length=100, unique=True)
+    generation = models.IntegerField(default=0)
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d" % (self.name, self.generation)
+
+
+class ImportCheckpoint(models.Model):
+    """How far the importer got in an archive, identified by its path, size and sha1.
+       offset is the position in the decompressed archive after the last committed
+       report, so an interrupted import resumes right there.
+    """
+    id = models.AutoField(primary_key=True)
+    path = models.CharField(max_length=255)
+    size = models.BigIntegerField()
+    content_hash = models.CharField(max_length=40)
+    offset = models.BigIntegerField(default=0)
+    records = models.IntegerField(default=0)
+    finished = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('path', 'size', 'content_hash')
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %d reports%s" % (self.path, self.records, " (finished)" if self.finished else "")
+
+
+class SysinfoValue(models.Model):
+    """A distinct (key, value) pair of the sysinfo of reports, e.g. ('python.version', '2.7.1')."""
+    id = models.AutoField(primary_key=True)
+    key = models.CharField(max_length=100, db_index=True)
+    value = models.CharField(max_length=255)
+
+    class Meta:
+        unique_together = ('key', 'value')
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s: %s" % (self.key, self.value)
+
+
+class SysinfoCount(models.Model):
+    """Number of reports per (date, version, sysinfo key/value), maintained by the importer
+       so a breakdown by any sysinfo key doesn't have to parse the sysinfo of every report.
+    """
+    id = models.AutoField(primary_key=True)
+    date = models.DateField()
+    version = models.CharField(max_length=10, db_index=True)
+    value = models.ForeignKey(SysinfoValue)
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('date', 'version', 'value')
+
+    def __unicode__(self):  # Python 3: def __str__(self):
+        return "%s %s %s: %d" % (self.date, self.version, self.value_id, self.count)
@@ -0,0 +1,219 @@
+"""Full-text search over the stacks, the comments of their reports and a few of their
+sysinfo values (ERRORREPORTER_SEARCH_SYSINFO_KEYS). Each distinct text of a stack is
+a SearchDocument, counted by the importer, so there are far fewer documents than reports.
+
+On SQLite the documents are indexed by the errorreporter_searchindex FTS5 table, which
+triggers keep in sync (see sql/searchdocument.sqlite3.sql). Each term of a query is
+matched on its own and the matches are grouped per stack, so the terms may occur in
+different documents of a stack, e.g. a word of the stack and a word of a comment. A term
+ranks its newest MAX_MATCHES matching documents with bm25, only a term that matches more
+is looked up again within the stacks the other terms found. Ranking all matches of a
+common word would score hundreds of thousands of documents, with the cap a query takes
+milliseconds however many documents there are. Other databases, and SQLite builds
+without FTS5, fall back to LIKE over the documents, with the stacks with the most
+reports first.
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import connection
+from django.utils.encoding import force_bytes
+from errorreporter.models import SearchDocument, signatures_by_id
+
+SEARCH_INDEX_TABLE = 'errorreporter_searchindex'
+DEFAULT_SYSINFO_KEYS = ('platform', 'platform.details', 'platform.machine', 'python.version', 'os.environ.LANG',
+                        'os.environ.DESKTOP_SESSION')
+# what clients send when the user didn't comment
+IGNORED_COMMENTS = (u"", u"Not provided")
+# the matching documents a query ranks and groups into stacks, newest first
+MAX_MATCHES = 2000
+# matching comments and sysinfo values returned per stack
+MAX_TEXTS = 5
+# quoted phrases and words, a trailing * makes them a prefix
+TERM_RE = re.compile(r'"([^"]*)"(\*?)|([^\s"]+)', re.UNICODE)
+WORD_RE = re.compile(r'\w', re.UNICODE)
+
+
+def document_key(signature_id, field, text):
+    return hashlib.sha1(force_bytes(u"%d\n%s\n%s" % (signature_id, field, text))).hexdigest()
+
+
+def indexed_sysinfo_keys():
+    """Returns the sysinfo keys whose values are searched (ERRORREPORTER_SEARCH_SYSINFO_KEYS). The values
+       of os.environ variables are only kept for those in ERRORREPORTER_SYSINFO_ENVIRON_KEYS.
+    """
+    return frozenset(getattr(settings, 'ERRORREPORTER_SEARCH_SYSINFO_KEYS', DEFAULT_SYSINFO_KEYS))
+
+
+def report_texts(comments, attributes, sysinfo_keys):
+    """Returns the (field, text) pairs a report adds to the documents of its stack: its comment and the
+       values of the given sysinfo keys of its (key, value) sysinfo attributes.
+    """
+    texts = []
+    comments = (comments or u"").strip()
+    if comments not in IGNORED_COMMENTS:
+        texts.append(('comments', comments))
+    texts.extend(('sysinfo', u"%s: %s" % (key, value)) for key, value in attributes if key in sysinfo_keys)
+    return texts
+
+
+def index_stack_documents(stacks):
+    """Stores the given {signature id: stack} dict as SearchDocuments.
+    """
+    SearchDocument.objects.bulk_create([
+        SearchDocument(signature_id=signature_id, field='stack', text=stack,
+                       key=document_key(signature_id, 'stack', stack))
+        for signature_id, stack in stacks.iteritems()])
+
+
+def parse_query(query):
+    """Returns the terms of a search query as (text, prefix) pairs: each quoted phrase and each other
+       word, without the terms that have no letters or digits.
+    """
+    terms = []
+    for phrase, phrase_prefix, word in TERM_RE.findall(query or u""):
+        if word:
+            phrase, phrase_prefix = word.rstrip(u"*"), u"*" if word.endswith(u"*") else u""
+        if WORD_RE.search(phrase):
+            terms.append((phrase, bool(phrase_prefix)))
+    return terms
+
+
+def match_expression(term):
+    """Returns the FTS5 query that matches documents with a (text, prefix) term. The term is quoted, FTS5
+       splits it into words like it does the documents, so punctuation in a term doesn't need escaping.
+    """
+    text, prefix = term
+    return u'"%s"%s' % (text.replace(u'"', u'""'), u"*" if prefix else u"")
+
+
+def has_search_index():
+    if connection.vendor != 'sqlite':
+        return False
+    cursor = connection.cursor()
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = %s", [SEARCH_INDEX_TABLE])
+    return cursor.fetchone() is not None
+
+
+def indexed_matches(term, signature_ids=None):
+    """Returns the (document id, signature id, field, text, count, rank) of the documents that match a term:
+       the newest MAX_MATCHES of them, or all of those of the given signatures. The text of stacks is left
+       out, it's in the signature.
+    """
+    names = {'index': SEARCH_INDEX_TABLE, 'documents': SearchDocument._meta.db_table}
+    columns = "d.id, d.signature_id, d.field, CASE WHEN d.field = 'stack' THEN '' ELSE d.text END, d.count"
+    cursor = connection.cursor()
+    if signature_ids is None:
+        # FTS5 walks the matches in rowid order and stops at the LIMIT, only those are scored
+        cursor.execute(
+            "SELECT %(columns)s, m.rank FROM (SELECT rowid, bm25(%(index)s) AS rank FROM %(index)s "
+            "WHERE %(index)s MATCH %%s ORDER BY rowid DESC LIMIT %%s) m "
+            "JOIN %(documents)s d ON d.id = m.rowid ORDER BY m.rowid DESC" % dict(names, columns=columns),
+            [match_expression(term), MAX_MATCHES])
+        return cursor.fetchall()
+    rows = []
+    for i in range(0, len(signature_ids), 500):
+        chunk = signature_ids[i:i + 500]
+        cursor.execute(
+            "SELECT %(columns)s, bm25(%(index)s) FROM %(index)s JOIN %(documents)s d ON d.id = %(index)s.rowid "
+            "WHERE %(index)s MATCH %%s AND d.signature_id IN (%(ids)s)"
+            % dict(names, columns=columns, ids=", ".join(["%s"] * len(chunk))),
+            [match_expression(term)] + chunk)
+        rows.extend(cursor.fetchall())
+    return rows
+
+
+def scanned_matches(term, signature_ids=None):
+    """Like indexed_matches, for databases without the index: the documents that contain the term, case
+       insensitive, of the stacks with the most reports first. Scans all documents.
+    """
+    objects = SearchDocument.objects.filter(text__icontains=term[0])
+    if signature_ids is None:
+        objects = objects.order_by('-signature__total_count', 'signature', 'id')[:MAX_MATCHES]
+        return [(document_id, signature_id, field, u"" if field == 'stack' else text, count, 0.0)
+                for document_id, signature_id, field, text, count in
+                objects.values_list('id', 'signature', 'field', 'text', 'count')]
+    rows = []
+    for i in range(0, len(signature_ids), 500):
+        rows.extend((document_id, signature_id, field, u"" if field == 'stack' else text, count, 0.0)
+                    for document_id, signature_id, field, text, count in
+                    objects.filter(signature__in=signature_ids[i:i + 500])
+                    .values_list('id', 'signature', 'field', 'text', 'count'))
+    return rows
+
+
+def stack_matches(terms, term_matches):
+    """Returns the [(signature id, score, rows)] of the stacks whose documents together contain every term,
+       best score first, with the rows of term_matches (indexed_matches or scanned_matches) of their matching
+       documents, best match first. A stack's score adds up the best (bm25) rank of each term. The stacks
+       are those of the first term that matches fewer than MAX_MATCHES documents, or else of the newest
+       MAX_MATCHES documents matching the first term. The other terms only look at their documents.
+    """
+    matches = [term_matches(term) for term in terms]
+    base = next((i for i, rows in enumerate(matches) if len(rows) < MAX_MATCHES), 0)
+    order = []
+    candidates = set()
+    for row in matches[base]:
+        if row[1] not in candidates:
+            candidates.add(row[1])
+            order.append(row[1])
+    for i, term in enumerate(terms):
+        if i == base or not candidates:
+            continue
+        if len(matches[i]) >= MAX_MATCHES:
+            matches[i] = term_matches(term, sorted(candidates))
+        candidates &= set(row[1] for row in matches[i])
+
+    stacks = dict((signature_id, {'ranks': [None] * len(terms), 'rows': {}}) for signature_id in candidates)
+    for i, rows in enumerate(matches):
+        for row in rows:
+            stack = stacks.get(row[1])
+            if stack is None:
+                continue
+            stack['ranks'][i] = row[5] if stack['ranks'][i] is None else min(stack['ranks'][i], row[5])
+            if row[0] not in stack['rows'] or row[5] < stack['rows'][row[0]][5]:
+                stack['rows'][row[0]] = row
+    position = dict((signature_id, i) for i, signature_id in enumerate(order))
+    ranks = dict((signature_id, sum(stack['ranks'])) for signature_id, stack in stacks.iteritems())
+    ordered = sorted(candidates, key=lambda signature_id: (ranks[signature_id], position[signature_id]))
+    return [(signature_id, -ranks[signature_id] if ranks[signature_id] else 0.0,
+             sorted(stacks[signature_id]['rows'].itervalues(), key=lambda row: (row[5], -row[0])))
+            for signature_id in ordered]
+
+
+def search_stacks(query, limit=20):
+    """Returns the stacks matching a search query, best match first. Every term of the query has to occur
+       in the stack, a comment or an indexed sysinfo value of one of its reports; quote words to find
+       them as a phrase, end a term with * to find the words starting with it. Each stack comes with its
+       number of reports, its first and last date, its score (higher is better, 0 without the index)
+       and the matching comments and sysinfo values with their number of reports.
+    """
+    terms = parse_query(query)
+    if not terms:
+        return []
+    matches = stack_matches(terms, indexed_matches if has_search_index() else scanned_matches)[:limit]
+
+    stacks = {}
+    order = []
+    for signature_id, score, rows in matches:
+        stack = stacks[signature_id] = {'signature': signature_id, 'score': score, 'stack_matches': False,
+                                        'texts': []}
+        order.append(signature_id)
+        for _, _, field, text, count, _ in rows:
+            if field == 'stack':
+                stack['stack_matches'] = True
+            elif len(stack['texts']) < MAX_TEXTS:
+                stack['texts'].append({'field': field, 'text': text, 'cnt': count})
+
+    signatures = signatures_by_id(order)
+    results = []
+    for signature_id in order:
+        signature = signatures[signature_id]
+        lines = signature.stack.strip().splitlines()
+        stack = stacks[signature_id]
+        stack.update({'stack_hash': signature.stack_hash, 'id': signature.first_report_id,
+                      'exception': lines[-1] if lines else "", 'total_count': signature.total_count,
+                      'first_seen': signature.first_seen, 'last_seen': signature.last_seen})
+        results.append(stack)
+    return results
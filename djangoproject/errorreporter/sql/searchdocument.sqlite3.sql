@@ -0,0 +1,8 @@
+-- Run by syncdb when it creates the SearchDocument table: an FTS5 index over its text, kept in
+-- sync by triggers. Without FTS5 in SQLite this fails and search falls back to LIKE, see
+-- errorreporter.search. Django splits this file on lines ending in a semicolon, so every
+-- statement is on a single line.
+CREATE VIRTUAL TABLE errorreporter_searchindex USING fts5(text, content='errorreporter_searchdocument', content_rowid='id');
+CREATE TRIGGER errorreporter_searchdocument_insert AFTER INSERT ON errorreporter_searchdocument BEGIN INSERT INTO errorreporter_searchindex(rowid, text) VALUES (new.id, new.text); END;
+CREATE TRIGGER errorreporter_searchdocument_delete AFTER DELETE ON errorreporter_searchdocument BEGIN INSERT INTO errorreporter_searchindex(errorreporter_searchindex, rowid, text) VALUES ('delete', old.id, old.text); END;
+CREATE TRIGGER errorreporter_searchdocument_update AFTER UPDATE OF text ON errorreporter_searchdocument BEGIN INSERT INTO errorreporter_searchindex(errorreporter_searchindex, rowid, text) VALUES ('delete', old.id, old.text); INSERT INTO errorreporter_searchindex(rowid, text) VALUES (new.id, new.text); END;
@@ -0,0 +1,118 @@
+"""Lightweight timings for the importer and the views: a few time.time() calls and
+dict updates per stage or request, cheap enough to leave on in production.
+"""
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+# the order stages are reported in, others follow alphabetically
+IMPORT_STAGES = ('decompress', 'unpickle', 'fields', 'dedup', 'signatures', 'insert', 'counts', 'search', 'commit')
+REQUEST_FIELDS = ('total_ms', 'sql_ms', 'render_ms', 'python_ms', 'queries')
+PERCENTILES = (50, 90, 99)
+
+
+class StageTimings(object):
+    """Seconds and counters per named stage, e.g. of an archive import.
+    """
+    def __init__(self):
+        super(StageTimings, self).__init__()
+        self.seconds = defaultdict(float)
+        self.counters = defaultdict(int)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.time() - start
+
+    def add(self, name, seconds):
+        self.seconds[name] += seconds
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def merge(self, other):
+        for name, seconds in other.seconds.iteritems():
+            self.seconds[name] += seconds
+        for name, n in other.counters.iteritems():
+            self.counters[name] += n
+
+    def __getstate__(self):
+        # sent back from the parsing workers, defaultdicts of builtins pickle fine
+        return {'seconds': dict(self.seconds), 'counters': dict(self.counters)}
+
+    def __setstate__(self, state):
+        self.seconds = defaultdict(float, state['seconds'])
+        self.counters = defaultdict(int, state['counters'])
+
+    def summary(self):
+        """Returns e.g. u"decompress 1.20s, unpickle 0.31s, ...; reports 10000, inserted 9990".
+        """
+        order = dict((name, i) for i, name in enumerate(IMPORT_STAGES))
+        stages = sorted(self.seconds, key=lambda name: (order.get(name, len(order)), name))
+        text = u", ".join(u"%s %.2fs" % (name, self.seconds[name]) for name in stages)
+        if self.counters:
+            text += u"; " + u", ".join(u"%s %d" % (name, self.counters[name]) for name in sorted(self.counters))
+        return text
+
+
+def percentile(values, p):
+    """Returns the p-th percentile (nearest rank) of a sorted list of values.
+    """
+    if not values:
+        return None
+    return values[min(len(values) - 1, len(values) * p // 100)]
+
+
+class RequestLog(object):
+    """The timings of the last requests of this process, per view.
+    """
+    def __init__(self, size):
+        super(RequestLog, self).__init__()
+        self._entries = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def record(self, view, status, **timings):
+        with self._lock:
+            self._entries.append(dict(timings, view=view, status=status, time=time.time()))
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries)
+
+    def summary(self):
+        """Returns a list of {view, requests, <field>: {p50, p90, p99}} dicts, busiest view first.
+        """
+        by_view = defaultdict(list)
+        for entry in self.entries():
+            by_view[entry['view']].append(entry)
+        views = []
+        for view, entries in by_view.iteritems():
+            row = {'view': view, 'requests': len(entries),
+                   'errors': sum(1 for entry in entries if entry['status'] >= 500)}
+            for field in REQUEST_FIELDS:
+                values = sorted(entry[field] for entry in entries)
+                row[field] = dict(("p%d" % p, percentile(values, p)) for p in PERCENTILES)
+            views.append(row)
+        views.sort(key=lambda row: -row['requests'])
+        return views
+
+
+_request_log = None
+_request_log_lock = threading.Lock()
+
+
+def get_request_log():
+    """Returns the request log of this process, keeping the last ERRORREPORTER_STATS_SIZE
+       requests (default: 5000).
+    """
+    global _request_log
+    with _request_log_lock:
+        if _request_log is None:
+            _request_log = RequestLog(getattr(settings, 'ERRORREPORTER_STATS_SIZE', 5000))
+    return _request_log
@@ -0,0 +1,116 @@
+"""Writes synthetic exception-YYYYMMDD.bz2 archives in the format of the reporter:
+one pickled dict per report with a timestamp and the POSTed fields, so imports and
+views can be measured at sizes the sample data doesn't reach.
+
+Stacks are drawn with a long tail like real crashes, a few stacks make up most of
+the reports, and the output is the same for the same seed.
+"""
+import bisect
+import bz2
+import calendar
+import datetime
+import os
+import pickle
+import random
+
+PLATFORMS = [(u"Windows-7-6.1.7601-SP1", u"x86"), (u"Windows-XP-5.1.2600-SP3", u"x86"),
+             (u"Windows-8-6.2.9200", u"AMD64"), (u"Linux-3.13.0-24-generic-x86_64-with-Ubuntu-14.04-trusty", u"x86_64"),
+             (u"Darwin-13.1.0-x86_64-i386-64bit", u"x86_64")]
+LANGUAGES = [u"en_US.UTF-8", u"nl_NL.UTF-8", u"de_DE.UTF-8", u"ru_RU.UTF-8", u"es_ES.UTF-8"]
+PACKAGES = [u"Core", u"Core/Libtorrent", u"Core/Tunnel", u"Main/vwxGUI", u"Main/Utility", u"community/search",
+            u"dispersy", u"Category", u"Video", u"Policies"]
+EXCEPTIONS = [u"AttributeError: 'NoneType' object has no attribute 'get'", u"KeyError: 'infohash'",
+              u"ValueError: invalid literal for int() with base 10: ''", u"IOError: [Errno 28] No space left on device",
+              u"OperationalError: database is locked", u"TypeError: 'NoneType' object is not iterable"]
+
+
+def make_stacks(count, versions, rng):
+    """Returns count distinct stacks of 5 to 25 frames, each prefixed with one of the given versions.
+    """
+    stacks = []
+    for i in range(count):
+        frames = []
+        for depth in range(rng.randint(5, 25)):
+            package = rng.choice(PACKAGES)
+            frames.append(u'  File "Tribler/%s/module%d.py", line %d, in function%d\n    self.call%d()\n'
+                          % (package, rng.randint(0, 40), rng.randint(1, 2000), rng.randint(0, 200), depth))
+        stacks.append(u"Tribler version: %s\nTraceback (most recent call last):\n%s%s (%d)\n"
+                      % (rng.choice(versions), u"".join(frames), rng.choice(EXCEPTIONS), i))
+    return stacks
+
+
+def make_sysinfo(size, rng):
+    """Returns a sysinfo text of about size characters.
+    """
+    details, machine = rng.choice(PLATFORMS)
+    lines = [u"os.getcwd\tC:\\Program Files\\Tribler", u"platform.details\t%s" % details,
+             u"platform.machine\t%s" % machine, u"python.version\t2.7.%d" % rng.randint(1, 6),
+             u"indebug\tFalse", u"sys.path\tC:\\Program Files\\Tribler\\library.zip",
+             u"sys.path\tC:\\Program Files\\Tribler\\lib%d" % rng.randint(0, 3),
+             u"os.environ\tLANG: %s" % rng.choice(LANGUAGES),
+             u"os.environ\tNUMBER_OF_PROCESSORS: %d" % rng.choice((1, 2, 4, 8))]
+    length = sum(len(line) + 1 for line in lines)
+    # like in real reports, most of the text is per-user environment that isn't indexed
+    while length < size:
+        line = u"os.environ\tUSERVAR%d: C:\\Users\\user%08x\\AppData" % (len(lines), rng.getrandbits(32))
+        lines.append(line)
+        length += len(line) + 1
+    return u"\n".join(lines) + u"\n"
+
+
+class ReportGenerator(object):
+    """Generates reports over a fixed set of stacks, versions and sysinfo texts.
+    """
+    def __init__(self, stacks=1000, sysinfo_size=2500, versions=8, seed=0):
+        super(ReportGenerator, self).__init__()
+        self._rng = random.Random(seed)
+        versions = [u"6.%d.%d" % (i // 4, i % 4) for i in range(versions)]
+        self._stacks = make_stacks(stacks, versions, self._rng)
+        # a Zipf-like popularity: the n-th stack is reported about 1/n as often as the first
+        self._weights = []
+        total = 0.0
+        for rank in range(1, stacks + 1):
+            total += 1.0 / rank
+            self._weights.append(total)
+        self._sysinfos = [make_sysinfo(sysinfo_size, self._rng) for _ in range(50)]
+
+    def stack(self):
+        return self._stacks[bisect.bisect(self._weights, self._rng.random() * self._weights[-1])]
+
+    def report(self, timestamp):
+        """Returns a report dict like the reporter pickles them, with UTF-8 byte strings.
+        """
+        return {'timestamp': timestamp,
+                'remote_host': "10.0.%d.%d" % (self._rng.randint(0, 255), self._rng.randint(1, 254)),
+                'post': [('sysinfo', self._rng.choice(self._sysinfos).encode('utf-8')),
+                         ('comments', "Not provided" if self._rng.random() < 0.9 else "Crashed on startup"),
+                         ('stack', self.stack().encode('utf-8'))]}
+
+    def write_archive(self, output_dir, date, reports):
+        """Writes an exception-YYYYMMDD.bz2 archive with the given number of reports
+           spread over the given date. Returns its path.
+        """
+        path = os.path.join(output_dir, "exception-%s.bz2" % date.strftime("%Y%m%d"))
+        start = calendar.timegm(date.timetuple())
+        # timestamps identify reports and are stored with 1/100 s precision, keep them apart
+        step = max(86400.0 / max(reports, 1), 0.01)
+        archive = bz2.BZ2File(path, 'w')
+        try:
+            for i in range(reports):
+                # the reporter pickles with the default protocol 0
+                pickle.dump(self.report(start + i * step), archive, 0)
+        finally:
+            archive.close()
+        return path
+
+
+def write_archives(output_dir, reports, days=1, start_date=datetime.date(2014, 1, 1), **kwargs):
+    """Writes reports spread over an archive per day starting at start_date. The other
+       keyword arguments configure the ReportGenerator. Returns the archive paths.
+    """
+    generator = ReportGenerator(**kwargs)
+    paths = []
+    for day in range(days):
+        count = reports // days + (1 if day < reports % days else 0)
+        paths.append(generator.write_archive(output_dir, start_date + datetime.timedelta(days=day), count))
+    return paths
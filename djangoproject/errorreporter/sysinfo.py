@@ -0,0 +1,59 @@
+"""Tokenizes the sysinfo text clients send along with a report: one "key<TAB>value"
+pair per line, a value that spans lines continues on the lines without a tab. Keys
+like sys.path occur once per value.
+
+The text itself is only shown on the page of a single report, it is stored zlib
+compressed in its own table (ReportSysinfo) to keep the report rows small.
+"""
+import zlib
+
+from django.conf import settings
+from django.utils.encoding import force_bytes, smart_text
+
+ENVIRON_KEY = u"os.environ"
+# os.environ variables worth a breakdown, the others are mostly per-user paths and session ids
+DEFAULT_ENVIRON_KEYS = ('LANG', 'LANGUAGE', 'LC_ALL', 'LC_CTYPE', 'PYTHONIOENCODING', 'DESKTOP_SESSION',
+                        'PROCESSOR_ARCHITECTURE', 'NUMBER_OF_PROCESSORS')
+
+
+def parse_sysinfo(sysinfo):
+    """Returns the (key, value) pairs of a sysinfo text in a single pass over its lines.
+    """
+    pairs = []
+    for line in smart_text(sysinfo or "").split(u"\n"):
+        key, tab, value = line.partition(u"\t")
+        if tab:
+            pairs.append([key.strip(), value])
+        elif pairs:
+            pairs[-1][1] += u"\n" + line
+    return [(key, value.strip()) for key, value in pairs]
+
+
+def sysinfo_attributes(pairs):
+    """Returns the distinct (key, value) pairs to index, sorted. os.environ values become
+       os.environ.<NAME> keys, only for the variables in ERRORREPORTER_SYSINFO_ENVIRON_KEYS.
+    """
+    environ_keys = set(getattr(settings, 'ERRORREPORTER_SYSINFO_ENVIRON_KEYS', DEFAULT_ENVIRON_KEYS))
+    attributes = set()
+    for key, value in pairs:
+        if key == ENVIRON_KEY:
+            name, _, value = value.partition(u": ")
+            if name not in environ_keys:
+                continue
+            key = u"%s.%s" % (ENVIRON_KEY, name)
+        attributes.add((key[:100], value[:255]))
+    return sorted(attributes)
+
+
+def compress_sysinfo(sysinfo):
+    """Returns the zlib compressed UTF-8 encoding of a sysinfo text.
+    """
+    return zlib.compress(force_bytes(sysinfo or ""))
+
+
+def decompress_sysinfo(data, compressed=True):
+    """Returns the sysinfo text of stored data, as compressed by compress_sysinfo()
+       or uncompressed when converted from an old database.
+    """
+    data = bytes(data or b"")
+    return smart_text(zlib.decompress(data) if compressed and data else data)
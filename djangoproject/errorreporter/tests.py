@@ -1,3 +1,925 @@
-from django.test import TestCase
+import bz2
+import datetime
+import json
+import os
+import pickle
+import re
+import shutil
+import tempfile
+import time
+from xml.etree import ElementTree
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connections
+from django.db.backends.sqlite3.base import DatabaseWrapper
+from django.db.models import Count, Sum
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import override_settings
+from django.utils.encoding import force_bytes, smart_text
+from errorreporter import api, middleware, search, views
+from errorreporter.aggregation import aggregate_stacks, sysinfo_breakdown
+from errorreporter.api import arrival_timestamp
+from errorreporter.cache import GENERATION_ALL, bump_generations, cache_by_generation, date_generation, \
+    get_generation_cache, get_generations
+from errorreporter.flamegraph import render_svg
+from errorreporter.grouping import normalize_stack, normalized_fingerprint
+from errorreporter.ingest import ReportQueue
+from errorreporter.management.commands import backfill_stack_hashes
+from errorreporter.management.commands.import_reports import PKG_BLOCK_SIZE, Command, ExceptionLogParser, \
+    FlameGraphCreator, PackageError
+from errorreporter.models import CrashReport, ImportCheckpoint, ReportCount, ReportSysinfo, SearchDocument, \
+    StackCount, StackSignature, StackTrend, SysinfoCount
+from errorreporter.search import has_search_index, parse_query, scanned_matches, search_stacks, stack_matches
+from errorreporter.timeseries import bucket_starts, clamp_start, pick_granularity
+from errorreporter.trends import new_stacks, trending
+from errorreporter.stats import get_request_log
+
+
+def make_report(i, stack_count=7, sysinfo_size=2500):
+    """Returns report i the way the reporter pickles it: byte strings and a float timestamp.
+    """
+    return {'timestamp': 1400000000.0 + i, 'remote_host': '10.0.0.1',
+            'post': [('sysinfo', 'platform.details\tWindows-7\nplatform.machine\tx86\nos.environ\tX: %s\n'
+                      % ('y' * sysinfo_size)),
+                     ('comments', 'Not provided'),
+                     ('stack', 'Tribler version: 6.2.0\nTraceback (most recent call last):\n'
+                               '  File "Tribler/Main/tribler.py", line %d, in run\nKeyError: %d\n'
+                      % (i % stack_count, i % stack_count))]}
+
+
+def write_archive(path, reports, protocol=0):
+    """Writes reports to a bzip2 archive, pickled with the protocol of the reporter by default.
+    """
+    archive = bz2.BZ2File(path, 'w')
+    try:
+        for report in reports:
+            pickle.dump(report, archive, protocol)
+    finally:
+        archive.close()
+    return path
+
+
+class ArchiveTestCase(TestCase):
+    def setUp(self):
+        # the data generations start over with the test database, and so must what is cached on them
+        get_generation_cache().clear()
+        self.input_dir = tempfile.mkdtemp()
+        self.output_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.input_dir)
+        shutil.rmtree(self.output_dir)
+
+    def archive(self, count, date="20140501", first=0, protocol=0):
+        return write_archive(os.path.join(self.input_dir, "exception-%s.bz2" % date),
+                             [make_report(i) for i in range(first, first + count)], protocol)
+
+
+class ParallelImportTest(ArchiveTestCase):
+    def test_parallel_import_in_batches(self):
+        self.archive(1560, "20140501")
+        self.archive(300, "20140502", first=1560)
+        corrupt = os.path.join(self.input_dir, "exception-20140503.bz2")
+        archive = bz2.BZ2File(corrupt, 'w')
+        pickle.dump(make_report(1860), archive, 0)
+        archive.write("not a pickle")
+        archive.close()
+        Command().importReports(self.input_dir, self.output_dir, batch_size=200, workers=2)
+        self.assertEqual(CrashReport.objects.count(), 1860)
+        self.assertEqual(sorted(ImportCheckpoint.objects.values_list('records', 'finished')),
+                         [(0, False), (300, True), (1560, True)])
+        # the package that failed is left for the next run
+        self.assertEqual(sorted(os.listdir(self.input_dir)), ["exception-20140503.bz2", "parsed"])
+
+
+class CheckpointTest(ArchiveTestCase):
+    def test_resume_after_failed_batch(self):
+        self.archive(1560)
+        insert_batch = ExceptionLogParser.insert_batch
+        batches = []
+
+        def failing_insert_batch(parser, rows):
+            batches.append(len(rows))
+            if len(batches) == 3:
+                raise ValueError("disk full")
+            return insert_batch(parser, rows)
+
+        ExceptionLogParser.insert_batch = failing_insert_batch
+        try:
+            Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        finally:
+            ExceptionLogParser.insert_batch = insert_batch
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.records, checkpoint.finished), (1000, False))
+        self.assertEqual(CrashReport.objects.count(), 1000)
+
+        # the package stays in the input dir and the next run starts after the last committed batch
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertEqual((checkpoint.records, checkpoint.finished), (1560, True))
+        self.assertEqual(CrashReport.objects.count(), 1560)
+        self.assertEqual(ReportCount.objects.aggregate(Sum('count'))['count__sum'], 1560)
+
+    def test_finished_package_is_skipped(self):
+        path = self.archive(10)
+        Command().importReports(self.input_dir, self.output_dir)
+        shutil.move(os.path.join(self.input_dir, "parsed", os.path.basename(path)), path)
+        Command().importReports(self.input_dir, self.output_dir)
+        self.assertEqual(ImportCheckpoint.objects.get().records, 10)
+        self.assertEqual(CrashReport.objects.count(), 10)
+
+
+class DispersyImportTest(ArchiveTestCase):
+    def dispersy_report(self, i, timestamp=1400000000.0, version_line=""):
+        report = make_report(i)
+        report['timestamp'] = timestamp + i if timestamp is not None else None
+        report['post'][2] = ('stack', '%sTraceback (most recent call last):\nKeyError: %d\n' % (version_line, i))
+        return report
+
+    def import_dispersy(self, reports, name):
+        write_archive(os.path.join(self.input_dir, name), reports)
+        call_command('import_dispersy_reports', **{'input-dir': self.input_dir, 'output-dir': self.output_dir,
+                                                   'default-version': '5.9.0'})
+        return sorted(CrashReport.objects.values_list('date', 'version'))
+
+    def test_reports_are_dated_by_the_archive_name(self):
+        reports = [self.dispersy_report(0), self.dispersy_report(1, version_line="Dispersy version: 1.2\n")]
+        self.assertEqual([(str(date), version) for date, version in
+                          self.import_dispersy(reports, "exception-20140502.bz2")],
+                         [('2014-05-02', '1.2'), ('2014-05-02', '5.9.0')])
+
+    def test_reports_are_dated_by_their_timestamp_without_a_date_in_the_name(self):
+        reports = [self.dispersy_report(0), self.dispersy_report(86400, version_line="Tribler version: 6.3.1\n")]
+        self.assertEqual([(str(date), version) for date, version in
+                          self.import_dispersy(reports, "exception-dispersy.bz2")],
+                         [('2014-05-13', '5.9.0'), ('2014-05-14', '6.3.1')])
+
+    def test_reports_without_a_timestamp_are_skipped(self):
+        reports = [self.dispersy_report(0), self.dispersy_report(1, timestamp=None), self.dispersy_report(2)]
+        self.assertEqual(len(self.import_dispersy(reports, "exception-dispersy.bz2")), 2)
+        self.assertEqual(ImportCheckpoint.objects.get().finished, True)
+        self.assertEqual(os.listdir(self.input_dir), ["parsed"])
+
+
+class DedupTest(ArchiveTestCase):
+    def test_known_and_repeated_timestamps(self):
+        self.archive(100, "20140501")
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        # another archive repeats 50 known reports, and has each new one twice
+        reports = [make_report(i) for i in range(50, 150)] + [make_report(i) for i in range(100, 150)]
+        write_archive(os.path.join(self.input_dir, "exception-20140502.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir, batch_size=30, bulk=True)
+        self.assertEqual(CrashReport.objects.count(), 150)
+        self.assertEqual(ReportCount.objects.aggregate(Sum('count'))['count__sum'], 150)
+        self.assertEqual(StackSignature.objects.aggregate(Sum('total_count'))['total_count__sum'], 150)
+
+
+class BackfillStackHashesTest(ArchiveTestCase):
+    def test_merge_keeps_rollups(self):
+        # signatures converted from an old database, then the importer created new ones for the same stacks
+        self.archive(70, "20140501")
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        old = StackSignature.objects.order_by('id')[0]
+        StackSignature.objects.update(stack_hash=None)
+        StackSignature.objects.filter(id=old.id).update(first_report_id=None)
+        self.archive(70, "20140502", first=70)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        self.assertEqual(StackSignature.objects.count(), 14)
+
+        backfill_stack_hashes.Command().handle()
+        self.assertEqual(StackSignature.objects.count(), 7)
+        for signature in StackSignature.objects.all():
+            reports = CrashReport.objects.filter(signature=signature)
+            self.assertEqual(signature.total_count, 20)
+            self.assertEqual(reports.count(), 20)
+            self.assertEqual(signature.first_report_id, reports.order_by('id')[0].id)
+            self.assertEqual(list(ReportCount.objects.filter(signature=signature).order_by('date')
+                                  .values_list('date', 'count')),
+                             list(reports.order_by('date').values_list('date').annotate(Count('id'))))
+            self.assertEqual(StackCount.objects.filter(signature=signature, granularity='day')
+                             .aggregate(Sum('count'))['count__sum'], 20)
+            self.assertEqual(StackTrend.objects.get(signature=signature).days, 1)
+            self.assertEqual(SearchDocument.objects.get(signature=signature, field='sysinfo',
+                                                        text__startswith='platform.details').count, 20)
+
+
+class RollupTest(ArchiveTestCase):
+    def rollups(self):
+        return (sorted(ReportCount.objects.values_list('date', 'version', 'signature', 'os', 'machine', 'count')),
+                sorted(StackCount.objects.values_list('signature', 'granularity', 'start', 'count')),
+                sorted(SysinfoCount.objects.values_list('date', 'version', 'value', 'count')),
+                sorted(SearchDocument.objects.values_list('key', 'count')),
+                sorted((t.signature_id, t.first_version, t.last_date, t.last_count, t.days, round(t.mean, 9),
+                        round(t.variance, 9), round(t.score, 9)) for t in StackTrend.objects.all()))
+
+    def test_incremental_rollups_match_rebuilt_ones(self):
+        for day in range(3):
+            write_archive(os.path.join(self.input_dir, "exception-2014050%d.bz2" % (day + 1)),
+                          [make_report(i, stack_count=3 + day * 4) for i in range(day * 200, day * 200 + 200)])
+            Command().importReports(self.input_dir, self.output_dir, batch_size=70, bulk=True)
+        rollups = self.rollups()
+        self.assertEqual(sum(c[-1] for c in rollups[0]), 600)
+
+        for command in ('rebuild_report_counts', 'rebuild_stack_counts', 'rebuild_stack_trends',
+                        'rebuild_sysinfo_counts', 'rebuild_search_index'):
+            call_command(command)
+        self.assertEqual(self.rollups(), rollups)
+
+
+class TimeseriesTest(ArchiveTestCase):
+    def test_granularity_is_coarsened_past_max_points(self):
+        monday = datetime.date(2014, 1, 6)
+        day = datetime.timedelta(days=1)
+        self.assertEqual(pick_granularity(monday, monday + 399 * day), 'day')
+        self.assertEqual(pick_granularity(monday, monday + 400 * day), 'week')
+        self.assertEqual(pick_granularity(monday, monday + (400 * 7 - 1) * day), 'week')
+        self.assertEqual(pick_granularity(monday, monday + 400 * 7 * day), 'month')
+        self.assertEqual(pick_granularity(datetime.date(1900, 1, 1), datetime.date(2014, 1, 1)), 'month')
+        # a coarser granularity asked for is kept
+        self.assertEqual(pick_granularity(monday, monday + day, 'week'), 'week')
+
+    def test_buckets_are_aligned(self):
+        self.assertEqual(bucket_starts(datetime.date(2014, 5, 1), datetime.date(2014, 5, 3), 'day'),
+                         [datetime.date(2014, 5, 1), datetime.date(2014, 5, 2), datetime.date(2014, 5, 3)])
+        # weeks start on Monday
+        self.assertEqual(bucket_starts(datetime.date(2014, 5, 1), datetime.date(2014, 5, 19), 'week'),
+                         [datetime.date(2014, 4, 28), datetime.date(2014, 5, 5), datetime.date(2014, 5, 12),
+                          datetime.date(2014, 5, 19)])
+        self.assertEqual(bucket_starts(datetime.date(2013, 12, 15), datetime.date(2014, 2, 1), 'month'),
+                         [datetime.date(2013, 12, 1), datetime.date(2014, 1, 1), datetime.date(2014, 2, 1)])
+        self.assertEqual(bucket_starts(datetime.date(9999, 12, 5), datetime.date.max, 'month'),
+                         [datetime.date(9999, 12, 1)])
+
+    def test_start_is_clamped_to_max_points(self):
+        start = datetime.date(2000, 1, 1)
+        end = datetime.date(2014, 5, 22)
+        self.assertEqual(clamp_start(datetime.date(2014, 5, 1), end, 'day', 30), datetime.date(2014, 5, 1))
+        self.assertEqual(clamp_start(start, end, 'day', 10), datetime.date(2014, 5, 13))
+        self.assertEqual(clamp_start(start, end, 'week', 10), datetime.date(2014, 3, 17))
+        self.assertEqual(clamp_start(start, end, 'month', 12), datetime.date(2013, 6, 1))
+        for granularity in ('day', 'week', 'month'):
+            self.assertEqual(len(bucket_starts(clamp_start(start, end, granularity, 10), end, granularity)), 10)
+
+    def test_stacktrace_graphs(self):
+        self.archive(70)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        report = CrashReport.objects.order_by('id')[0]
+        response = self.client.get('/errorreporter/stacktrace_graphs/%d' % report.id)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.context['granularity'], response.context['total']), ('day', 10))
+        self.assertEqual(self.client.get('/errorreporter/stacktrace_graphs/%d' % (report.id + 1000)).status_code,
+                         404)
+
+
+class TrendTest(ArchiveTestCase):
+    def day(self, day, stacks):
+        """Writes the archive of 2014-05-<day> with the given (exception, version, count) reports."""
+        reports = []
+        for exception, version, count in stacks:
+            for _ in range(count):
+                report = make_report(day * 1000 + len(reports))
+                report['post'][2] = ('stack', 'Tribler version: %s\nTraceback (most recent call last):\n'
+                                              'KeyError: %s\n' % (version, exception))
+                reports.append(report)
+        write_archive(os.path.join(self.input_dir, "exception-201405%02d.bz2" % day), reports)
+
+    def setUp(self):
+        super(TrendTest, self).setUp()
+        for day in range(1, 11):
+            self.day(day, [('steady', '6.2.0', 3), ('spiky', '6.2.0', 3)])
+        # the first report of the new stack decides its first version, not the lowest version
+        self.day(11, [('steady', '6.2.0', 3), ('spiky', '6.2.0', 30), ('new', '6.3.1', 4), ('new', '6.3.0', 2)])
+        Command().importReports(self.input_dir, self.output_dir, batch_size=50, bulk=True)
+
+    def exceptions(self, trends):
+        return [t.signature.stack.splitlines()[-1] for t in trends]
+
+    def test_trending_and_new_stacks(self):
+        self.assertEqual(self.exceptions(trending(datetime.date(2014, 5, 11), 10)), ['KeyError: spiky'])
+        self.assertEqual(trending(datetime.date(2014, 5, 10), 10), [])
+        new = new_stacks(10, date=datetime.date(2014, 5, 11))
+        self.assertEqual(self.exceptions(new), ['KeyError: new'])
+        self.assertEqual(new[0].first_version, '6.3.1')
+        self.assertEqual(self.exceptions(new_stacks(10, version='6.3.1')), ['KeyError: new'])
+        self.assertEqual(new_stacks(10, version='6.3.0'), [])
+        self.assertEqual(sorted(self.exceptions(new_stacks(10, date=datetime.date(2014, 5, 1)))),
+                         ['KeyError: spiky', 'KeyError: steady'])
+
+        # rebuilding them from the stack counts gives the same first versions and scores
+        trends = sorted(StackTrend.objects.values_list('signature', 'first_version', 'score'))
+        call_command('rebuild_stack_trends')
+        self.assertEqual(sorted(StackTrend.objects.values_list('signature', 'first_version', 'score')), trends)
+
+    def test_trending_api(self):
+        data = json.loads(self.client.get('/errorreporter/api/trending').content)
+        self.assertEqual(data['date'], '2014-05-11')
+        self.assertEqual([(t['exception'], t['count']) for t in data['trending']], [('KeyError: spiky', 30)])
+        self.assertGreaterEqual(data['trending'][0]['score'], 3)
+        self.assertEqual([(t['exception'], t['first_version'], t['total']) for t in data['new']],
+                         [('KeyError: new', '6.3.1', 6)])
+
+        data = json.loads(self.client.get('/errorreporter/api/trending', {'version': '6.2.0', 'limit': 1}).content)
+        self.assertEqual((len(data['trending']), len(data['new'])), (1, 1))
+        data = json.loads(self.client.get('/errorreporter/api/trending', {'date': '2014-05-05'}).content)
+        self.assertEqual((data['trending'], data['new']), ([], []))
+        self.assertEqual(self.client.get('/errorreporter/api/trending', {'date': 'May 5'}).status_code, 404)
+        self.assertEqual(self.client.get('/errorreporter/trending').status_code, 200)
+
+
+class SysinfoTest(ArchiveTestCase):
+    SYSINFO = [
+        None,
+        "",
+        "platform.details\tWindows-7-6.1.7601-SP1\nplatform.machine\tAMD64\n",
+        "python.version\t2.7.5\nplatform.machine\t  x86  \r\nplatform.details\tLinux-3.13\n",
+        # a value that continues on the lines after it
+        "sys.path\tC:\\Tribler\nC:\\Python27\nplatform.details\tDarwin-13.1.0\nplatform.machine\ti386\n",
+        "os.environ\tLANG: en_US.UTF-8\nos.environ\tHOME: /home/user\nplatform.details\tLinux\n",
+        "platform.machine\tx86\nplatform.machine\tAMD64\n",
+    ]
+
+    def test_os_and_machine_match_the_old_regexes(self):
+        parser = ExceptionLogParser()
+        for sysinfo in self.SYSINFO:
+            fields = parser.report_fields({u'timestamp': 1400000000.0, u'stack': None, u'sysinfo': sysinfo,
+                                           u'comments': None}, "2014-05-01")
+            for key, column in (('platform.details', 'os'), ('platform.machine', 'machine')):
+                details = re.findall(key + '(.*?)\n', sysinfo or "", re.S)
+                self.assertEqual(fields[column], details[0].strip() if details else "", (sysinfo, key))
+
+    def test_breakdown_by_sysinfo_key(self):
+        reports = [make_report(i) for i in range(30)]
+        for report in reports[:10]:
+            report['post'][0] = ('sysinfo', 'platform.machine\tAMD64\nos.environ\tLANG: nl_NL\n'
+                                            'os.environ\tHOME: /home/user\n')
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+
+        self.assertEqual([(s['value'], s['cnt']) for s in sysinfo_breakdown('platform.machine', date='2014-05-01')],
+                         [('AMD64', 10), ('x86', 20)])
+        self.assertEqual([(s['value'], s['cnt']) for s in sysinfo_breakdown('platform.machine', 'AMD64', 1)],
+                         [('x86', 20)])
+        self.assertEqual([s['value'] for s in sysinfo_breakdown('os.environ.LANG')], ['nl_NL'])
+        # only the os.environ variables worth a breakdown are counted
+        self.assertEqual(sysinfo_breakdown('os.environ.HOME'), [])
+
+        response = self.client.get('/errorreporter/api/date/2014-05-01/breakdown/sysinfo/platform.machine?limit=1')
+        data = json.loads(response.content)
+        self.assertEqual((data['results'][0]['value'], data['next']), ('AMD64', 'AMD64'))
+        response = self.client.get('/errorreporter/api/date/2014-05-01/breakdown/sysinfo/platform.machine',
+                                   {'limit': 1, 'after': data['next']})
+        data = json.loads(response.content)
+        self.assertEqual(([r['value'] for r in data['results']], data['next']), (['x86'], None))
+
+    def test_compressed_sysinfo_round_trips(self):
+        reports = [make_report(i) for i in range(3)]
+        reports[1]['post'][0] = ('sysinfo', u'platform.details\tWindows-7\nos.environ\tUSERNAME: J\xfcrgen\n'
+                                            .encode('utf-8'))
+        reports[2]['post'][0] = ('sysinfo', None)
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir)
+        texts = [smart_text(dict(report['post'])['sysinfo'] or "") for report in reports]
+        self.assertEqual([r.sysinfo for r in CrashReport.objects.order_by('timestamp')], texts)
+        self.assertTrue(all(s.compressed for s in ReportSysinfo.objects.all()))
+
+        # sysinfo copied over from an old database is stored as it was until compress_sysinfo runs
+        for report in CrashReport.objects.all():
+            ReportSysinfo.objects.filter(report=report).update(data=force_bytes(report.sysinfo), compressed=False)
+        self.assertEqual([r.sysinfo for r in CrashReport.objects.order_by('timestamp')], texts)
+        call_command('compress_sysinfo')
+        self.assertFalse(ReportSysinfo.objects.filter(compressed=False).exists())
+        self.assertEqual([r.sysinfo for r in CrashReport.objects.order_by('timestamp')], texts)
+
+
+class AggregateStacksTest(ArchiveTestCase):
+    def pages(self, limit, group=None):
+        stacks = []
+        after = None
+        while True:
+            page, after = aggregate_stacks({'date': '2014-05-01'}, after, limit, group)
+            stacks.extend((s['cnt'], s['stack_hash']) for s in page)
+            if after is None:
+                return stacks
+
+    def test_pages_follow_new_reports(self):
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"),
+                      [make_report(i, stack_count=1 + i % 7) for i in range(100)])
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        stacks = self.pages(3)
+        self.assertEqual(sum(cnt for cnt, _ in stacks), 100)
+        self.assertEqual(stacks, sorted(stacks, key=lambda s: -s[0]))
+        self.assertEqual(self.pages(100), stacks)
+        self.assertEqual(sum(cnt for cnt, _ in self.pages(2, 'cluster')), 100)
+        # the stacks only differ in line numbers and the number in the message
+        self.assertEqual(self.pages(2, 'normalized'), [(100, stacks[0][1])])
+
+        # the cached order of the date is replaced when its reports change
+        self.archive(10, "20140501", first=100)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        self.assertEqual(sum(cnt for cnt, _ in self.pages(3)), 110)
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                                       'LOCATION': 'errorreporter-tests'}})
+class CacheByGenerationTest(TestCase):
+    def setUp(self):
+        get_generation_cache().clear()
+        self.calls = []
+
+        @cache_by_generation(lambda status: [GENERATION_ALL])
+        def view(request, status):
+            self.calls.append(status)
+            return HttpResponse("page %d" % len(self.calls), status=status)
+        self.view = view
+
+    def get(self, path, status=200):
+        return self.view(RequestFactory().get(path), status).content
+
+    def test_pages_are_cached_until_their_generation_is_bumped(self):
+        self.assertEqual(self.get("/a"), "page 1")
+        self.assertEqual(self.get("/a"), "page 1")
+        self.assertEqual(self.get("/b"), "page 2")
+        self.assertEqual(len(self.calls), 2)
+
+        bump_generations([GENERATION_ALL])
+        self.assertEqual(self.get("/a"), "page 3")
+        self.assertEqual(self.get("/a"), "page 3")
+        self.assertEqual(len(self.calls), 3)
+
+    def test_errors_are_not_cached(self):
+        self.get("/missing", 404)
+        self.get("/missing", 404)
+        self.assertEqual(self.calls, [404, 404])
+
+
+class FlameGraphTest(ArchiveTestCase):
+    def graphs(self):
+        """Returns {file name: (mtime, inode)} of the graphs in the output dir, and backdates them so
+           a graph rendered again gets a different mtime.
+        """
+        graphs = {}
+        for name in os.listdir(self.output_dir):
+            path = os.path.join(self.output_dir, name)
+            graphs[name] = (os.stat(path).st_mtime, os.stat(path).st_ino)
+            os.utime(path, (1000000000, 1000000000))
+        return graphs
+
+    def test_graphs_are_rendered_when_their_generation_changes(self):
+        self.archive(10, "20140501")
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        Command().generateFlamegraphs(self.output_dir)
+        self.assertEqual(sorted(self.graphs()), ["fg_d2014-05-01.svg", "fg_v6_2_0.svg"])
+        # a reader that opened the version graph keeps the complete old file
+        os.link(os.path.join(self.output_dir, "fg_v6_2_0.svg"), os.path.join(self.input_dir, "reader.svg"))
+        old_graph = open(os.path.join(self.input_dir, "reader.svg")).read()
+
+        self.archive(10, "20140502", first=10)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        Command().generateFlamegraphs(self.output_dir)
+        graphs = self.graphs()
+        self.assertEqual(sorted(graphs), ["fg_d2014-05-01.svg", "fg_d2014-05-02.svg", "fg_v6_2_0.svg"])
+        # 2014-05-01 got no reports, the version did
+        self.assertEqual(graphs["fg_d2014-05-01.svg"][0], 1000000000)
+        self.assertNotEqual(graphs["fg_v6_2_0.svg"][0], 1000000000)
+        # the new graph was renamed into place, not written over the old one
+        self.assertNotEqual(graphs["fg_v6_2_0.svg"][1], os.stat(os.path.join(self.input_dir, "reader.svg")).st_ino)
+        self.assertEqual(open(os.path.join(self.input_dir, "reader.svg")).read(), old_graph)
+        self.assertNotEqual(open(os.path.join(self.output_dir, "fg_v6_2_0.svg")).read(), old_graph)
+
+        Command().generateFlamegraphs(self.output_dir)
+        self.assertEqual([mtime for mtime, _ in self.graphs().values()], [1000000000] * 3)
+        Command().generateFlamegraphs(self.output_dir, rebuild_all=True)
+        self.assertNotIn(1000000000, [mtime for mtime, _ in self.graphs().values()])
+
+
+def parse_stacktrace(stacktrace, sep):
+    """The StacktraceParser.parse the flame graphs collapsed stacks with before import_reports did it."""
+    lines = stacktrace.split(sep)
+    p = re.compile(r'File \"(.*)\", line (.*), in (.*)', re.M)
+    result = ""
+    for l in lines:
+        match = re.search(p, l)
+        if not match:
+            continue
+        stack_file = match.group(1)
+        function = match.group(3)
+        if result is not "":
+            result = "%s;%s:%s" % (result, stack_file, function)
+        else:
+            result = "%s:%s" % (stack_file, function)
+    return result
+
+
+class CollapseStackTest(ArchiveTestCase):
+    STACKS = [u'Traceback (most recent call last):\n  File "Tribler/Main/tribler.py", line 3, in run\nKeyError: 3\n',
+              u'Traceback (most recent call last):\n  File "Tribler/Core/Session.py", line 10, in start\n'
+              u'    self.lm.start()\n  File "Tribler/Core/APIImplementation/LaunchManyCore.py", line 95, in start\n'
+              u'ValueError: bad port\n\nDuring handling of the above exception, another exception occurred:\n\n'
+              u'Traceback (most recent call last):\n  File "Tribler/Main/tribler.py", line 12, in <module>\n'
+              u'    run()\nSystemExit: 1\n',
+              u'  File "C:\\Program Files\\Tribler;old\\x.py", line 1, in f\n  File "y.py", line 2, in g\n',
+              u'']
+
+    def test_collapsed_stacks_match_the_old_parser(self):
+        reports = []
+        for i, stack in enumerate(self.STACKS):
+            report = make_report(i)
+            report['post'][2] = ('stack', (u"Tribler version: 6.2.0\n" + stack).encode('utf-8'))
+            reports.append(report)
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        signatures = list(StackSignature.objects.order_by('id'))
+        self.assertEqual(sorted(s.stack for s in signatures), sorted(self.STACKS))
+        # signatures imported before the collapsed form was kept are collapsed by the flame graph step
+        StackSignature.objects.filter(stack=self.STACKS[1]).update(collapsed=None)
+
+        creator = FlameGraphCreator()
+        frames = creator.frames(s.id for s in signatures)
+        counts = [(frames[s.id], i + 1) for i, s in enumerate(signatures)]
+        creator.generateSvg = lambda txt_path: None
+        with self.settings(FLAMEGRAPH_BACKEND='perl'):
+            creator.render(os.path.join(self.output_dir, "fg_d2014-05-01.svg"), counts)
+        self.assertEqual(open(os.path.join(self.output_dir, "fg_d2014-05-01.txt")).read().decode('utf-8'),
+                         u"".join(u"%s %d\n" % (parse_stacktrace(s.stack.replace('\n', ';'), ';'), i + 1)
+                                  for i, s in enumerate(signatures)))
+
+
+class FramesTest(ArchiveTestCase):
+    def setUp(self):
+        super(FramesTest, self).setUp()
+        # stack k passes through session.py if k is odd and through start() if k < 3, and has k + 1 reports
+        reports = []
+        for k in range(6):
+            for _ in range(k + 1):
+                report = make_report(len(reports))
+                report['post'][2] = ('stack', 'Tribler version: 6.2.0\nTraceback (most recent call last):\n'
+                                              '  File "Tribler/Main/tribler.py", line 1, in run\n'
+                                              '  File "Tribler/Core/%s.py", line %d, in %s\nKeyError: %d\n'
+                                     % ("session" if k % 2 else "download", k, "start" if k < 3 else "stop", k))
+                reports.append(report)
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+
+    def api(self, **params):
+        response = self.client.get("/errorreporter/api/frames", params)
+        self.assertEqual(response.status_code, 200)
+        data = json.loads(response.content)
+        return [s['total_count'] for s in data['results']], data['next']
+
+    def test_filter_by_file(self):
+        self.assertEqual(self.api(file="Tribler/Core/session.py"), ([6, 4, 2], None))
+        response = self.client.get("/errorreporter/frames", {'file': "Tribler/Core/session.py"})
+        self.assertEqual((response.context['stacks'], response.context['total']), (3, 12))
+        self.assertEqual([s['frames'] for s in response.context['crashreports']],
+                         [[{'file': "Tribler/Core/session.py", 'line': k, 'function': function}]
+                          for k, function in ((5, "stop"), (3, "stop"), (1, "start"))])
+
+    def test_filter_by_function(self):
+        self.assertEqual(self.api(function="start"), ([3, 2, 1], None))
+        self.assertEqual(self.api(file="Tribler/Core/session.py", function="start"), ([2], None))
+        self.assertEqual(self.client.get("/errorreporter/api/frames").status_code, 404)
+
+    def test_pages(self):
+        first, after = self.api(file="Tribler/Main/tribler.py", limit=4)
+        self.assertEqual(first, [6, 5, 4, 3])
+        self.assertEqual(after.split(":")[0], "3")
+        self.assertEqual(self.api(file="Tribler/Main/tribler.py", limit=4, after=after), ([2, 1], None))
+        self.assertEqual(self.client.get("/errorreporter/api/frames", {'file': "x", 'after': "3"}).status_code, 404)
+
+        response = self.client.get("/errorreporter/frames", {'file': "Tribler/Main/tribler.py", 'limit': 4})
+        self.assertEqual(response.context['next'], after)
+        response = self.client.get("/errorreporter/frames", {'file': "Tribler/Main/tribler.py", 'limit': 4,
+                                                               'after': after})
+        self.assertEqual([s['total_count'] for s in response.context['crashreports']], [2, 1])
+        self.assertIsNone(response.context['next'])
+
+
+class RenderSvgTest(SimpleTestCase):
+    def test_frames_of_collapsed_stacks(self):
+        svg = render_svg([((u"run", u"it's <here> & \\there"), 2), ((u"run", u"other"), 1), ((u"main",), 1)],
+                         u"Flame 'graph'")
+        frames = ElementTree.fromstring(svg.encode('utf-8')).findall('{http://www.w3.org/2000/svg}g')
+        # all, run, main and the two frames called by run
+        self.assertEqual(len(frames), 5)
+        frame = [f for f in frames if f.find('{http://www.w3.org/2000/svg}title').text.startswith(u"it's")][0]
+        info = u"it's <here> & \\there (2 samples, 50.00%)"
+        self.assertEqual(frame.find('{http://www.w3.org/2000/svg}title').text, info)
+        # the handler is one JavaScript string literal that evaluates to the frame info
+        handler = frame.get('onmouseover')
+        self.assertTrue(handler.startswith(u"s('") and handler.endswith(u"')"))
+        literal = handler[3:-2]
+        self.assertNotIn(u"'", literal)
+        self.assertEqual(literal.encode('ascii').decode('unicode_escape'), info)
+
+
+class BlockUnpicklerTest(ArchiveTestCase):
+    def test_protocol_0_reports_across_blocks(self):
+        # protocol 0 strings cut at a block edge fail with ValueError, not EOFError
+        path = self.archive(1560)
+        self.assertGreater(1560 * 2500, 4 * PKG_BLOCK_SIZE)
+        reports = list(ExceptionLogParser().iter_report_offsets(path, strict=True))
+        self.assertEqual(len(reports), 1560)
+        self.assertEqual([r[u'timestamp'] for r, _ in reports], [1400000000.0 + i for i in range(1560)])
+
+    def test_protocol_2_reports_across_blocks(self):
+        path = self.archive(1560, protocol=2)
+        self.assertEqual(len(list(ExceptionLogParser().iter_report_offsets(path, strict=True))), 1560)
+
+    def test_resume_from_offset(self):
+        path = self.archive(1560)
+        reports = list(ExceptionLogParser().iter_report_offsets(path, strict=True))
+        rest = list(ExceptionLogParser().iter_report_offsets(path, reports[999][1], strict=True))
+        self.assertEqual([r for r, _ in rest], [r for r, _ in reports[1000:]])
+
+    def test_corrupt_package(self):
+        path = os.path.join(self.input_dir, "exception-20140501.bz2")
+        archive = bz2.BZ2File(path, 'w')
+        pickle.dump(make_report(0), archive, 0)
+        archive.write("S'not a pickle\n" * (PKG_BLOCK_SIZE // 8))
+        archive.close()
+        parser = ExceptionLogParser()
+        parser._logger.disabled = True
+        self.assertEqual(len(list(parser.iter_report_offsets(path))), 1)
+        with self.assertRaises(PackageError):
+            list(parser.iter_report_offsets(path, strict=True))
+
+    def test_bulk_import_protocol_0(self):
+        self.archive(1560)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        self.assertEqual(CrashReport.objects.count(), 1560)
+        checkpoint = ImportCheckpoint.objects.get()
+        self.assertTrue(checkpoint.finished)
+        self.assertEqual(checkpoint.records, 1560)
+
+
+class RequestStatsTest(ArchiveTestCase):
+    def get(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return get_request_log().entries()[-1]
+
+    def test_queries_and_rendering_are_timed(self):
+        self.archive(20)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+
+        # the report counts are queried while the template renders, that is SQL time, not render time
+        entry = self.get('/errorreporter/overview_crashreport_daily')
+        self.assertEqual((entry['view'], entry['status'], entry['queries']),
+                         ('views.overview_crashreport_daily', 200, 2))
+        self.assertGreater(entry['sql_ms'], 0)
+        self.assertGreater(entry['render_ms'], 0)
+        self.assertAlmostEqual(entry['total_ms'], entry['sql_ms'] + entry['render_ms'] + entry['python_ms'])
+
+        # the rendered page came from the cache
+        entry = self.get('/errorreporter/overview_crashreport_daily')
+        self.assertEqual((entry['queries'], entry['render_ms']), (1, 0))
+
+
+class ReadSnapshotTest(SimpleTestCase):
+    """Reads in a snapshot while another connection commits, on a database file in WAL mode."""
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        settings_dict = dict(connections.databases['default'], NAME=os.path.join(self.dir, "db.sqlite3"),
+                             OPTIONS={'timeout': 1})
+        self.reader = DatabaseWrapper(dict(settings_dict), 'reader')
+        self.writer = DatabaseWrapper(dict(settings_dict), 'writer')
+        self.writer.cursor().execute("CREATE TABLE report (id INTEGER PRIMARY KEY)")
+        self.writer.cursor().execute("INSERT INTO report VALUES (1)")
+
+    def tearDown(self):
+        self.reader.close()
+        self.writer.close()
+        shutil.rmtree(self.dir)
+
+    def count(self):
+        cursor = self.reader.cursor()
+        cursor.execute("SELECT COUNT(*) FROM report")
+        return cursor.fetchone()[0]
+
+    def test_page_reads_one_snapshot(self):
+        cursor = self.writer.cursor()
+        cursor.execute("PRAGMA journal_mode")
+        self.assertEqual(cursor.fetchone()[0], "wal")
+
+        request = RequestFactory().get("/")
+        snapshot = middleware.ReadSnapshotMiddleware()
+        default = middleware.connections
+        middleware.connections = {'default': self.reader}
+        try:
+            snapshot.process_view(request, views.index, (), {})
+            self.assertEqual(self.count(), 1)
+            # the import commits while the page is read, without waiting for it
+            self.writer.cursor().execute("INSERT INTO report VALUES (2)")
+            self.assertEqual(self.count(), 1)
+            snapshot.process_response(request, None)
+        finally:
+            middleware.connections = default
+        self.assertEqual(self.count(), 2)
+
+    def test_writes_are_left_alone(self):
+        request = RequestFactory().post("/")
+        default = middleware.connections
+        middleware.connections = {'default': self.reader}
+        try:
+            middleware.ReadSnapshotMiddleware().process_view(request, views.index, (), {})
+        finally:
+            middleware.connections = default
+        self.assertFalse(hasattr(request, '_errorreporter_snapshot'))
+        self.assertTrue(self.reader.get_autocommit())
+
+
+class ClusterMergeTest(ArchiveTestCase):
+    def test_merge_invalidates_earlier_dates(self):
+        self.archive(70, "20140501")
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        self.assertEqual(StackSignature.objects.values('cluster').distinct().count(), 1)
+        # split off a stack, as if it had been clustered apart
+        split = StackSignature.objects.order_by('-id')[0]
+        StackSignature.objects.filter(id=split.id).update(cluster=split.id)
+        generation, = get_generations([date_generation("2014-05-01")])
+
+        # a new stack similar to both joins them again, which changes how the reports of 2014-05-01 group
+        write_archive(os.path.join(self.input_dir, "exception-20140502.bz2"),
+                      [make_report(1007, stack_count=1000)])
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+        self.assertEqual(StackSignature.objects.values('cluster').distinct().count(), 1)
+        self.assertEqual(get_generations([date_generation("2014-05-01")]), [generation + 1])
+
+
+class NormalizeStackTest(SimpleTestCase):
+    WINDOWS = ('Traceback (most recent call last):\n'
+               '  File "C:\\Program Files\\Tribler\\Tribler\\Core\\Session.py", line 120, in start\n'
+               '    self.lm.start()\n'
+               '  File "C:\\Python27\\lib\\site-packages\\twisted\\internet\\defer.py", line 45, in callback\n'
+               '    raise ValueError(x)\n'
+               'ValueError: object at 0x7f3a2c10 has 3 peers\n')
+    LINUX = ('Traceback (most recent call last):\n'
+             '  File "/usr/share/tribler/Tribler/Core/Session.pyc", line 98, in start\n'
+             '    self.lm.start()  # another build\n'
+             '  File "/usr/lib/python2.7/dist-packages/twisted/internet/defer.py", line 50, in callback\n'
+             '    raise ValueError(y)\n'
+             'ValueError: object at 0x0000aaaa has 12 peers\n')
+
+    def test_line_numbers_paths_and_addresses_are_dropped(self):
+        normalized = (u"tribler/core/session.py:start\n"
+                      u"twisted/internet/defer.py:callback\n"
+                      u"ValueError: object at <addr> has <n> peers")
+        self.assertEqual(normalize_stack(self.WINDOWS), normalized)
+        self.assertEqual(normalize_stack(self.LINUX), normalized)
+        self.assertEqual(normalized_fingerprint(self.WINDOWS), normalized_fingerprint(self.LINUX))
+        self.assertNotEqual(normalized_fingerprint(self.LINUX),
+                            normalized_fingerprint(self.LINUX.replace("ValueError: object", "KeyError: object")))
+
+    def test_volatile_parts_of_the_message(self):
+        self.assertEqual(normalize_stack("IOError: [Errno 2] No such file or directory: '/home/user/.Tribler/x.db'"),
+                         u"IOError: [Errno <n>] No such file or directory: '<path>'")
+        self.assertEqual(normalize_stack("KeyError: 'c0ffee00c0ffee00c0ffee00' 123e4567-e89b-12d3-a456-426614174000"),
+                         u"KeyError: '<hex>' <uuid>")
+        self.assertEqual((normalize_stack(None), normalize_stack("")), (u"", u""))
+
+
+class SearchTest(ArchiveTestCase):
+    def setUp(self):
+        super(SearchTest, self).setUp()
+        reports = [make_report(i) for i in range(14)]
+        for report in reports[:7]:
+            report['post'][1] = ('comments', 'Crashed on startup')
+        write_archive(os.path.join(self.input_dir, "exception-20140501.bz2"), reports)
+        Command().importReports(self.input_dir, self.output_dir, bulk=True)
+
+    def test_terms_match_across_documents(self):
+        self.assertTrue(has_search_index())
+        # KeyError is in the stack, startup in a comment and Windows in the sysinfo of the same stack
+        results = search_stacks(u"KeyError startup Windows")
+        self.assertEqual(len(results), 7)
+        for stack in results:
+            self.assertTrue(stack['stack_matches'])
+            self.assertEqual(sorted(t['field'] for t in stack['texts']), ['comments', 'sysinfo'])
+            self.assertGreater(stack['score'], 0.0)
+        self.assertEqual(search_stacks(u"KeyError startup nothere"), [])
+
+    def test_common_terms_are_looked_up_within_the_stacks_found(self):
+        max_matches = search.MAX_MATCHES
+        search.MAX_MATCHES = 5
+        try:
+            results = search_stacks(u'startup KeyError "line 3"')
+        finally:
+            search.MAX_MATCHES = max_matches
+        self.assertEqual([stack['exception'] for stack in results], ["KeyError: 3"])
+
+    def test_scanned_matches_across_documents(self):
+        matches = stack_matches(parse_query(u"keyerror STARTUP"), scanned_matches)
+        self.assertEqual(len(matches), 7)
+        self.assertEqual([score for _, score, _ in matches], [0.0] * 7)
+        self.assertEqual(stack_matches(parse_query(u"keyerror nothere"), scanned_matches), [])
+
+
+class ArrivalTimestampTest(TestCase):
+    def test_unique_and_kept_by_import(self):
+        timestamps = [arrival_timestamp() for _ in range(1000)]
+        self.assertEqual(len(set(timestamps)), 1000)
+        self.assertEqual(timestamps, sorted(timestamps))
+        parser = ExceptionLogParser()
+        rows = [parser.report_fields({u'timestamp': t, u'stack': None, u'sysinfo': None, u'comments': None},
+                                     "2014-05-01") for t in timestamps]
+        self.assertEqual(parser.insert_rows(rows), 1000)
+
+
+class RecordingQueue(ReportQueue):
+    """Records the batches the writer thread flushes instead of writing them, failing the first ones
+       and all of them while it is broken.
+    """
+    def __init__(self, *args, **kwargs):
+        self.batches = []
+        self.failures = kwargs.pop('failures', 0)
+        self.broken = False
+        super(RecordingQueue, self).__init__(*args, **kwargs)
+
+    def _write(self, rows):
+        if self.failures or self.broken:
+            self.failures = max(0, self.failures - 1)
+            return False
+        self.batches.append(rows)
+        return True
+
+    def timestamps(self):
+        return [[row['timestamp'] for row in batch] for batch in self.batches]
+
+
+class ReportQueueTest(SimpleTestCase):
+    def report(self, i):
+        return {u'timestamp': "%d" % i, u'stack': None, u'sysinfo': None, u'comments': None}
+
+    def test_flushes_full_batches_and_the_rest_on_stop(self):
+        queue = RecordingQueue(100, 5, 60)
+        for i in range(12):
+            self.assertTrue(queue.put(self.report(i), "2014-05-01"))
+        queue.stop()
+        self.assertEqual([len(batch) for batch in queue.batches], [5, 5, 2])
+        self.assertEqual(sum(queue.timestamps(), []), ["%d" % i for i in range(12)])
+
+    def test_flushes_after_interval(self):
+        queue = RecordingQueue(100, 500, 0.05)
+        for i in range(3):
+            queue.put(self.report(i), "2014-05-01")
+        deadline = time.time() + 5
+        while not queue.batches and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(queue.timestamps(), [["0", "1", "2"]])
+        queue.stop()
+
+    def test_failed_batches_are_retried(self):
+        queue = RecordingQueue(100, 5, 60, retry_delay=0.01, failures=3)
+        for i in range(7):
+            queue.put(self.report(i), "2014-05-01")
+        deadline = time.time() + 5
+        while not queue.batches and time.time() < deadline:
+            time.sleep(0.01)
+        queue.stop()
+        self.assertEqual(queue.timestamps(), [["0", "1", "2", "3", "4"], ["5", "6"]])
+
+    def test_full_queue_refuses_reports(self):
+        # the writer keeps the batch it can't write, so the next reports fill the queue
+        queue = RecordingQueue(2, 500, 0.01, retry_delay=0.01)
+        queue.broken = True
+        accepted = 0
+        deadline = time.time() + 5
+        while queue.put(self.report(accepted), "2014-05-01") and time.time() < deadline:
+            accepted += 1
+        self.assertLess(time.time(), deadline)
+        # once the database is back every accepted report is written
+        queue.broken = False
+        queue.stop()
+        self.assertEqual(sum(queue.timestamps(), []), ["%d" % i for i in range(accepted)])
+
+
+class ReportViewTest(TestCase):
+    def post(self, queue, **fields):
+        get_report_queue = api.get_report_queue
+        api.get_report_queue = lambda: queue
+        try:
+            return self.client.post("/errorreporter/api/report", dict(stack="Traceback", **fields))
+        finally:
+            api.get_report_queue = get_report_queue
+
+    def test_client_timestamps_are_kept(self):
+        queue = RecordingQueue(100, 500, 60)
+        for timestamp in ("1400000000.123456", "1400000000.127", "1400000000.12"):
+            self.assertEqual(self.post(queue, timestamp=timestamp).status_code, 202)
+        self.assertEqual(self.post(queue, timestamp="yesterday").status_code, 400)
+        queue.stop()
+        self.assertEqual(queue.timestamps(), [["1400000000.123456", "1400000000.127", "1400000000.12"]])
+        self.assertEqual(ExceptionLogParser().insert_rows(queue.batches[0]), 3)
+
+    def test_full_queue_answers_503(self):
+        queue = RecordingQueue(1, 500, 60)
+        queue.broken = True
+        deadline = time.time() + 5
+        response = self.post(queue)
+        while response.status_code == 202 and time.time() < deadline:
+            response = self.post(queue)
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], "10")
+        queue.broken = False
+        queue.stop()
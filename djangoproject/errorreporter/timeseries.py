@@ -0,0 +1,111 @@
+"""Report counts of stacks over time, per day, week (starting on Monday) or month. The
+importer keeps a StackCount per stack and bucket of each granularity, so a series is
+read from at most max_points rows per stack however many reports it covers.
+"""
+import datetime
+
+from errorreporter.models import StackCount
+
+GRANULARITIES = ('day', 'week', 'month')
+DEFAULT_MAX_POINTS = 400
+
+
+def bucket_start(date, granularity):
+    """Returns the first day of the bucket of the given granularity that date falls in.
+    """
+    if granularity == 'week':
+        return date - datetime.timedelta(days=date.weekday())
+    if granularity == 'month':
+        return date.replace(day=1)
+    return date
+
+
+def next_bucket(start, granularity):
+    if granularity == 'week':
+        return start + datetime.timedelta(days=7)
+    if granularity == 'month':
+        return datetime.date(start.year + start.month // 12, start.month % 12 + 1, 1)
+    return start + datetime.timedelta(days=1)
+
+
+def bucket_starts(start, end, granularity):
+    """Returns the starts of the buckets of the given granularity from start to end, inclusive.
+    """
+    starts = []
+    current = bucket_start(start, granularity)
+    while current <= end:
+        starts.append(current)
+        try:
+            current = next_bucket(current, granularity)
+        except (ValueError, OverflowError):
+            # end is in the last bucket before date.max
+            break
+    return starts
+
+
+def point_count(start, end, granularity):
+    if granularity == 'week':
+        return (bucket_start(end, 'week') - bucket_start(start, 'week')).days // 7 + 1
+    if granularity == 'month':
+        return (end.year - start.year) * 12 + end.month - start.month + 1
+    return (end - start).days + 1
+
+
+def pick_granularity(start, end, granularity=None, max_points=DEFAULT_MAX_POINTS):
+    """Returns the given granularity, or the finest one if None, coarsened until the range
+       from start to end has at most max_points buckets. Months are as coarse as it gets.
+    """
+    candidates = GRANULARITIES[GRANULARITIES.index(granularity or 'day'):]
+    for candidate in candidates:
+        if point_count(start, end, candidate) <= max_points:
+            return candidate
+    return candidates[-1]
+
+
+def to_date(value):
+    """Returns a date of a date, datetime or "YYYY-MM-DD..." string.
+    """
+    return datetime.datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+
+def clamp_start(start, end, granularity, max_points=DEFAULT_MAX_POINTS):
+    """Returns start, moved forward so the range up to end has at most max_points buckets.
+    """
+    if point_count(start, end, granularity) <= max_points:
+        return start
+    if granularity == 'month':
+        months = end.year * 12 + end.month - max_points
+        return datetime.date(months // 12, months % 12 + 1, 1)
+    days = (max_points - 1) * (7 if granularity == 'week' else 1)
+    return bucket_start(end, granularity) - datetime.timedelta(days=days)
+
+
+def stack_counts(reports):
+    """Returns the {(signature id, granularity, bucket start): count} of the given
+       (signature id, date) pairs, one pair per report.
+    """
+    counts = {}
+    for signature_id, date in reports:
+        date = to_date(date)
+        for granularity in GRANULARITIES:
+            key = (signature_id, granularity, bucket_start(date, granularity))
+            counts[key] = counts.get(key, 0) + 1
+    return counts
+
+
+def stack_series(signature_ids, start, end, granularity, chunk_size=500):
+    """Returns {signature id: [count per bucket]} for the buckets of bucket_starts(start,
+       end, granularity), with 0 for buckets without reports.
+    """
+    signature_ids = list(signature_ids)
+    starts = bucket_starts(start, end, granularity)
+    positions = dict((bucket, i) for i, bucket in enumerate(starts))
+    series = dict((signature_id, [0] * len(starts)) for signature_id in signature_ids)
+    if not starts:
+        return series
+    for i in range(0, len(signature_ids), chunk_size):
+        counts = StackCount.objects.filter(signature__in=signature_ids[i:i + chunk_size], granularity=granularity,
+                                           start__range=(starts[0], starts[-1]))
+        for signature_id, bucket, count in counts.values_list('signature', 'start', 'count'):
+            series[signature_id][positions[bucket]] = count
+    return series
@@ -0,0 +1,133 @@
+"""Spike detection on the daily report counts of stacks. Per stack a StackTrend keeps an
+exponentially weighted moving mean and variance of its counts per day, so adding the
+reports of a day takes a few arithmetic operations whatever the history of the stack:
+the importer only reads and writes the StackTrends of the stacks in a batch.
+
+The count of the last day a stack was reported is kept apart from the moving statistics
+until a report of a later day arrives, its score is the number of standard deviations it
+is above the mean of the days before. Reports of days before the last one only count
+for the report counts, they arrive when old archives are imported out of order.
+"""
+import math
+
+from django.db.models import Min
+from errorreporter.models import CrashReport, StackTrend
+from errorreporter.timeseries import to_date
+
+# weight of the latest day in the moving statistics, about the last 1 / ALPHA days count
+ALPHA = 0.2
+# after this many days without reports the statistics have decayed to nothing anyway
+MAX_QUIET_DAYS = 365
+# a day is a spike at this score and at least this many reports
+SPIKE_SCORE = 3.0
+SPIKE_MIN_COUNT = 5
+
+
+def add_day(mean, variance, count, alpha=ALPHA):
+    """Returns the moving mean and variance after a day with count reports.
+    """
+    diff = count - mean
+    increment = alpha * diff
+    return mean + increment, (1 - alpha) * (variance + diff * increment)
+
+
+def spike_score(count, mean, variance):
+    """Returns how many standard deviations count is above mean. Daily counts vary at
+       least as much as a Poisson process, so a stack with a steady history doesn't turn
+       every extra report into a spike.
+    """
+    return (count - mean) / math.sqrt(max(variance, mean, 1.0))
+
+
+def add_reports(trend, date, count):
+    """Adds count reports of date to a StackTrend.
+    """
+    if date < trend.last_date:
+        return
+    if date > trend.last_date:
+        # the last day is complete, fold it and the days without reports since into the statistics
+        mean, variance = add_day(trend.mean, trend.variance, trend.last_count)
+        quiet = (date - trend.last_date).days - 1
+        for _ in range(min(quiet, MAX_QUIET_DAYS)):
+            mean, variance = add_day(mean, variance, 0)
+        trend.mean, trend.variance = mean, variance
+        trend.days += 1 + quiet
+        trend.last_date = date
+        trend.last_count = 0
+    trend.last_count += count
+    trend.score = spike_score(trend.last_count, trend.mean, trend.variance) if trend.days else 0.0
+
+
+def day_counts(reports):
+    """Returns the {signature id: {date: count}} of the given (signature id, date) pairs,
+       one per report.
+    """
+    counts = {}
+    for signature_id, date in reports:
+        days = counts.setdefault(signature_id, {})
+        date = to_date(date)
+        days[date] = days.get(date, 0) + 1
+    return counts
+
+
+def first_versions(signature_ids, chunk_size=500):
+    """Returns the {signature id: version} of the first report of the given stacks, the
+       one imported first (lowest id). The importer, rebuild_stack_trends and the backfill
+       all take first_version from here, so they agree on it.
+    """
+    signature_ids = list(signature_ids)
+    versions = {}
+    for i in range(0, len(signature_ids), chunk_size):
+        first_ids = [r['first_id'] for r in CrashReport.objects.filter(signature__in=signature_ids[i:i + chunk_size])
+                     .values('signature').annotate(first_id=Min('id'))]
+        versions.update(CrashReport.objects.filter(id__in=first_ids).values_list('signature', 'version'))
+    return versions
+
+
+def new_trend(signature_id, date, version):
+    return StackTrend(signature_id=signature_id, first_version=version[:10], last_date=date)
+
+
+def update_trends(trends, counts, versions):
+    """Adds the {signature id: {date: count}} counts to the given {signature id: StackTrend}
+       dict, creating StackTrends for new stacks with the {signature id: version} of their
+       first reports (see first_versions). Returns the StackTrends that were created.
+    """
+    created = []
+    for signature_id, days in counts.iteritems():
+        trend = trends.get(signature_id)
+        if trend is None:
+            trend = trends[signature_id] = new_trend(signature_id, min(days), versions.get(signature_id, ""))
+            created.append(trend)
+        for date in sorted(days):
+            add_reports(trend, date, days[date])
+    return created
+
+
+def is_spike(trend):
+    return trend.score >= SPIKE_SCORE and trend.last_count >= SPIKE_MIN_COUNT
+
+
+def latest_date():
+    """Returns the last day any stack was reported, None without reports.
+    """
+    trend = StackTrend.objects.order_by('-last_date').only('last_date').first()
+    return trend.last_date if trend else None
+
+
+def trending(date, limit, min_score=SPIKE_SCORE, min_count=SPIKE_MIN_COUNT):
+    """Returns the StackTrends of the stacks that spiked on the given date, highest score first.
+    """
+    return list(StackTrend.objects.filter(last_date=date, score__gte=min_score, last_count__gte=min_count)
+                .select_related('signature').order_by('-score', 'signature')[:limit])
+
+
+def new_stacks(limit, date=None, version=None):
+    """Returns the StackTrends of the stacks first reported on date or from version, most reports first.
+    """
+    trends = StackTrend.objects.select_related('signature')
+    if date is not None:
+        trends = trends.filter(signature__first_seen=date)
+    if version is not None:
+        trends = trends.filter(first_version=version)
+    return list(trends.order_by('-signature__total_count', 'signature')[:limit])
@@ -1,6 +1,6 @@
 from django.conf.urls import patterns, url
 
-from errorreporter import views
+from errorreporter import api, views
 
 urlpatterns = patterns('',
     url(r'^$', views.index, name='index'),
@@ -10,5 +10,23 @@ urlpatterns = patterns('',
     url(r'^crashreport_daily/(?P<date>\d{4}-\d{2}-\d{2})$', views.crashreport_daily, name='crashreport_daily'),
     url(r'^crashreport_version/(?P<version>.+)$', views.crashreport_version, name='crashreport_version'),
     url(r'^stacktrace_graphs/(?P<stack_id>.+)$', views.stacktrace_graphs, name='stacktrace_graphs'),
+    url(r'^stack_graphs/(?P<stack_hash>[0-9a-f]{40})$', views.stack_graphs, name='stack_graphs'),
     url(r'^stacktrace/(?P<stack_id>.+)$', views.stacktrace, name='stacktrace'),
+    url(r'^frames$', views.frames, name='frames'),
+    url(r'^sysinfo/(?P<scope>date|version)/(?P<value>[^/]+)/(?P<key>[^/]+)$', views.sysinfo, name='sysinfo'),
+    url(r'^trending$', views.trending, name='trending'),
+    url(r'^search$', views.search, name='search'),
+    url(r'^stats$', views.stats, name='stats'),
+    url(r'^api/(?P<scope>date|version)/(?P<value>[^/]+)/reports$', api.reports, name='api_reports'),
+    url(r'^api/(?P<scope>date|version)/(?P<value>[^/]+)/stacks$', api.stacks, name='api_stacks'),
+    url(r'^api/(?P<scope>date|version)/(?P<value>[^/]+)/breakdown/(?P<key>os|machine)$', api.breakdown,
+        name='api_breakdown'),
+    url(r'^api/(?P<scope>date|version)/(?P<value>[^/]+)/breakdown/sysinfo/(?P<key>[^/]+)$', api.sysinfo,
+        name='api_sysinfo'),
+    url(r'^api/(?P<scope>date|version)/(?P<value>[^/]+)/occurrences$', api.top_occurrences, name='api_top_occurrences'),
+    url(r'^api/stack/(?P<stack_hash>[0-9a-f]{40})/occurrences$', api.occurrences, name='api_occurrences'),
+    url(r'^api/trending$', api.trend_feed, name='api_trending'),
+    url(r'^api/search$', api.search, name='api_search'),
+    url(r'^api/frames$', api.frames, name='api_frames'),
+    url(r'^api/report$', api.report, name='api_report'),
 )
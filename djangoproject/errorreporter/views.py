@@ -1,8 +1,17 @@
-from django.shortcuts import render
-from django.db.models import Count
-from errorreporter.models import CrashReport
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404
+from django.template.response import TemplateResponse
+from django.db.models import Sum
+from errorreporter.aggregation import aggregate_reports, frame_stacks, frame_summary, sysinfo_breakdown, sysinfo_keys
+from errorreporter.api import frame_filters, get_cursor, get_limit, scope_filters, scope_generations, trends
+from errorreporter.cache import GENERATION_ALL, cache_by_generation, date_generation, version_generation
+from errorreporter.models import CrashReport, ReportCount, StackSignature
+from errorreporter.search import search_stacks
+from errorreporter.stats import get_request_log
+from errorreporter.timeseries import bucket_starts, pick_granularity, stack_series
 from django.shortcuts import redirect
-import time
+import calendar
+import os
 
 
 # Create your views here.
@@ -10,133 +19,131 @@ def index(request):
     return redirect('overview_daily')
 
 
+@cache_by_generation(lambda: [GENERATION_ALL])
 def overview_crashreport_version(request):
-    crashreports = CrashReport.objects.values('version').annotate(cnt=Count('version')).order_by('-version')
+    crashreports = ReportCount.objects.values('version').annotate(cnt=Sum('count')).order_by('-version')
     context = {'crashreports': crashreports}
-    return render(request, 'errorreporter/overview_crashreport_version.html', context)
+    return TemplateResponse(request, 'errorreporter/overview_crashreport_version.html', context)
 
 
+@cache_by_generation(lambda: [GENERATION_ALL])
 def overview_crashreport_daily(request):
-    crashreports = CrashReport.objects.values('date').annotate(cnt=Count('date')).order_by('-date')
+    crashreports = ReportCount.objects.values('date').annotate(cnt=Sum('count')).order_by('-date')
     context = {'crashreports': crashreports}
-    return render(request, 'errorreporter/overview_crashreport_daily.html', context)
+    return TemplateResponse(request, 'errorreporter/overview_crashreport_daily.html', context)
 
 
+@cache_by_generation(lambda date: [date_generation(date)])
 def crashreport_daily(request, date):
-    crashreports = CrashReport.objects.filter(date=date)
-    comments = compact_comments(crashreports)
-    objects = CrashReport.objects.values('stack').filter(date=date)
-    crashreports_aggr = objects.annotate(cnt=Count('stack')).order_by('-cnt')
+    context = aggregate_reports(date=date)
+    context.update({'report_for': date,
+                    'scope': "date",
+                    'sysinfo_keys': sysinfo_keys(),
+                    'fg_prefix': "fg_d" + date})
+    return TemplateResponse(request, 'errorreporter/crashreport_aggr.html', context)
 
-    os_objects = CrashReport.objects.values('os').filter(date=date)
-    os_info = os_objects.annotate(cnt=Count('os')).order_by('os')
-    for o in os_info:
-        o['descr'] = o['os']
-
-    machine_objects = CrashReport.objects.values('machine').filter(date=date)
-    machine_info = machine_objects.annotate(cnt=Count('machine')).order_by('machine')
-    for m in machine_info:
-        m['descr'] = m['machine']
-
-    for c in crashreports_aggr:
-        tmp = CrashReport.objects.filter(stack=c['stack']).first()
-        c['id'] = tmp.id
-        c['comments'] = comments[c['stack']]
 
-    context = {'crashreports': crashreports,
-               'crashreports_aggr': crashreports_aggr,
-               'report_for': date,
-               'fg_prefix': "fg_d" + date,
-               'os_info': os_info,
-               'machine_info': machine_info}
-    return render(request, 'errorreporter/crashreport_aggr.html', context)
+@cache_by_generation(lambda version: [version_generation(version)])
+def crashreport_version(request, version):
+    formattedversion = version.replace(".", "_")
 
+    context = aggregate_reports(version=version)
+    context.update({'report_for': version,
+                    'scope': "version",
+                    'sysinfo_keys': sysinfo_keys(),
+                    'fg_prefix': "fg_v" + formattedversion})
+    return TemplateResponse(request, 'errorreporter/crashreport_aggr.html', context)
 
-def crashreport_version(request, version):
-    crashreports = CrashReport.objects.filter(version=version)
-    comments = compact_comments(crashreports)
-    objects = CrashReport.objects.values('stack').filter(version=version)
-    crashreports_aggr = objects.annotate(cnt=Count('stack')).order_by('-cnt')
 
-    os_objects = CrashReport.objects.values('os').filter(version=version)
-    os_info = os_objects.annotate(cnt=Count('os')).order_by('os')
-    for o in os_info:
-        o['descr'] = o['os']
+@cache_by_generation(scope_generations)
+def sysinfo(request, scope, value, key):
+    context = {'sysinfo': sysinfo_breakdown(key, **scope_filters(scope, value)),
+               'key': key}
+    return TemplateResponse(request, 'errorreporter/sysinfo_breakdown.html', context)
 
-    machine_objects = CrashReport.objects.values('machine').filter(version=version)
-    machine_info = machine_objects.annotate(cnt=Count('machine')).order_by('machine')
-    for m in machine_info:
-        m['descr'] = m['machine']
 
-    # add some extra info to the aggregate reports
-    for c in crashreports_aggr:
-        tmp = CrashReport.objects.filter(stack=c['stack']).first()
-        c['id'] = tmp.id
-        c['comments'] = comments[c['stack']]
+def stacktrace_graphs(request, stack_id):
+    objects = CrashReport.objects.filter(id=stack_id)
+    stack = objects.values('signature').first()
+    return render_stacktrace_graphs(request, stack['signature'] if stack else None)
 
-    formattedversion = version.replace(".", "_")
 
-    context = {'crashreports': crashreports,
-               'crashreports_aggr': crashreports_aggr,
-               'report_for': version,
-               'fg_prefix': "fg_v" + formattedversion,
-               'os_info': os_info,
-               'machine_info': machine_info}
-    return render(request, 'errorreporter/crashreport_aggr.html', context)
+def stack_graphs(request, stack_hash):
+    signature = StackSignature.objects.filter(stack_hash=stack_hash).values('id').first()
+    return render_stacktrace_graphs(request, signature['id'] if signature else None)
 
 
-def stacktrace_graphs(request, stack_id):
-    objects = CrashReport.objects.filter(id=stack_id)
-    stack = objects.first()
+def render_stacktrace_graphs(request, signature_id):
+    signature = StackSignature.objects.filter(id=signature_id).only('id', 'first_seen', 'last_seen').first() \
+        if signature_id else None
+    if signature is None:
+        raise Http404
 
-    if stack:
-        objects = CrashReport.objects.values('date').filter(stack=stack.stack)
-        occurrences = objects.annotate(cnt=Count('date')).order_by('date')
-        os_objects = CrashReport.objects.values('os').filter(stack=stack.stack)
-        os_info = os_objects.annotate(cnt=Count('os')).order_by('os')
-        for o in os_info:
-            o['descr'] = o['os']
-        machine_objects = CrashReport.objects.values('machine').filter(stack=stack.stack)
-        machine_info = machine_objects.annotate(cnt=Count('machine')).order_by('machine')
-        for m in machine_info:
-            m['descr'] = m['machine']
-    else:
-        occurrences = None
-        os_info = None
-
-    total = 0
-    for o in occurrences:
-        dtt = o['date'].timetuple()
-        ts = time.mktime(dtt)
-        o['ts'] = int(ts) * 1000
-        total = total + o['cnt']
+    # at most DEFAULT_MAX_POINTS bars, per week or month for long-lived stacks
+    granularity = pick_granularity(signature.first_seen, signature.last_seen)
+    starts = bucket_starts(signature.first_seen, signature.last_seen, granularity)
+    counts = stack_series([signature.id], signature.first_seen, signature.last_seen, granularity)[signature.id]
+    occurrences = [{'ts': calendar.timegm(start.timetuple()) * 1000, 'cnt': cnt}
+                   for start, cnt in zip(starts, counts) if cnt]
+    os_objects = ReportCount.objects.values('os').filter(signature=signature_id)
+    os_info = os_objects.annotate(cnt=Sum('count')).order_by('os')
+    for o in os_info:
+        o['descr'] = o['os']
+    machine_objects = ReportCount.objects.values('machine').filter(signature=signature_id)
+    machine_info = machine_objects.annotate(cnt=Sum('count')).order_by('machine')
+    for m in machine_info:
+        m['descr'] = m['machine']
 
     context = {
                'occurrences': occurrences,
-               'total': total,
+               'granularity': granularity,
+               'bar_width': {'day': 1, 'week': 7, 'month': 28}[granularity] * 24 * 60 * 60 * 1000,
+               'total': sum(counts),
                'os_info': os_info,
                'machine_info': machine_info
                }
-    return render(request, 'errorreporter/stacktrace_graphs.html', context)
+    return TemplateResponse(request, 'errorreporter/stacktrace_graphs.html', context)
 
 
 def stacktrace(request, stack_id):
     objects = CrashReport.objects.filter(id=stack_id)
     stack = objects.first()
     context = {'c': stack}
-    return render(request, 'errorreporter/stacktrace.html', context)
+    return TemplateResponse(request, 'errorreporter/stacktrace.html', context)
 
 
-def compact_comments(objects):
-    """
-    Collect the comments for each stack trace in a more compact fashion, i.e.:
-    Stack1 - comment1 - [id1,id2,...]. This is to prevent hundreds of lines with 'Not provided' in the reports.
+@cache_by_generation(lambda: [GENERATION_ALL])
+def frames(request):
+    context = {'file': request.GET.get('file', ""),
+               'function': request.GET.get('function', "")}
+    if context['file'] or context['function']:
+        filters = frame_filters(request)
+        stacks, next_cursor = frame_stacks(filters, get_cursor(request), get_limit(request))
+        context.update(frame_summary(**filters))
+        context.update({'crashreports': stacks,
+                        'next': "%d:%d" % next_cursor if next_cursor else None})
+    return TemplateResponse(request, 'errorreporter/frames.html', context)
+
+
+@cache_by_generation(lambda: [GENERATION_ALL])
+def trending(request):
+    return TemplateResponse(request, 'errorreporter/trending.html', trends(request))
+
+
+@cache_by_generation(lambda: [GENERATION_ALL])
+def search(request):
+    query = request.GET.get('q', "")
+    context = {'q': query,
+               'crashreports': search_stacks(query, get_limit(request)) if query else None}
+    return TemplateResponse(request, 'errorreporter/search.html', context)
+
+
+@staff_member_required
+def stats(request):
+    """Percentiles of the timings RequestStatsMiddleware recorded in this process.
     """
-    comments = {}
-    for o in objects:
-        if not o.stack in comments.keys():
-            comments[o.stack] = {}
-        if not o.comments in comments[o.stack].keys():
-            comments[o.stack][o.comments] = []
-        comments[o.stack][o.comments].append(o.id)
-    return comments
+    log = get_request_log()
+    context = {'views': log.summary(),
+               'requests': len(log.entries()),
+               'pid': os.getpid()}
+    return TemplateResponse(request, 'errorreporter/stats.html', context)
@@ -10,4 +10,4 @@ rsync -rcnC --out-format="%f" all/ parsed/ --dry-run | xargs cp -t .
 cd /var/www/errorreporter/errorreporter/djangoproject
 
 . /var/www/errorreporter/env/bin/activate
-python manage.py import_reports --input-dir=/var/www/errorreporter/collected/ --output-dir=/var/www/public_html/static/errorreporter/errorreporter/flamegraphs/
+python manage.py import_reports --bulk --input-dir=/var/www/errorreporter/collected/ --output-dir=/var/www/public_html/static/errorreporter/errorreporter/flamegraphs/
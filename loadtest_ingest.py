@@ -0,0 +1,86 @@
+#!/usr/bin/env python
+"""
+Posts synthetic crash reports to the errorreporter ingest endpoint from a number of
+threads for a fixed time and prints the sustained requests per second and latencies.
+Reports are posted without a timestamp, so the server stamps them on arrival, unless
+--client-timestamps is given.
+
+    python manage.py runserver 8000 &
+    python loadtest_ingest.py --url=http://localhost:8000/errorreporter/api/report --threads=8 --duration=30
+"""
+import itertools
+import random
+import threading
+import time
+import urllib
+import urllib2
+from optparse import OptionParser
+
+SYSINFO = "platform.details\tLinux-3.13.0-24-generic-x86_64-with-Ubuntu-14.04-trusty\nplatform.machine\tx86_64\n"
+
+
+def make_stacks(count):
+    stacks = []
+    for i in range(count):
+        frames = "".join('  File "Tribler/Core/module%d.py", line %d, in function%d\n    call()\n' % (j, i + j, j)
+                         for j in range(10))
+        stacks.append("Tribler version: 6.4.%d\nTraceback (most recent call last):\n%sValueError: %d\n"
+                      % (i % 4, frames, i))
+    return stacks
+
+
+def worker(url, stacks, timestamps, deadline, results, lock):
+    latencies = []
+    errors = 0
+    while time.time() < deadline:
+        fields = {'stack': random.choice(stacks), 'sysinfo': SYSINFO, 'comments': 'Not provided'}
+        if timestamps is not None:
+            fields['timestamp'] = "%.2f" % (next(timestamps) / 100.0)
+        data = urllib.urlencode(fields)
+        start = time.time()
+        try:
+            urllib2.urlopen(url, data).read()
+        except urllib2.URLError:
+            errors += 1
+            continue
+        latencies.append(time.time() - start)
+    with lock:
+        results['latencies'].extend(latencies)
+        results['errors'] += errors
+
+
+def main():
+    parser = OptionParser()
+    parser.add_option('--url', default='http://localhost:8000/errorreporter/api/report')
+    parser.add_option('--threads', type='int', default=8)
+    parser.add_option('--duration', type='float', default=30, help='seconds')
+    parser.add_option('--stacks', type='int', default=200, help='number of distinct stacks')
+    parser.add_option('--client-timestamps', action='store_true', default=False,
+                      help='post a timestamp with each report instead of using the time of arrival')
+    options, _ = parser.parse_args()
+
+    stacks = make_stacks(options.stacks)
+    results = {'latencies': [], 'errors': 0}
+    lock = threading.Lock()
+    deadline = time.time() + options.duration
+    # timestamps identify reports and archived ones are stored with 1/100 s precision, keep them unique
+    timestamps = itertools.count(int(time.time() * 100)) if options.client_timestamps else None
+    threads = [threading.Thread(target=worker, args=(options.url, stacks, timestamps, deadline, results, lock))
+               for _ in range(options.threads)]
+    start = time.time()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(results['latencies'])
+    print "%d reports in %.1fs: %.0f requests/s, %d errors" % \
+        (len(latencies), elapsed, len(latencies) / elapsed, results['errors'])
+    if latencies:
+        for p in (50, 90, 99):
+            print "p%d latency: %.1f ms" % (p, latencies[min(len(latencies) - 1, len(latencies) * p / 100)] * 1000)
+
+
+if __name__ == '__main__':
+    main()